@@ -0,0 +1,265 @@
+"""
+A local stand-in for the Azure OpenAI chat-completions endpoint and the ProductAI chat endpoint.
+It answers with deterministic canned outputs in the shapes the pipeline parses, after a configurable latency,
+and rejects a configurable share of the requests with 429 or 500, so the generators, the evaluator and the
+prompter can be benchmarked and tested without the production services.
+
+Run it standalone with:
+    python benchmarks/fake_server.py --port 8000 --latency lognormal --latency-mean 0.5 --rate-429 0.05
+and point the clients at it with LLMClient(api_key, base_url="http://127.0.0.1:8000") and
+ProductAIPrompter(cookie, url="http://127.0.0.1:8000/chat").
+"""
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class LatencyDistribution:
+    """The distribution the latency of each request is drawn from.
+
+    Attributes:
+        kind (str): "constant", "uniform", "exponential" or "lognormal".
+        mean (float): The mean latency in seconds.
+        spread (float): The half width for "uniform", the sigma of the underlying normal distribution for "lognormal".
+    """
+
+    KINDS = ("constant", "uniform", "exponential", "lognormal")
+
+    def __init__(self, kind="constant", mean=0.0, spread=0.5):
+        if kind not in LatencyDistribution.KINDS:
+            raise ValueError(f"Unknown latency distribution {kind}, use one of {LatencyDistribution.KINDS}")
+        self.kind = kind
+        self.mean = mean
+        self.spread = spread
+
+    def sample(self, rng):
+        if self.mean <= 0:
+            return 0.0
+        if self.kind == "uniform":
+            return max(0.0, rng.uniform(self.mean - self.spread, self.mean + self.spread))
+        if self.kind == "exponential":
+            return rng.expovariate(1 / self.mean)
+        if self.kind == "lognormal":
+            # choose mu so that the mean of the distribution is self.mean
+            return rng.lognormvariate(math.log(self.mean) - self.spread ** 2 / 2, self.spread)
+        return self.mean
+
+
+class FakeLLMServer:
+    """A threaded HTTP server speaking the chat-completions and the ProductAI /chat shapes.
+
+    The answers only depend on the request, so repeated runs produce identical results:
+        - QA generation: a list with the requested number of question-answer pairs.
+        - Evaluation: a score from 1 to 5 and a reasoning.
+        - Batched evaluation: one result per item of the batch.
+        - ProductAI: an HTML answer to the question.
+
+    Attributes:
+        latency (dict): The LatencyDistribution of the "chat_completions" and the "productai" route.
+        error_rates (dict): The share of requests answered with each status code, e.g. {429: 0.05, 500: 0.01}.
+        retry_after (float): The seconds sent in the retry-after-ms and Retry-After headers of rejected requests.
+        counts (dict): The number of answered requests per route and status code.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=None, productai_latency=None, error_rates=None,
+                 retry_after=0.1, seed=0):
+        """
+        Args:
+            host (str, optional): The host to listen on. Defaults to "127.0.0.1".
+            port (int, optional): The port to listen on, 0 for a free port. Defaults to 0.
+            latency (LatencyDistribution, optional): The latency of the chat completions. Defaults to no latency.
+            productai_latency (LatencyDistribution, optional): The latency of ProductAI. Defaults to the latency of the chat completions.
+            error_rates (dict, optional): The share of requests answered with each status code. Defaults to no errors.
+            retry_after (float, optional): The seconds sent in the retry-after-ms and Retry-After headers of rejected requests. Defaults to 0.1.
+            seed (int, optional): The seed of the latencies and the injected errors. Defaults to 0.
+        """
+        latency = latency or LatencyDistribution()
+        self.latency = {"chat_completions": latency, "productai": productai_latency or latency}
+        self.error_rates = error_rates or {}
+        self.retry_after = retry_after
+        self.counts = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def productai_url(self):
+        return self.base_url + "/chat"
+
+    def start(self):
+        """Starts serving in a background thread and returns the server."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _draw(self, route):
+        """Draws the latency and the status code of a request."""
+        with self._lock:
+            latency = self.latency[route].sample(self._rng)
+            draw = self._rng.random()
+        status = 200
+        for error_status, rate in sorted(self.error_rates.items()):
+            if draw < rate:
+                status = error_status
+                break
+            draw -= rate
+        return latency, status
+
+    def _count(self, route, status):
+        with self._lock:
+            self.counts.setdefault(route, {})
+            self.counts[route][status] = self.counts[route].get(status, 0) + 1
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                route = "productai" if self.path.split("?")[0].rstrip("/").endswith("/chat") else "chat_completions"
+                latency, status = server._draw(route)
+                time.sleep(latency)
+                server._count(route, status)
+                if status != 200:
+                    # Azure OpenAI sends the delay in milliseconds as well, which is preferred by the clients
+                    headers = {"retry-after-ms": str(int(server.retry_after * 1000)), "Retry-After": str(server.retry_after)} if status == 429 else {}
+                    self._send_json(status, {"error": {"code": str(status), "message": "Injected error of the fake server."}}, headers)
+                elif route == "productai":
+                    self._send_json(200, fake_productai_answer(body))
+                else:
+                    self._send_json(200, fake_chat_completion(body))
+
+            def _send_json(self, status, data, headers=None):
+                content = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
+
+
+def _stable_int(text, modulo):
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16) % modulo
+
+
+def _message_texts(body):
+    """The texts of all messages of a chat-completion payload."""
+    texts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        else:
+            texts.extend(part.get("text", "") for part in content or [])
+    return texts
+
+
+def fake_chat_completion(body):
+    """Builds a deterministic chat-completion response for a payload of the QA generation or the evaluation.
+
+    Args:
+        body (dict): The chat-completion payload.
+
+    Returns:
+        dict: The response with one choice and the token usage.
+    """
+    text = "\n".join(_message_texts(body))
+    if "exactly one entry per item" in text:
+        item_ids = sorted(set(int(item_id) for item_id in re.findall(r"Item (\d+):", text)))
+        content = str([{"id": item_id, "score": str(1 + _stable_int(f"{text}{item_id}", 5)), "reasoning": f"Canned reasoning for item {item_id}."}
+                       for item_id in item_ids])
+    elif '"score"' in text:
+        content = str({"score": str(1 + _stable_int(text, 5)), "reasoning": "Canned reasoning of the fake server."})
+    else:
+        match = re.search(r"generate (\d+) different questions", text)
+        number_questions = int(match.group(1)) if match else 1
+        digest = _stable_int(text, 10 ** 6)
+        content = str([{"question": f"Canned question {digest}-{i}?", "answer": f"Canned answer {digest}-{i}."}
+                       for i in range(number_questions)])
+    prompt_tokens = len(text) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"fake-{_stable_int(text, 10 ** 9)}",
+        "object": "chat.completion",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens, "prompt_tokens_details": {"cached_tokens": 0}}
+    }
+
+
+def fake_productai_answer(body):
+    """Builds a deterministic ProductAI response for a question.
+
+    Args:
+        body (dict): The ProductAI payload with the 'message'.
+
+    Returns:
+        dict: The response with the HTML answer.
+    """
+    question = body.get("message", "")
+    return {"message": {"html_answer": f"<p>Canned answer {_stable_int(question, 10 ** 6)} to: {question}</p>"}}
+
+
+def parse_error_rates(rate_429, rate_500):
+    return {status: rate for status, rate in ((429, rate_429), (500, rate_500)) if rate > 0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for Azure OpenAI chat completions and ProductAI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="constant", choices=LatencyDistribution.KINDS)
+    parser.add_argument("--latency-mean", type=float, default=0.0, help="mean latency of the chat completions in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--productai-latency-mean", type=float, default=None, help="mean latency of ProductAI in seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    productai_latency = None
+    if args.productai_latency_mean is not None:
+        productai_latency = LatencyDistribution(args.latency, args.productai_latency_mean, args.latency_spread)
+    fake_server = FakeLLMServer(args.host, args.port, LatencyDistribution(args.latency, args.latency_mean, args.latency_spread),
+                                productai_latency, parse_error_rates(args.rate_429, args.rate_500), args.retry_after, args.seed)
+    print(f"Serving chat completions at {fake_server.base_url} and ProductAI at {fake_server.productai_url}")
+    fake_server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake_server.stop()
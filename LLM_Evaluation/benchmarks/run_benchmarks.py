@@ -0,0 +1,208 @@
+"""
+Throughput benchmarks of the pipeline stages against the local fake server.
+Each benchmark sends the same work through the existing classes and reports the items per second, so the effect of
+a change to the transport, the concurrency or the batching can be measured instead of guessed.
+
+Run it from the LLM_Evaluation folder with:
+    python benchmarks/run_benchmarks.py --latency-mean 0.2 --rate-429 0.02 --workers 8 --output benchmark_results.csv
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import logging as log
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_server import FakeLLMServer, LatencyDistribution, parse_error_rates
+from objects.llm_client import LLMClient
+from objects.rate_limiter import RateLimiter
+from objects.qa_pair_generator import QAPairGenerator
+from objects.product_ai_prompter import ProductAIPrompter
+from objects.evaluator import Evaluator
+from objects.pipeline_runner import PipelineRunner
+from objects.chunk_objects.corpus_ingestion import find_document_paths
+
+MODEL = "fake-deployment"
+API_KEY = "fake-api-key"
+COOKIE = "fake-cookie"
+
+WORDS = ["membrane", "filter", "extractables", "validation", "polyethersulfone", "sterile", "buffer", "pressure",
+         "temperature", "leachables", "guide", "study", "solvent", "sample", "result", "the", "and", "of", "with"]
+
+
+def make_documents(folder, number_documents=10, sections_per_document=12, seed=0):
+    """Writes synthetic markdown documents with headings and page markers, for benchmarks without the document twins.
+
+    Args:
+        folder (str): The folder to write the documents to.
+        number_documents (int, optional): The number of documents. Defaults to 10.
+        sections_per_document (int, optional): The number of level-2 sections of each document. Defaults to 12.
+        seed (int, optional): The seed of the random text. Defaults to 0.
+
+    Returns:
+        list: The paths of the documents.
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(number_documents):
+        lines = [f"# Validation Guide {i}", ""]
+        page = 1
+        for section in range(sections_per_document):
+            lines += [f"## {section + 1} {rng.choice(WORDS).title()} {rng.choice(WORDS)}", ""]
+            for _ in range(rng.randint(3, 8)):
+                lines += [" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) + ".", ""]
+            if rng.random() < 0.5:
+                page += 1
+                lines += [f"[PAGE {page}]", ""]
+        path = os.path.join(folder, f"benchmark_document_{i}.md")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines))
+        paths.append(path)
+    return paths
+
+
+def measure(name, function):
+    """Runs a benchmark and returns its result.
+
+    Args:
+        name (str): The name of the benchmark.
+        function (callable): Runs the benchmark and returns the number of processed items.
+
+    Returns:
+        dict: The name, the number of items, the seconds and the items per second.
+    """
+    start = time.time()
+    items = function()
+    seconds = time.time() - start
+    print(f"{name}: {items} items in {seconds:.2f} s")
+    return {"benchmark": name, "items": items, "seconds": seconds, "items_per_second": items / seconds if seconds > 0 else float("nan")}
+
+
+def run_benchmarks(base_url, productai_url, document_paths, number_questions=2, workers=8, batch_size=10, retry_base_delay=0.1):
+    """Runs the benchmarks of each stage, serial and concurrent, and of the full streaming pipeline.
+
+    Args:
+        base_url (str): The base URL of the chat completions, e.g. of the fake server.
+        productai_url (str): The URL of the ProductAI chat endpoint.
+        document_paths (list): The documents to generate the questions from.
+        number_questions (int, optional): Number of questions per chunk. Defaults to 2.
+        workers (int, optional): The number of concurrent requests of the concurrent benchmarks. Defaults to 8.
+        batch_size (int, optional): The number of rows per request of the batched evaluation. Defaults to 10.
+        retry_base_delay (float, optional): The back-off in seconds after the first injected error without Retry-After header,
+            so the default back-off of seconds does not dominate the measured throughput. Defaults to 0.1.
+
+    Returns:
+        pandas.DataFrame: One row per benchmark.
+    """
+    # retry the injected server errors as well, so every item completes
+    client = LLMClient(API_KEY, base_url=base_url, pool_maxsize=2 * workers, retry_statuses=(429, 500),
+                       rate_limiter=RateLimiter(base_delay=retry_base_delay, max_delay=10 * retry_base_delay))
+    productai_client = LLMClient(pool_maxsize=workers, rate_limiter=RateLimiter(base_delay=retry_base_delay, max_delay=10 * retry_base_delay))
+    prompter = ProductAIPrompter(COOKIE, client=productai_client, url=productai_url)
+    results = []
+    qa_pairs = []
+
+    def generate_serial():
+        qa_pairs.clear()
+        for path in document_paths:
+            qa_pairs.extend(QAPairGenerator(path, MODEL, API_KEY, client=client).generate_qa_pairs(number_questions))
+        return len(qa_pairs)
+
+    def generate_async():
+        generated = 0
+        for path in document_paths:
+            generator = QAPairGenerator(path, MODEL, API_KEY, client=client)
+            generated += len(asyncio.run(generator.generate_qa_pairs_async(number_questions, max_concurrency=workers)))
+        return generated
+
+    results.append(measure("generation_serial", generate_serial))
+    results.append(measure("generation_async", generate_async))
+
+    questions = [qa_pair["question"] for qa_pair in qa_pairs]
+    answers = {}
+
+    def prompt_serial():
+        for question in questions:
+            answers[question] = prompter.prompt_productai(question)[0]
+        return len(questions)
+
+    def prompt_threads():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return len(list(executor.map(prompter.prompt_productai, questions)))
+
+    results.append(measure("productai_serial", prompt_serial))
+    results.append(measure("productai_threads", prompt_threads))
+
+    rows = [(qa_pair["question"], qa_pair["answer"], answers[qa_pair["question"]]) for qa_pair in qa_pairs]
+
+    def evaluate_serial():
+        for row in rows:
+            Evaluator(*row, MODEL, API_KEY, client=client).evaluate_correctness()
+        return len(rows)
+
+    def evaluate_threads():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return len(list(executor.map(lambda row: Evaluator(*row, MODEL, API_KEY, client=client).evaluate_correctness(), rows)))
+
+    def evaluate_batched():
+        return len(Evaluator.evaluate_correctness_batch(rows, MODEL, API_KEY, batch_size=batch_size, client=client))
+
+    results.append(measure("evaluation_serial", evaluate_serial))
+    results.append(measure("evaluation_threads", evaluate_threads))
+    results.append(measure(f"evaluation_batched_{batch_size}", evaluate_batched))
+
+    def run_pipeline():
+        runner = PipelineRunner(document_paths, MODEL, API_KEY, COOKIE, number_questions=number_questions,
+                                generation_workers=workers, productai_workers=workers, evaluation_workers=workers,
+                                client=client, prompter=prompter)
+        return sum(1 for row in runner.run() if row.get("error") is None)
+
+    results.append(measure("pipeline_streaming", run_pipeline))
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput benchmarks of the pipeline stages against the local fake server.")
+    parser.add_argument("--documents", default=None, help="folder with document twins, defaults to synthetic documents")
+    parser.add_argument("--number-documents", type=int, default=5, help="number of synthetic documents")
+    parser.add_argument("--number-questions", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--latency", default="lognormal", choices=LatencyDistribution.KINDS)
+    parser.add_argument("--latency-mean", type=float, default=0.2, help="mean latency of the chat completions in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--productai-latency-mean", type=float, default=None, help="mean latency of ProductAI in seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.1, help="seconds the fake server asks to wait after a 429")
+    parser.add_argument("--retry-base-delay", type=float, default=0.1, help="back-off in seconds after an error without Retry-After")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="csv file to save the results to")
+    args = parser.parse_args()
+    log.disable(log.WARNING)
+
+    if args.documents:
+        document_paths = find_document_paths(args.documents)
+    else:
+        document_paths = make_documents(tempfile.mkdtemp(prefix="benchmark_documents_"), args.number_documents, seed=args.seed)
+
+    latency = LatencyDistribution(args.latency, args.latency_mean, args.latency_spread)
+    productai_latency = None
+    if args.productai_latency_mean is not None:
+        productai_latency = LatencyDistribution(args.latency, args.productai_latency_mean, args.latency_spread)
+    with FakeLLMServer(latency=latency, productai_latency=productai_latency,
+                       error_rates=parse_error_rates(args.rate_429, args.rate_500), retry_after=args.retry_after,
+                       seed=args.seed) as fake_server:
+        results = run_benchmarks(fake_server.base_url, fake_server.productai_url, document_paths,
+                                 args.number_questions, args.workers, args.batch_size, args.retry_base_delay)
+        print("Requests answered by the fake server:", fake_server.counts)
+
+    print(results.to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
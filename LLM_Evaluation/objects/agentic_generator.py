@@ -1,8 +1,7 @@
 from autogen import ConversableAgent
 import ast
-import requests
 import json
-import time
+from objects.llm_client import LLMClient
 
 class SimpleGenerator:
     """A class to generate question-answer pairs using a specified model and API key.
@@ -13,16 +12,19 @@ class SimpleGenerator:
         number_questions (int): The number of questions to generate.
         format (str): The format the generator should return the question-answer pairs in.
         instruction (str): The instruction for generating questions and answers.
+        client (LLMClient): The client used to send the requests.
     """
-    def __init__(self, model, api_key, number_questions=2):
+    def __init__(self, model, api_key, number_questions=2, client=None):
         """
         Args:
             model (str): The model to be used for generating questions and answers.
             api_key (str): The API key for authentication.
             number_questions (int, optional): The number of questions to generate. Defaults to 2.
+            client (LLMClient, optional): A shared client to send the requests with. Defaults to the shared client of the api_key, see LLMClient.shared.
         """
         self.model = model
         self.api_key = api_key
+        self.client = client or LLMClient.shared(api_key)
         self.number_questions = number_questions
         self.format = "{'question': 'the question', 'answer': 'the answer'}, "
         self.instruction = f"""
@@ -44,6 +46,23 @@ class SimpleGenerator:
         Your answer is always of exactly the format: "[{self.format * self.number_questions}]"
         """
     
+    def build_payload(self, context):
+        """Builds the chat-completion payload for the given context.
+
+        Args:
+            context (str): The text extract from which to generate questions and answers.
+
+        Returns:
+            dict: The payload with the messages and sampling parameters.
+        """
+        return {
+            "messages": [
+                {"role": "system", "content": [{"type": "text", "text": "Here is the text:\n" + context}]},
+                {"role": "user", "content": [{"type": "text", "text": self.instruction}]}
+            ],
+            "temperature": 0.7, "top_p": 0.95, "max_tokens": 4096
+        }
+
     def generate_question_answer_pair(self, context):
         """Generates question-answer pairs from the given context.
 
@@ -57,32 +76,8 @@ class SimpleGenerator:
             KeyError: If the 'choices' key is missing or empty in the response.
             HTTPError: If the request to the API fails.
         """
-        headers = {"Content-Type": "application/json", 
-                   "api-key": self.api_key}
-        payload = {
-            "messages": [
-                {"role": "system", "content": [{"type": "text", "text": "Here is the text:\n" + context}]},
-                {"role": "user", "content": [{"type": "text", "text": self.instruction}]}
-            ],
-            "temperature": 0.7, "top_p": 0.95, "max_tokens": 4096
-        }
-        GPT4V_ENDPOINT = f"https://appprodsagopenaigpt4weu.openai.azure.com/openai/deployments/{self.model}/chat/completions?api-version=2024-02-15-preview"
-        
-        # Implemented to handle rate limiting by waiting before retrying and catching HTTP errors.
-        while True:
-            response = requests.post(GPT4V_ENDPOINT, headers=headers, json=payload)
-            if response.status_code == 200:
-                response_json = response.json()
-                if "choices" in response_json and len(response_json["choices"]) > 0:
-                    qa_pair = response_json["choices"][0]["message"]["content"]
-                    return ast.literal_eval(qa_pair)
-                else:
-                    raise KeyError("The 'choices' key is missing or empty in the response.")
-            elif response.status_code == 429:
-                print("HTTP Error:", response.status_code, "\nRetrying in 60 seconds")
-                time.sleep(60)
-            else:
-                response.raise_for_status()
+        qa_pair = self.client.chat_completion(self.model, self.build_payload(context), validate=ast.literal_eval)
+        return ast.literal_eval(qa_pair)
 
 
 class AgenticGenerator:
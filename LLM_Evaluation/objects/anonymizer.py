@@ -0,0 +1,166 @@
+"""
+Functions to anonymize columns of result parquets. The files are streamed row group by row group with pyarrow, so a
+file never has to fit into memory, and the row groups are hashed in a process pool. Each distinct value of a row group
+is hashed once, and repeated values across row groups are taken from a cache, as questions and answers repeat across runs.
+
+The values are replaced by their SHA-256 hex digest, as in the anonymization notebook, or by their HMAC-SHA256 with a
+secret key, so the hashes of short or guessable values cannot be reversed by hashing candidates.
+"""
+import os
+import hmac
+import hashlib
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+DEFAULT_COLUMNS = ['question', 'answer', 'productai_response', 'evaluation_reasoning']
+
+
+@lru_cache(maxsize=1 << 18)
+def hash_value(value, key=None):
+    """Hashes a string with SHA-256, or with HMAC-SHA256 if a key is given.
+
+    Args:
+        value (str): The value to hash.
+        key (bytes, optional): The secret key of the HMAC. Defaults to None.
+
+    Returns:
+        str: The hex digest.
+    """
+    if key is None:
+        return hashlib.sha256(value.encode()).hexdigest()
+    return hmac.new(key, value.encode(), hashlib.sha256).hexdigest()
+
+
+def anonymize_array(array, key=None):
+    """Hashes each distinct value of a string column once and keeps the missing values.
+
+    Args:
+        array (pyarrow.Array or pyarrow.ChunkedArray): The string column.
+        key (bytes, optional): The secret key of the HMAC. Defaults to None.
+
+    Returns:
+        pyarrow.Array: The hex digests, with the type of the column. A column of only missing values is returned as it is.
+    """
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    # a column without any value, e.g. the reasoning of a run whose evaluations all failed, has the null type
+    if pa.types.is_null(array.type):
+        return array
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    encoded = pc.dictionary_encode(array)
+    hashed_dictionary = pa.array([None if value is None else hash_value(value, key) for value in encoded.dictionary.to_pylist()], type=array.type)
+    return pc.take(hashed_dictionary, encoded.indices)
+
+
+def anonymize_table(table, columns=DEFAULT_COLUMNS, key=None):
+    """Hashes the given columns of a table. Columns that are not in the table are skipped.
+
+    Args:
+        table (pyarrow.Table): The table, e.g. a row group.
+        columns (list, optional): The columns to hash. Defaults to DEFAULT_COLUMNS.
+        key (bytes, optional): The secret key of the HMAC. Defaults to None.
+
+    Returns:
+        pyarrow.Table: The table with the hashed columns.
+    """
+    for column in columns:
+        index = table.schema.get_field_index(column)
+        if index >= 0:
+            table = table.set_column(index, table.schema.field(index), anonymize_array(table.column(index), key))
+    return table
+
+
+def _anonymize_row_group(path, row_group, columns, key):
+    """Reads and anonymizes one row group, in a worker process."""
+    return anonymize_table(pq.ParquetFile(path).read_row_group(row_group), columns, key)
+
+
+def anonymize_file(source_path, destination_path, columns=DEFAULT_COLUMNS, key=None, max_workers=None, max_in_flight=None):
+    """Anonymizes a parquet file row group by row group and writes each row group as soon as it is hashed.
+
+    Args:
+        source_path (str): The parquet file to anonymize.
+        destination_path (str): The path of the anonymized parquet file. It must differ from the source path.
+        columns (list, optional): The string columns to hash. Defaults to DEFAULT_COLUMNS.
+        key (str or bytes, optional): The secret key of the HMAC, None for plain SHA-256. Defaults to None.
+        max_workers (int, optional): The number of processes hashing row groups. Defaults to the number of CPUs.
+            With 1, the row groups are hashed in this process.
+        max_in_flight (int, optional): The maximum number of row groups read but not yet written. Defaults to twice the number of processes.
+
+    Returns:
+        int: The number of written rows.
+    """
+    if os.path.abspath(source_path) == os.path.abspath(destination_path):
+        raise ValueError("The anonymized file must not overwrite the source file while it is read.")
+    if isinstance(key, str):
+        key = key.encode()
+    parquet_file = pq.ParquetFile(source_path)
+    # the hashed columns keep their string type, but not a dictionary type
+    schema = parquet_file.schema_arrow
+    for column in columns:
+        index = schema.get_field_index(column)
+        if index >= 0 and pa.types.is_dictionary(schema.field(index).type):
+            schema = schema.set(index, schema.field(index).with_type(schema.field(index).type.value_type))
+
+    if os.path.dirname(destination_path):
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    number_rows = 0
+    max_workers = max_workers or os.cpu_count() or 1
+    with pq.ParquetWriter(destination_path, schema) as writer:
+        if max_workers == 1:
+            for row_group in range(parquet_file.num_row_groups):
+                table = anonymize_table(parquet_file.read_row_group(row_group), columns, key)
+                writer.write_table(table)
+                number_rows += table.num_rows
+            return number_rows
+
+        max_in_flight = max_in_flight or 2 * max_workers
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # the row groups are written in order, so only a bounded number of them is submitted ahead
+            in_flight = deque()
+            for row_group in range(parquet_file.num_row_groups):
+                in_flight.append(executor.submit(_anonymize_row_group, source_path, row_group, columns, key))
+                if len(in_flight) >= max_in_flight:
+                    table = in_flight.popleft().result()
+                    writer.write_table(table)
+                    number_rows += table.num_rows
+            while in_flight:
+                table = in_flight.popleft().result()
+                writer.write_table(table)
+                number_rows += table.num_rows
+    return number_rows
+
+
+def anonymize_folder(folder, destination_folder=None, columns=DEFAULT_COLUMNS, key=None, prefix="curated_results",
+                     output_prefix="complete_anonymized_results", max_workers=None):
+    """Anonymizes all parquets of a folder whose name starts with the prefix, like the anonymization notebook.
+    The output file name replaces the prefix by the output prefix, e.g. "curated_results_2024.parquet" becomes
+    "complete_anonymized_results_2024.parquet".
+
+    Args:
+        folder (str): The folder with the parquets.
+        destination_folder (str, optional): The folder of the anonymized parquets. Defaults to the same folder.
+        columns (list, optional): The string columns to hash. Defaults to DEFAULT_COLUMNS.
+        key (str or bytes, optional): The secret key of the HMAC, None for plain SHA-256. Defaults to None.
+        prefix (str, optional): The prefix of the parquets to anonymize. Defaults to "curated_results".
+        output_prefix (str, optional): The prefix of the anonymized parquets. Defaults to "complete_anonymized_results".
+        max_workers (int, optional): The number of processes per file. Defaults to the number of CPUs.
+
+    Returns:
+        list: The paths of the anonymized parquets.
+    """
+    destination_folder = destination_folder or folder
+    paths = []
+    for file_name in sorted(os.listdir(folder)):
+        if not (file_name.endswith(".parquet") and file_name.startswith(prefix)):
+            continue
+        destination_path = os.path.join(destination_folder, output_prefix + file_name[len(prefix):])
+        number_rows = anonymize_file(os.path.join(folder, file_name), destination_path, columns, key, max_workers)
+        print(f"Anonymized {number_rows} rows of {file_name}.")
+        paths.append(destination_path)
+    return paths
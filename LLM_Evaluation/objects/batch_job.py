@@ -0,0 +1,125 @@
+"""
+Functions to write chat-completion requests into a batch file and to read the results of a batch job back.
+The files follow the JSONL layout of the OpenAI / Azure OpenAI batch API, so large runs can use the cheaper batch
+path instead of interactive requests. answer_batch_file runs a batch file through an LLMClient instead, which can
+be pointed at a local stand-in server.
+"""
+import os
+import json
+import hashlib
+
+BATCH_URL = "/chat/completions"
+
+
+def make_custom_id(prefix, *parts):
+    """Builds a stable custom id from a prefix and the hash of the given parts.
+
+    Args:
+        prefix (str): The prefix of the id, e.g. the stage the request belongs to.
+        *parts (str): The values identifying the request.
+
+    Returns:
+        str: The custom id.
+    """
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f"{prefix}-{digest[:24]}"
+
+
+def make_batch_request(custom_id, deployment, payload, url=BATCH_URL):
+    """Builds one line of a batch file.
+
+    Args:
+        custom_id (str): The id used to join the result back onto its row.
+        deployment (str): The name of the model deployment.
+        payload (dict): The chat-completion payload.
+        url (str, optional): The endpoint of the request. Defaults to BATCH_URL.
+
+    Returns:
+        dict: The batch request.
+    """
+    return {"custom_id": custom_id, "method": "POST", "url": url, "body": {"model": deployment, **payload}}
+
+
+def write_batch_file(batch_requests, path):
+    """Writes batch requests to a JSONL file. Requests with an already written custom id are skipped.
+
+    Args:
+        batch_requests (list): The batch requests built with make_batch_request.
+        path (str): The path of the batch file.
+
+    Returns:
+        int: The number of written requests.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    written_ids = set()
+    with open(path, "w", encoding="utf-8") as file:
+        for batch_request in batch_requests:
+            if batch_request["custom_id"] in written_ids:
+                continue
+            written_ids.add(batch_request["custom_id"])
+            file.write(json.dumps(batch_request, ensure_ascii=False) + "\n")
+    return len(written_ids)
+
+
+def read_batch_file(path):
+    """Reads the requests of a batch file.
+
+    Args:
+        path (str): The path of the batch file.
+
+    Returns:
+        list: The batch requests.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def read_batch_results(path):
+    """Reads the results file of a batch job and extracts the content of each successful request.
+
+    Args:
+        path (str): The path of the results file.
+
+    Returns:
+        dict: Maps the custom id to the content of the first choice or to None if the request failed.
+    """
+    results = {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            body = response.get("body") or {}
+            if result.get("error") or response.get("status_code") != 200 or not body.get("choices"):
+                print("Batch request failed:", result["custom_id"], result.get("error") or response.get("status_code"))
+                results[result["custom_id"]] = None
+            else:
+                results[result["custom_id"]] = body["choices"][0]["message"]["content"]
+    return results
+
+
+def answer_batch_file(input_path, output_path, client):
+    """Answers a batch file request by request with an LLMClient and writes a results file in the batch layout.
+    Useful to run small batches interactively or to answer a batch file with a local stand-in server.
+
+    Args:
+        input_path (str): The path of the batch file.
+        output_path (str): The path of the results file.
+        client (LLMClient): The client to send the requests with.
+    """
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as file:
+        for batch_request in read_batch_file(input_path):
+            payload = dict(batch_request["body"])
+            deployment = payload.pop("model")
+            try:
+                content = client.chat_completion(deployment, payload)
+                response = {"status_code": 200, "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}}
+                error = None
+            except Exception as ex:
+                response = None
+                error = {"message": str(ex)}
+            file.write(json.dumps({"custom_id": batch_request["custom_id"], "response": response, "error": error}, ensure_ascii=False) + "\n")
@@ -0,0 +1,142 @@
+"""
+In this module, we define the CallMetrics class. It collects one record per LLM or ProductAI call with the token
+usage reported by the service, the latency, the retries and the time spent waiting, so throughput and costs of a
+run can be analysed from real numbers instead of offline estimates.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+
+class CallMetrics:
+    """A thread-safe collector of call records, shared by the clients of a run.
+
+    Records are kept in memory and, if a path is given, appended to a JSONL file as soon as they are collected,
+    so the metrics of an interrupted run are not lost.
+
+    Attributes:
+        path (str): The path of the JSONL file the records are appended to, None to keep them in memory only.
+        records (list): The collected records.
+    """
+
+    FIELDS = ["timestamp", "key", "url", "status", "error", "cache_hit", "latency", "total_time", "retries",
+              "retry_sleep", "rate_limit_wait", "prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens"]
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str, optional): The path of a JSONL file to append each record to. Defaults to None.
+        """
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+        # the labels of the calls of each thread, e.g. the stage and item they belong to
+        self._local = threading.local()
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextmanager
+    def labels(self, **labels):
+        """Adds the given fields to all records collected in this thread within the with block.
+
+        Example: with metrics.labels(stage="evaluation", question=question): evaluator.evaluate_correctness()
+        """
+        previous_labels = getattr(self._local, "labels", {})
+        self._local.labels = {**previous_labels, **labels}
+        try:
+            yield
+        finally:
+            self._local.labels = previous_labels
+
+    @staticmethod
+    def new_record(key, url):
+        """Creates the record of a call before it is sent.
+
+        Args:
+            key (str): The deployment or service of the call.
+            url (str): The URL of the call.
+
+        Returns:
+            dict: The record with all FIELDS.
+        """
+        record = dict.fromkeys(CallMetrics.FIELDS)
+        record.update({"timestamp": time.time(), "key": key, "url": url, "cache_hit": False,
+                       "retries": 0, "retry_sleep": 0.0, "rate_limit_wait": 0.0})
+        return record
+
+    @staticmethod
+    def add_usage(record, usage):
+        """Adds the token usage of a chat-completion response to a record.
+
+        Args:
+            record (dict): The record of the call.
+            usage (dict): The 'usage' of the response, None if the response has none.
+        """
+        if not usage:
+            return
+        record["prompt_tokens"] = usage.get("prompt_tokens")
+        record["completion_tokens"] = usage.get("completion_tokens")
+        record["total_tokens"] = usage.get("total_tokens")
+        record["cached_tokens"] = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+    def collect(self, record):
+        """Adds a finished record together with the labels of the current thread.
+
+        Args:
+            record (dict): The record of the call.
+        """
+        record = {**record, **getattr(self._local, "labels", {})}
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def to_dataframe(self):
+        """Returns the collected records as a metrics table with one row per call.
+
+        Returns:
+            pandas.DataFrame: The records.
+        """
+        with self._lock:
+            records = list(self.records)
+        return pd.DataFrame(records, columns=None if records else CallMetrics.FIELDS)
+
+    def summary(self, by="key"):
+        """Aggregates the records per deployment or service, or per label.
+
+        Args:
+            by (str or list, optional): The field(s) to group by. Defaults to "key".
+
+        Returns:
+            pandas.DataFrame: The number of calls, errors and cache hits, the retries and waiting times, the tokens and the latency percentiles.
+        """
+        df = self.to_dataframe()
+        grouped = df.groupby(by, dropna=False)
+        summary = grouped.agg(
+            calls=("timestamp", "size"),
+            errors=("error", lambda errors: errors.notna().sum()),
+            cache_hits=("cache_hit", "sum"),
+            retries=("retries", "sum"),
+            retry_sleep=("retry_sleep", "sum"),
+            rate_limit_wait=("rate_limit_wait", "sum"),
+            prompt_tokens=("prompt_tokens", "sum"),
+            completion_tokens=("completion_tokens", "sum"),
+            cached_tokens=("cached_tokens", "sum"),
+            latency_p50=("latency", lambda latency: latency.quantile(0.5)),
+            latency_p95=("latency", lambda latency: latency.quantile(0.95)),
+        )
+        return summary
+
+    def save(self, path):
+        """Saves the metrics table as a parquet file, e.g. next to the results of the run.
+
+        Args:
+            path (str): The path of the parquet file.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.to_dataframe().to_parquet(path, index=False)
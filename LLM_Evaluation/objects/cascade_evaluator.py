@@ -0,0 +1,218 @@
+"""
+In this module, we define the CascadeEvaluator class. It scores all ProductAI responses of a run with cheap local
+metrics first and only sends the rows the metrics cannot decide to the LLM judge.
+"""
+import re
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from objects.evaluator import Evaluator
+from objects.llm_client import LLMClient
+from objects.utils.utils import tokenize_words
+
+# a number with an optional unit directly after it, e.g. "0.2 µm", "50 %", "5bar"
+NUMBER_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*(%|°c|°f|µm|um|nm|mm|cm|ml|µl|mg|kg|kda|mbar|bar|psi|min|l|m|g|h|s)?(?![\w])")
+
+# a word that negates a statement, e.g. "not", "cannot" or the ending of "isn't"
+NEGATION_PATTERN = re.compile(r"\b(?:not|no|cannot|never|none|nor|neither|nothing|nobody|nowhere|without)\b|n['’]t\b")
+
+
+def extract_numbers(text):
+    """Returns the numbers of a text with their units, with a decimal point instead of a comma, e.g. ["0.2µm", "50%"]."""
+    return [number.replace(",", ".") + unit for number, unit in NUMBER_PATTERN.findall(text.lower())]
+
+
+def is_negated(text):
+    """Checks if a text contains a negation, e.g. "The filter is not compatible with ethanol"."""
+    return NEGATION_PATTERN.search(text.lower()) is not None
+
+
+def lcs_length(a, b):
+    """The length of the longest common subsequence of two token lists, with the bit-parallel algorithm of Allison and Dix.
+
+    Args:
+        a (list): The first tokens.
+        b (list): The second tokens.
+
+    Returns:
+        int: The number of tokens of the longest common subsequence.
+    """
+    if not a or not b:
+        return 0
+    # the bits of the positions of each token in a
+    positions = {}
+    for i, token in enumerate(a):
+        positions[token] = positions.get(token, 0) | (1 << i)
+    mask = (1 << len(a)) - 1
+    row = mask
+    for token in b:
+        matches = row & positions.get(token, 0)
+        row = ((row + matches) | (row - matches)) & mask
+    return len(a) - bin(row).count("1")
+
+
+class CascadeEvaluator:
+    """Evaluates the correctness of the ProductAI responses of a run in two steps.
+
+    First, local metrics compare each response with the true answer:
+        - token F1: the F1 score of the overlapping words.
+        - ROUGE-L: the F1 score of the longest common subsequence of words.
+        - numeric overlap: the share of the numbers and units of the true answer found in the response, NaN without numbers.
+    Their mean is the local score. Responses with a local score of at least the accept threshold, whose numbers all
+    match, are scored 5, empty responses and responses with a local score of at most the reject threshold are scored 1.
+    Only the rows in between go to the LLM judge. The 'evaluation_source' of each row tells which step decided it.
+
+    The word metrics do not see the meaning of a negation, e.g. "The filter is compatible with ethanol" and "The filter
+    is not compatible with ethanol" have a token F1 of 0.92, and a short true answer like "No." shares no words with a
+    correct response like "The filter cannot be autoclaved". So rows where only one of the answers is negated always
+    go to the judge, and responses to true answers with fewer than min_reject_tokens words are never rejected locally.
+
+    Attributes:
+        accept_threshold (float): The minimal local score of a response that is scored 5 without the judge.
+        reject_threshold (float): The maximal local score of a response that is scored 1 without the judge.
+        min_reject_tokens (int): The minimal number of words of a true answer whose response may be scored 1 without the judge.
+    """
+
+    LOCAL = "local"
+    JUDGE = "judge"
+
+    def __init__(self, model, api_key, accept_threshold=0.85, reject_threshold=0.05, min_reject_tokens=3, batch_size=None,
+                 client=None, ledger=None):
+        """
+        Args:
+            model (str): The model of the LLM judge.
+            api_key (str): The API key for the model.
+            accept_threshold (float, optional): The minimal local score scored 5 without the judge. Defaults to 0.85.
+            reject_threshold (float, optional): The maximal local score scored 1 without the judge. Defaults to 0.05.
+            min_reject_tokens (int, optional): The minimal number of words of a true answer whose response may be scored 1
+                without the judge. Defaults to 3.
+            batch_size (int, optional): The number of rows the judge evaluates in one request, see Evaluator.evaluate_correctness_batch.
+                Defaults to None, one request per row as in Evaluator.evaluate_correctness.
+            client (LLMClient, optional): A shared client to send the judge requests with. Defaults to the shared client of the api_key, see LLMClient.shared.
+            ledger (RunLedger, optional): A ledger of the run for the judge evaluations. Defaults to None.
+        """
+        if not 0 <= reject_threshold < accept_threshold <= 1:
+            raise ValueError("The thresholds must satisfy 0 <= reject_threshold < accept_threshold <= 1.")
+        self.model = model
+        self.api_key = api_key
+        self.accept_threshold = accept_threshold
+        self.reject_threshold = reject_threshold
+        self.min_reject_tokens = min_reject_tokens
+        self.batch_size = batch_size
+        self.client = client or LLMClient.shared(api_key)
+        self.ledger = ledger
+
+    @staticmethod
+    def compute_local_metrics(true_answers, generated_answers):
+        """Computes the local metrics of all rows at once.
+
+        Args:
+            true_answers (list): The true answers.
+            generated_answers (list): The ProductAI responses.
+
+        Returns:
+            pandas.DataFrame: The columns 'token_f1', 'rouge_l', 'numeric_overlap', 'local_score', 'polarity_match', which is
+            False if only one of the answers is negated, and 'true_tokens', the number of words of the true answer, one row per answer.
+        """
+        # missing answers count as empty answers
+        true_answers = pd.Series(list(true_answers), dtype=object).fillna("").astype(str).tolist()
+        generated_answers = pd.Series(list(generated_answers), dtype=object).fillna("").astype(str).tolist()
+        true_tokens = [tokenize_words(answer) for answer in true_answers]
+        generated_tokens = [tokenize_words(answer) for answer in generated_answers]
+
+        # the word counts of both columns in sparse matrices with a shared vocabulary
+        vocabulary = {}
+        true_counts = CascadeEvaluator._count_matrix(true_tokens, vocabulary)
+        generated_counts = CascadeEvaluator._count_matrix(generated_tokens, vocabulary)
+        shape = (len(true_tokens), max(len(vocabulary), 1))
+        true_counts.resize(shape)
+        generated_counts.resize(shape)
+        true_lengths = np.array([len(tokens) for tokens in true_tokens], dtype=float)
+        generated_lengths = np.array([len(tokens) for tokens in generated_tokens], dtype=float)
+        overlap = np.asarray(true_counts.minimum(generated_counts).sum(axis=1)).ravel()
+        token_f1 = CascadeEvaluator._f1(overlap, true_lengths, generated_lengths)
+
+        lcs = np.array([lcs_length(true, generated) for true, generated in zip(true_tokens, generated_tokens)], dtype=float)
+        rouge_l = CascadeEvaluator._f1(lcs, true_lengths, generated_lengths)
+
+        # the share of the distinct numbers of the true answer that are in the response
+        numbers = {}
+        true_numbers = CascadeEvaluator._count_matrix([set(extract_numbers(answer)) for answer in true_answers], numbers)
+        generated_numbers = CascadeEvaluator._count_matrix([set(extract_numbers(answer)) for answer in generated_answers], numbers)
+        shape = (len(true_tokens), max(len(numbers), 1))
+        true_numbers.resize(shape)
+        generated_numbers.resize(shape)
+        number_counts = np.asarray(true_numbers.sum(axis=1)).ravel()
+        matched_numbers = np.asarray(true_numbers.multiply(generated_numbers).sum(axis=1)).ravel()
+        numeric_overlap = np.divide(matched_numbers, number_counts, out=np.full(len(number_counts), np.nan), where=number_counts > 0)
+
+        metrics = pd.DataFrame({"token_f1": token_f1, "rouge_l": rouge_l, "numeric_overlap": numeric_overlap})
+        # the numeric overlap only counts for answers with numbers
+        metrics["local_score"] = metrics[["token_f1", "rouge_l", "numeric_overlap"]].mean(axis=1, skipna=True)
+        metrics["polarity_match"] = [is_negated(true) == is_negated(generated) for true, generated in zip(true_answers, generated_answers)]
+        metrics["true_tokens"] = true_lengths.astype(int)
+        return metrics
+
+    def evaluate(self, df, true_column="answer", generated_column="productai_response"):
+        """Evaluates all rows of a run, locally where the metrics are decisive and with the judge otherwise.
+
+        Args:
+            df (pandas.DataFrame): The run with the questions, true answers and ProductAI responses.
+            true_column (str, optional): The column of the true answers. Defaults to "answer".
+            generated_column (str, optional): The column of the ProductAI responses. Defaults to "productai_response".
+
+        Returns:
+            pandas.DataFrame: A copy of the run with the local metrics, 'evaluation_score', 'evaluation_reasoning'
+            and 'evaluation_source', which is "local" or "judge".
+        """
+        df = df.reset_index(drop=True)
+        metrics = self.compute_local_metrics(df[true_column].tolist(), df[generated_column].tolist())
+        df = pd.concat([df, metrics], axis=1)
+
+        empty = df[generated_column].fillna("").astype(str).str.strip() == ""
+        numbers_match = df["numeric_overlap"].isna() | (df["numeric_overlap"] == 1)
+        accepted = ~empty & (df["local_score"] >= self.accept_threshold) & numbers_match & df["polarity_match"]
+        rejected = empty | ((df["local_score"] <= self.reject_threshold) & df["polarity_match"]
+                            & (df["true_tokens"] >= self.min_reject_tokens))
+
+        df["evaluation_score"] = np.where(accepted, 5, np.where(rejected, 1, np.nan))
+        df["evaluation_reasoning"] = None
+        df["evaluation_source"] = np.where(accepted | rejected, CascadeEvaluator.LOCAL, CascadeEvaluator.JUDGE)
+        for i in np.flatnonzero(accepted | rejected):
+            reason = "The generated answer is empty" if empty[i] else "The generated answer nearly matches the true answer" if accepted[i] \
+                else "The generated answer has almost nothing in common with the true answer"
+            df.at[i, "evaluation_reasoning"] = (f"Decided locally: {reason} (token F1 {df.at[i, 'token_f1']:.2f}, "
+                                                f"ROUGE-L {df.at[i, 'rouge_l']:.2f}, numeric overlap {df.at[i, 'numeric_overlap']:.2f}).")
+
+        judged = np.flatnonzero(~(accepted | rejected))
+        rows = [(df.at[i, "question"], df.at[i, true_column], df.at[i, generated_column]) for i in judged]
+        for i, evaluation in zip(judged, self._judge(rows)):
+            df.at[i, "evaluation_score"] = float(evaluation["score"])
+            df.at[i, "evaluation_reasoning"] = evaluation["reasoning"]
+        print(f"Decided {len(df) - len(judged)} of {len(df)} rows locally, {len(judged)} rows were sent to the judge.")
+        return df
+
+    def _judge(self, rows):
+        """Evaluates the rows with the LLM judge and returns their evaluation results in order."""
+        if self.batch_size is not None:
+            return Evaluator.evaluate_correctness_batch(rows, self.model, self.api_key, batch_size=self.batch_size,
+                                                        client=self.client, ledger=self.ledger)
+        return [Evaluator(*row, self.model, self.api_key, client=self.client, ledger=self.ledger).evaluate_correctness() for row in rows]
+
+    @staticmethod
+    def _count_matrix(token_lists, vocabulary):
+        """Counts the tokens of each list in a sparse matrix with one row per list, adding new tokens to the vocabulary."""
+        indptr, indices = [0], []
+        for tokens in token_lists:
+            indices.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+            indptr.append(len(indices))
+        counts = sp.csr_matrix((np.ones(len(indices)), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+                               shape=(len(token_lists), max(len(vocabulary), 1)))
+        counts.sum_duplicates()
+        return counts
+
+    @staticmethod
+    def _f1(overlap, true_lengths, generated_lengths):
+        precision = np.divide(overlap, generated_lengths, out=np.zeros_like(overlap), where=generated_lengths > 0)
+        recall = np.divide(overlap, true_lengths, out=np.zeros_like(overlap), where=true_lengths > 0)
+        return np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(overlap), where=precision + recall > 0)
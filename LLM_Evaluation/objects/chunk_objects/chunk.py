@@ -8,6 +8,8 @@ import logging as log
 import copy
 import string
 from objects.utils import utils
+from objects.chunk_objects.page_index import PageIndex
+from objects.chunk_objects.chunk_tree_index import ChunkTreeIndex
 
 class MarkdownDocument:
 
@@ -56,6 +58,8 @@ class MarkdownDocument:
         else:
             raise AttributeError(f"Trying to read content from unexpected file type: {self.file_path}")
         
+        # find the page markers once, they are reused for the page count and the page numbers of the chunks
+        self.page_index = PageIndex(self.text)
         self._get_page_count()
         self.len = len(self.text)
         
@@ -88,22 +92,28 @@ class MarkdownDocument:
         if type(self) is MarkdownDocument and len(self.chunks) == 0:
             return [Chunk(self.text, self, self.chunk_level, 0, self.page_number)]
 
-        # Only include chunks that do not have sub-chunks
-        # as those with sub-chunks would otherwise repeat
-        atom_chunks = [chunk for chunk in self.chunks if len(chunk.chunks) == 0]
+        # Only include chunks that do not have sub-chunks as those with sub-chunks would otherwise repeat.
+        # Collect them recursively and sort them by page number once, the sort is stable, so this keeps the order
+        # of sorting at every level of the recursion
+        atom_chunks = []
+        self._collect_atom_chunks(atom_chunks)
+        return sorted(atom_chunks, key=lambda x: x.page_number)
 
-        non_atomic_chunks = [chunk for chunk in self.chunks if len(chunk.chunks) > 0]
 
-        # Recursively retrieve sub-chunks
-        for sub_chunk in non_atomic_chunks:
-            atom_chunks.extend(sub_chunk.get_atom_chunks()) 
-
-        # Sort the atom chunks by page number
-        atom_chunks = sorted(atom_chunks, key=lambda x: x.page_number)
-            
-        return atom_chunks
+    def _collect_atom_chunks(self, atom_chunks):
+        """Append the atom chunks of the chunk to the list: its chunks without sub-chunks first, then the atom chunks of the others."""
+        atom_chunks.extend(chunk for chunk in self.chunks if not chunk.chunks)
+        for sub_chunk in self.chunks:
+            if sub_chunk.chunks:
+                sub_chunk._collect_atom_chunks(atom_chunks)
     
 
+    def build_tree_index(self):
+        """Flatten the chunk tree into a ChunkTreeIndex. Build it once to answer several hierarchy queries,
+        and again after the tree has changed."""
+        return ChunkTreeIndex(self)
+
+
     def get_chunks_of_level(self, level: int, debug=False):
         """Iterate over all chunks and sub-chunks and retrieve a list of all chunks at a specific level."""
         chunks_at_level = []
@@ -124,22 +134,16 @@ class MarkdownDocument:
         """Calculate the number of chunks for each level in the chunk hierarchy.
            We start with the document and check if it has chunks. These would be level 1 chunks. 
            Then, we iterate over all level 1 chunks and check if they have sub-chunks. These are level 2 chunks and so on."""
-        # TODO: think if recursive approach would be easy to implement and understand
-        chunk_counts = {0: 1}
-        for level in range(1, 10):
-            chunks_at_level = self.get_chunks_of_level(level)
-            chunk_counts[level] = len(chunks_at_level)
-        return chunk_counts
+        # all levels are counted in one pass over the tree instead of one traversal per level
+        return self.build_tree_index().calculate_number_of_chunks_for_each_level(max_level=9)
 
             
     def _get_page_count(self):
         """Get the number of pages in the document and check if each page is included."""
-        # first, get all page markers in the whole markdown document
-        page_numbers = re.findall(r'\[PAGE (\d+)\]', self.text)
         # get the page_count as the max page_number identified in the document
-        page_count = max([int(page) for page in page_numbers]) if len(page_numbers) > 0 else 1
+        page_count = self.page_index.get_page_count()
         # check if all pages are included in the document, from page 1 to page_count
-        missing_pages = [page for page in range(1, page_count+1) if f'[PAGE {page}]' not in self.text]
+        missing_pages = self.page_index.get_missing_pages()
         # log warning if some pages are missing
         if len(missing_pages) > 0:
             log.warning(f"Markdown Document '{self.title}' is missing pages: {missing_pages}")
@@ -242,28 +246,36 @@ class Chunk(MarkdownDocument):
     
 
     def _generate_chunk_title_from_first_line(self):
+        chunk_title, rest_of_text = Chunk._split_title_from_text(self.text, self.parent.title)
+        self.text = rest_of_text
+        return chunk_title
+
+
+    @staticmethod
+    def _split_title_from_text(text, parent_title):
+        """Split the title from the stripped text of a chunk. Returns the title and the rest of the text."""
         try:
-            # replace page markers first
-            cleaned_text = re.sub(r'\n*\[PAGE (\d+)\]\n*', '', self.text).strip()
+            # ignore page markers in the first line, only the beginning of the text is cleaned
+            first_line, has_more_lines = PageIndex.get_first_line_without_markers(text)
             
             # check if the chunks starts with bold text or one of the hashes indicating titles
             # and in this case, use the first line of the text as title
-            if cleaned_text.startswith('#') or cleaned_text.startswith('*'):
-                chunk_title = cleaned_text.split('\n', maxsplit=1)[0] if '\n' in cleaned_text else self.parent.title
+            if first_line.startswith('#') or first_line.startswith('*'):
+                chunk_title = first_line if has_more_lines else parent_title
             else:
                 # no title detected in first line, so just use a the title of the parent
-                chunk_title = self.parent.title
-                rest_of_text = self.text
+                chunk_title = parent_title
+                rest_of_text = text
 
             # remove the title from the original text 
             # do not use the cleaned text as we would loose the page information
-            rest_of_text = self.text.replace(chunk_title, '', 1)
+            rest_of_text = text.replace(chunk_title, '', 1)
         
         except Exception as ex:
             log.warning(f"Error while extracting chunk title from the chunk text:\n{ex}")
             # some chunks seem to be too short
-            chunk_title = self.parent.title
-            rest_of_text = self.text
+            chunk_title = parent_title
+            rest_of_text = text
 
         # TODO: check if a chunk starts with a removed image and in this case use the next line as title
         # # replace special characters
@@ -273,19 +285,12 @@ class Chunk(MarkdownDocument):
             
         # do not shorten title. It was only necessary for using it as file name, but we can shorten during path creation
         # if len(chunk_title) > 50: chunk_title = chunk_title[:50]
-        self.text = rest_of_text.strip()
-        return chunk_title.strip()
+        return chunk_title.strip(), rest_of_text.strip()
     
     
     def _generate_chunk_context(self, include_title=True, include_page_number=True):
         """The context provides the info about the location of the chunk in a given text corpus."""
-        # construct the context from the titles of the parent documents and the title of the chunk
-        self.context = copy.copy(self.parent.context)
-
-        # only if the title of the chunk contains a hash (is a heading), we add  it to the context together with the page number
-        if (self.title.startswith('#') or self.title.startswith('*')) and self.title not in ''.join(self.context):
-            title_with_page_nr = self.title + f" (Page Nr. {self.page_number})"
-            self.context += [title_with_page_nr]
+        self.context = Chunk._build_chunk_context(self.parent.context, self.title, self.page_number)
         
         # # add the title only if it is not yet included in the context
         # # as some chunks do not have a title and use the title of their parent
@@ -297,29 +302,45 @@ class Chunk(MarkdownDocument):
         #     self.context[0] += f" (Page Nr. {self.page_number})"
 
         
-    def generate_json_chunk_with_metadata(self):
-        # build the context string from the extended context list
-        extended_context = copy.deepcopy(self.context)
-        # add page info to first line specifying the document
-        # extended_context[0] += f" (Page Nr. {self.page_number})"
+    @staticmethod
+    def _build_chunk_context(parent_context, title, page_number):
+        """Build the context of a chunk from the context of its parent and the title of the chunk."""
+        # construct the context from the titles of the parent documents and the title of the chunk
+        context = copy.copy(parent_context)
+
+        # only if the title of the chunk contains a hash (is a heading), we add  it to the context together with the page number
+        if (title.startswith('#') or title.startswith('*')) and title not in ''.join(context):
+            title_with_page_nr = title + f" (Page Nr. {page_number})"
+            context += [title_with_page_nr]
+        return context
+
+        
+    def get_chunk_metadata(self, date_created:str=None):
+        """
+        The metadata of the chunk itself, without the metadata of its document.
+        @param date_created: the creation date to store, defaults to today. Pass it when exporting many chunks at once
+        """
         # do not include the last item in the context as its equal to the first line of the chunk
-        if len(extended_context) >= 2 : extended_context = extended_context[:-1] 
+        extended_context = self.context[:-1] if len(self.context) >= 2 else self.context
         context_string = '\n'.join(extended_context)
 
-        metadata = {
+        return {
             "chunk_title": self.title,
             "chunk_file_name": self.file_name,
             "chunk_page": self.page_number,
             "chunk_length": self.len,
             "chunk_context": context_string,
-            "chunk_date_created": utils.get_current_datetime_as_str(str_format="%Y-%m-%d"),
+            "chunk_date_created": date_created or utils.get_current_datetime_as_str(str_format="%Y-%m-%d"),
             "chunk_text": self.text,
             "chunk_text_with_context": context_string + '\n\n' + self.title + '\n\n' + self.text 
         }
 
-        # add parent metadata without the content of the whole document
-        parent_metadata = copy.deepcopy(self.parent.source_metadata)
-        parent_metadata.pop('source_content', None) 
+
+    def generate_json_chunk_with_metadata(self):
+        metadata = self.get_chunk_metadata()
+
+        # add parent metadata without the content of the whole document, which is left out before copying
+        parent_metadata = copy.deepcopy({key: value for key, value in self.parent.source_metadata.items() if key != 'source_content'})
         metadata = {**parent_metadata, **metadata}
         
         self.json_dict = metadata
@@ -380,6 +401,117 @@ class Chunk(MarkdownDocument):
     
 
 
+class CompactChunk:
+    """
+    A memory efficient chunk that does not keep its own copy of the text.
+    It stores the (start, end) offsets of its text in the text of the root document and uses __slots__ instead of a __dict__.
+    Text, title and context are produced when they are accessed. Otherwise, it behaves like a Chunk.
+    """
+    __slots__ = ('source_text', 'start', 'end', 'parent', 'page_number', 'chunk_level', 'chunk_pos', 'len', 'chunks',
+                 'json_dict', 'json_string', '_title_start', '_title_end', '_context')
+
+    # compact chunks are never merged, merging creates a new Chunk
+    merged_titles = ()
+    is_merged_chunk = False
+
+    def __init__(self, source_text:str, start:int, end:int, parent:MarkdownDocument, level:int, chunk_pos:int,
+                 page_number:int, length:int, title_span:tuple=None):
+        """
+        @param source_text: the text of the root document, which contains the text of the chunk
+        @param start, end: the offsets of the text of the chunk (without its title) in the source text
+        @param length: the length of the chunk including the title, as for a Chunk
+        @param title_span: the offsets of the title in the source text or None if the chunk uses the title of its parent
+        The other parameters are the same as for a Chunk.
+        """
+        self.source_text = source_text
+        self.start = start
+        self.end = end
+        self.parent = parent
+        self.page_number = page_number
+        self.chunk_level = level
+        self.chunk_pos = chunk_pos
+        self.len = length
+        self._title_start, self._title_end = title_span if title_span is not None else (None, None)
+        self._context = None
+        self.chunks = None
+        self.json_dict = None
+        self.json_string = None
+
+
+    @staticmethod
+    def from_text(chunk_text:str, parent:MarkdownDocument, level:int, chunk_pos:int, page_number:int,
+                  source_text:str, search_start:int=0, search_end:int=None):
+        """
+        Create a chunk from the text of a split. The text and title of the chunk are searched in the source text between search_start and search_end.
+        If they cannot be found there, e.g. because the title was not at the beginning of the chunk, a regular Chunk is returned instead.
+        """
+        text = chunk_text.strip()
+        title, rest_of_text = Chunk._split_title_from_text(text, parent.title)
+        start = source_text.find(rest_of_text, search_start, search_end)
+        if start < 0:
+            return Chunk(chunk_text, parent, level, chunk_pos, page_number)
+
+        title_span = None
+        if title != parent.title:
+            title_start = source_text.find(title, search_start, search_end)
+            if title_start < 0:
+                return Chunk(chunk_text, parent, level, chunk_pos, page_number)
+            title_span = (title_start, title_start + len(title))
+
+        return CompactChunk(source_text, start, start + len(rest_of_text), parent, level, chunk_pos, page_number, len(text), title_span)
+
+
+    @property
+    def text(self):
+        return self.source_text[self.start:self.end]
+
+    @property
+    def title(self):
+        if self._title_start is None:
+            return self.parent.title
+        return self.source_text[self._title_start:self._title_end]
+
+    @property
+    def context(self):
+        if self._context is not None:
+            return self._context
+        return Chunk._build_chunk_context(self.parent.context, self.title, self.page_number)
+
+    @context.setter
+    def context(self, context):
+        self._context = context
+
+    @property
+    def source_metadata(self):
+        return self.parent.source_metadata
+
+    @property
+    def file_name(self):
+        return self.parent.file_name
+
+    @property
+    def folder(self):
+        return self.parent.folder
+
+
+    # reuse the methods of the document and chunk classes
+    print_chunk_tree = MarkdownDocument.print_chunk_tree
+    get_atom_chunks = MarkdownDocument.get_atom_chunks
+    _collect_atom_chunks = MarkdownDocument._collect_atom_chunks
+    build_tree_index = MarkdownDocument.build_tree_index
+    get_chunks_of_level = MarkdownDocument.get_chunks_of_level
+    calculate_number_of_chunks_for_each_level = MarkdownDocument.calculate_number_of_chunks_for_each_level
+    display = MarkdownDocument.display
+    get_chunk_metadata = Chunk.get_chunk_metadata
+    generate_json_chunk_with_metadata = Chunk.generate_json_chunk_with_metadata
+    save_chunk = Chunk.save_chunk
+    _Chunk__clean_filename = Chunk._Chunk__clean_filename
+    print = Chunk.print
+    __str__ = Chunk.__str__
+    __repr__ = MarkdownDocument.__repr__
+
+
+
 class WebpageChunk(Chunk):
     def __init__(self, chunk_text:str, parent:MarkdownDocument, level:int, chunk_pos:int, page_number):
         super().__init__()
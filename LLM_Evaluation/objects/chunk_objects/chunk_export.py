@@ -0,0 +1,114 @@
+"""
+Functions to export the chunks of a document as one JSONL or Parquet file per document, instead of a json and a markdown
+file per chunk. The metadata of the document is stored once per file and each chunk row references the document by its
+file name, so exporting a corpus writes one file per document and never copies the document metadata per chunk.
+"""
+import os
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from objects.utils import utils
+
+FORMATS = ('jsonl', 'parquet')
+
+# the key of the document metadata in the key-value metadata of a parquet file
+PARQUET_METADATA_KEY = b'document_metadata'
+
+
+def get_document_metadata(document):
+    """Returns the source metadata of a document without the content of the whole document.
+
+    Args:
+        document (MarkdownDocument): The document.
+
+    Returns:
+        dict: The metadata with the file name of the document under 'document'.
+    """
+    metadata = {key: value for key, value in document.source_metadata.items() if key != 'source_content'}
+    metadata['document'] = document.file_name
+    return metadata
+
+
+def get_chunk_rows(document, chunks=None):
+    """Returns one row per chunk with the chunk metadata of Chunk.generate_json_chunk_with_metadata, without the document metadata.
+
+    Args:
+        document (MarkdownDocument): The chunked document.
+        chunks (list, optional): The chunks to export. Defaults to the atom chunks of the document.
+
+    Returns:
+        list: The rows with the 'document' they belong to and their 'chunk_index' in the chunks.
+    """
+    if chunks is None:
+        chunks = document.get_atom_chunks()
+    # the same creation date for all chunks of the export
+    date_created = utils.get_current_datetime_as_str(str_format="%Y-%m-%d")
+    return [{'document': document.file_name, 'chunk_index': chunk_index, **chunk.get_chunk_metadata(date_created)}
+            for chunk_index, chunk in enumerate(chunks)]
+
+
+def export_document_chunks(document, dest_folder, file_format='jsonl', chunks=None):
+    """Writes the chunks of a document to one file in the destination folder.
+
+    A JSONL file has the document metadata in its first line and one chunk row per following line.
+    A Parquet file has one chunk row per row and the document metadata as JSON in its key-value metadata.
+
+    Args:
+        document (MarkdownDocument): The chunked document.
+        dest_folder (str): The folder to write the file to. It is created if it does not exist.
+        file_format (str, optional): "jsonl" or "parquet". Defaults to "jsonl".
+        chunks (list, optional): The chunks to export. Defaults to the atom chunks of the document.
+
+    Returns:
+        str: The path of the written file.
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown chunk export format {file_format}, use one of {FORMATS}")
+    os.makedirs(dest_folder, exist_ok=True)
+    path = os.path.join(dest_folder, f"{document.file_name}.chunks.{file_format}")
+    metadata = get_document_metadata(document)
+    rows = get_chunk_rows(document, chunks)
+
+    if file_format == 'jsonl':
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(metadata, ensure_ascii=False) + '\n')
+            file.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+    else:
+        table = pa.Table.from_pylist(rows)
+        table = table.replace_schema_metadata({PARQUET_METADATA_KEY: json.dumps(metadata, ensure_ascii=False)})
+        pq.write_table(table, path)
+    return path
+
+
+def export_documents(documents, dest_folder, file_format='jsonl'):
+    """Writes the atom chunks of each document to its own file, e.g. for the documents yielded by ingest_documents.
+
+    Args:
+        documents (iterable): The chunked documents.
+        dest_folder (str): The folder to write the files to.
+        file_format (str, optional): "jsonl" or "parquet". Defaults to "jsonl".
+
+    Returns:
+        list: The paths of the written files.
+    """
+    return [export_document_chunks(document, dest_folder, file_format) for document in documents]
+
+
+def read_document_chunks(path):
+    """Reads a file written by export_document_chunks.
+
+    Args:
+        path (str): The path of the JSONL or Parquet file.
+
+    Returns:
+        tuple: The document metadata and the list of chunk rows. {**metadata, **row} gives the json_dict of the chunk,
+        with the additional 'document' and 'chunk_index' keys.
+    """
+    if path.endswith('.parquet'):
+        table = pq.read_table(path)
+        metadata = json.loads(table.schema.metadata[PARQUET_METADATA_KEY])
+        return metadata, table.to_pylist()
+
+    with open(path, 'r', encoding='utf-8') as file:
+        metadata = json.loads(file.readline())
+        return metadata, [json.loads(line) for line in file if line.strip()]
@@ -4,7 +4,9 @@ Class to chunk a document into chunks, merge too short chunks and get a list of
 import re
 import copy
 import logging as log
-from objects.chunk_objects.chunk import MarkdownDocument, Chunk
+from objects.chunk_objects.chunk import MarkdownDocument, Chunk, CompactChunk
+from objects.chunk_objects.header_index import HeaderIndex
+from objects.chunk_objects.page_index import PageIndex
 
 class ChunkHandler:
 
@@ -125,13 +127,29 @@ class ChunkHandler:
         max_chunk_size, 
         split_criteria, 
         recursive=True,
-        include_page_number=True) -> list[Chunk]:
-
+        include_page_number=True,
+        compact=False,
+        header_index:HeaderIndex=None,
+        text_offset:int=0) -> list[Chunk]:
+        """
+        Split the document into chunks by the first split criterion that splits it and, if recursive, split each chunk by the remaining criteria.
+        @param compact: create CompactChunks, which store offsets into the text of the root document instead of copies of the text.
+        @param header_index: positions of the headers in the text of the root document. It is built once for the root document and passed down the recursion,
+                             so the text is scanned once per kind of header instead of once per chunk and level.
+        @param text_offset:  position of the text of doc in the text of the header index
+        """
         
         # do not split if the chunk is not long
         if doc.len <= max_chunk_size:
             return []
         
+        if header_index is None:
+            # a document brings the page markers of its text, chunks do not
+            header_index = HeaderIndex(doc.text, getattr(doc, 'page_index', None))
+            text_offset = 0
+        # the span of the document in the indexed text
+        doc_start, doc_end = text_offset, text_offset + len(doc.text)
+        
         # We have a hierarchy of strings to split by defined in split_criteria.
         # If the doc cannot be splitted by the string of current level, increase the level until it gets splitted or reaches max level
         next_level = doc.chunk_level
@@ -139,20 +157,25 @@ class ChunkHandler:
         # DEBUG: uncomment to debug the splitting function for a single file 
         # if 'applications/applied-industries/medical-devices.md' in doc.file_path:
         #     pause = True
-
-        if "Single-use components or systems" in doc.text and next_level == 1:
-            debug = True
         
         # split by the next level
         for i_criterion, split_criterion in enumerate(split_criteria):
 
+            # the spans of the splits in the indexed text, only known for the indexed split criteria
+            split_spans = None
             if split_criterion in ChunkHandler.MARKDOWN_HEADINGS:
-                regex_pattern = r"(?<!#)" + '\n'+split_criterion + r"(?!#)"
+                # the splits are identical to re.split(r"(?<!#)" + '\n'+split_criterion + r"(?!#)", doc.text)
                 # TODO: please change the regex pattern to exactly match the number of hashes... but be careful, it's a running system in the moment! ;)
                 # regex_pattern = (r'\n' if split_criterion in ChunkHandler.MARKDOWN_HEADINGS else '') + f'{split_criterion}' \
                 #     + (' ' if split_criterion in ChunkHandler.MARKDOWN_HEADINGS else '')
                 # regex_pattern = f'{split_str}(?![#])'
-                splits = re.split(regex_pattern, doc.text)
+                split_spans = header_index.split_by_markdown_heading(split_criterion, doc_start, doc_end)
+
+            elif split_criterion is ChunkHandler.split_by_bold_headers:
+                split_spans = header_index.split_by_bold_headers(doc_start, doc_end)
+
+            elif split_criterion is ChunkHandler.split_by_short_lines_that_might_be_headers:
+                split_spans = header_index.split_by_short_lines_that_might_be_headers(doc_start, doc_end)
 
             elif callable(split_criterion):
                 splits = split_criterion(doc.text)
@@ -161,6 +184,21 @@ class ChunkHandler:
                 log.error(f'Splitting criteria {split_criterion} has unexpected type {type(split_criterion)}')
                 continue
 
+            if split_spans is not None:
+                splits = [header_index.text[start:end] for start, end in split_spans]
+                # the text of each chunk is searched between the end of the previous split and the end of its split
+                search_windows = list(zip([doc_start] + [end for _, end in split_spans[:-1]], [end for _, end in split_spans]))
+                # the spans of the stripped splits to look up their page markers.
+                # A split that gets the markdown heading added back does not start with a page marker
+                page_spans = []
+                for pos, ((start, end), split) in enumerate(zip(split_spans, splits)):
+                    start += len(split) - len(split.lstrip())
+                    page_spans.append((start, max(start, end - (len(split) - len(split.rstrip()))),
+                                       pos == 0 or split_criterion not in ChunkHandler.MARKDOWN_HEADINGS))
+            else:
+                search_windows = [(doc_start, doc_end)] * len(splits)
+                page_spans = [None] * len(splits)
+
             # remove spaces and line breaks at beginning and end of strings
             splits = [item.strip() for item in splits]
 
@@ -181,9 +219,12 @@ class ChunkHandler:
                 # remove empty splits or those only containing the split criterion
                 # which happens when the split criterion is at the beginning of the text
                 if type(split_criteria)==str:
-                    splits = [split for split in splits if len(split.strip()) > (len(split_criterion)) ]
+                    keep = [len(split.strip()) > (len(split_criterion)) for split in splits]
                 else:
-                    splits = [split for split in splits if len(split.strip()) > 0]
+                    keep = [len(split.strip()) > 0 for split in splits]
+                splits = [split for split, keep_split in zip(splits, keep) if keep_split]
+                search_windows = [window for window, keep_split in zip(search_windows, keep) if keep_split]
+                page_spans = [page_span for page_span, keep_split in zip(page_spans, keep) if keep_split]
 
                 # create a chunk for each split
                 chunks = []
@@ -191,36 +232,53 @@ class ChunkHandler:
                 # some splits will not have a page info and should use the previously available info
                 # the chunk's page is the same or bigger as the page number of its parent
                 page_number = doc.page_number
+                # the chunks of not indexed split criteria are in order, so the search for the next chunk starts at the previous one
+                search_start = doc_start
 
                 # ITERATE OVER ALL SPLITS
-                for pos, split in enumerate(splits):
-                    # remove the page tags in the split and remember the page numbers
-                    split, page_numbers, chunk_starts_with_page_number = ChunkHandler.extract_page_numbers(split, False)
-                    # use the smallest extracted number of the previous page number
-                    if page_numbers: 
-                        page_number = min(page_numbers)
-                        # subsctract 1 as the extracted page number indicate the start of the NEXT page
-                        # don't substract if it is the first page
-                        # TODO: might be a bug, make sure, we do not subsctract -1 too often when a split does not contain page info
-                        if page_number > 1 and not chunk_starts_with_page_number: page_number -= 1 
+                for pos, (split, search_window, page_span) in enumerate(zip(splits, search_windows, page_spans)):
+                    # get the page number of the chunk and the page number the next chunk starts on
+                    if page_span is not None:
+                        # look up the page markers of the split in the page index
+                        span_start, span_end, can_start_with_marker = page_span
+                        chunk_page_number, next_page_number = header_index.page_index.get_chunk_page_number(
+                            span_start, span_end, page_number, can_start_with_marker)
+                    else:
+                        # remove the page tags in the split and remember the page numbers
+                        split, page_numbers, chunk_starts_with_page_number = ChunkHandler.extract_page_numbers(split, False)
+                        chunk_page_number, next_page_number = PageIndex.get_page_number_from_markers(
+                            min(page_numbers) if page_numbers else None, max(page_numbers) if page_numbers else None,
+                            chunk_starts_with_page_number, page_number)
                     
                     # # for short splits, just use the title of the parent
                     # title_of_the_split = doc.title if len(split) < 100 else None
 
                     # instantiate the chunk
-                    if "1.1 Background" in split: 
-                        breakpoint = True
-                    chunk = Chunk(split, doc, next_level+1, pos, page_number)
+                    search_window_start = max(search_window[0], search_start)
+                    if compact:
+                        chunk = CompactChunk.from_text(split, doc, next_level+1, pos, chunk_page_number, header_index.text, search_window_start, search_window[1])
+                    else:
+                        chunk = Chunk(split, doc, next_level+1, pos, chunk_page_number)
                     if recursive:
-                        chunk.chunks = ChunkHandler.split_document_into_chunks(
-                            chunk, max_chunk_size, split_criteria[i_criterion+1:], recursive, include_page_number)
+                        # find the text of the chunk in the indexed text to reuse the index for its sub-chunks.
+                        # The text of the chunk is stripped, so any occurrence of it has the same headers.
+                        if isinstance(chunk, CompactChunk):
+                            chunk_start = chunk.start
+                        else:
+                            chunk_start = header_index.text.find(chunk.text, search_window_start, search_window[1])
+                        if chunk_start >= 0:
+                            search_start = chunk_start
+                            chunk.chunks = ChunkHandler.split_document_into_chunks(
+                                chunk, max_chunk_size, split_criteria[i_criterion+1:], recursive, include_page_number, compact, header_index, chunk_start)
+                        else:
+                            # the title has not been removed from the beginning of the chunk, so it needs its own index
+                            chunk.chunks = ChunkHandler.split_document_into_chunks(
+                                chunk, max_chunk_size, split_criteria[i_criterion+1:], recursive, include_page_number, compact)
                     chunks.append(chunk)
 
                     # set the maximum extracted page to current page number
-                    page_number = max(page_numbers) if page_numbers else page_number
+                    page_number = next_page_number
 
-                if chunks is None:
-                    pause = True
                 return chunks
         
         # return an empty list of chunks if there was nothing to chunk
@@ -340,7 +398,7 @@ class ChunkHandler:
         if len(chunks) == 1: return chunks[0]
 
         # all items in list must be chunks
-        assert all([isinstance(chunk, Chunk) for chunk in chunks]), "All items in the list must be chunks!"
+        assert all([isinstance(chunk, (Chunk, CompactChunk)) for chunk in chunks]), "All items in the list must be chunks!"
         # all chunks should have the same parent, only a single unique parent
         unique_chunk_parent_titles = set([chunk.parent.title for chunk in chunks])
         assert len(unique_chunk_parent_titles) == 1, "All chunks to be merged must have the same parent but parents were: " + str(unique_chunk_parent_titles)
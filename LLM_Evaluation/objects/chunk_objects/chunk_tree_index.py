@@ -0,0 +1,107 @@
+"""
+Class to flatten a chunk tree into parallel arrays, so hierarchy queries such as the atom chunks, the chunks of a level
+or the number of chunks per level are answered from a single pass over the tree instead of a traversal per query.
+"""
+
+class ChunkTreeIndex:
+    """
+    The nodes of a chunk tree in pre-order with parallel arrays of their level, parent, page number and length.
+    The subtree of a node is the slice of the nodes from its index to its subtree end.
+    The index is a snapshot, build a new one after changing the tree, e.g. after merging chunks.
+    """
+
+    def __init__(self, root):
+        """
+        @param root: the document or chunk whose tree is indexed
+        """
+        self.root = root
+        self.nodes = []
+        self.levels = []
+        self.parents = []
+        self.page_numbers = []
+        self.lengths = []
+        # the index after the last node of the subtree of each node
+        self.subtree_ends = []
+        # the indices of the children of each node
+        self.children = []
+        # the nodes of each level that are reached when searching the level from the root, in pre-order.
+        # The search does not descend below nodes of the requested level or higher
+        self._indices_of_level = {}
+        self._add_node(root, -1, float('-inf'))
+        self._index_of_node = None
+
+
+    def _add_node(self, node, parent, max_ancestor_level):
+        """Add the node and its subtree in pre-order. The tree is only a few levels deep, so the recursion is safe."""
+        index = len(self.nodes)
+        self.nodes.append(node)
+        self.levels.append(node.chunk_level)
+        self.parents.append(parent)
+        self.page_numbers.append(node.page_number)
+        self.lengths.append(node.len)
+        self.subtree_ends.append(None)
+        self.children.append([])
+        if parent >= 0:
+            self.children[parent].append(index)
+        if max_ancestor_level < node.chunk_level:
+            self._indices_of_level.setdefault(node.chunk_level, []).append(index)
+
+        max_ancestor_level = max(max_ancestor_level, node.chunk_level)
+        for chunk in node.chunks or []:
+            self._add_node(chunk, index, max_ancestor_level)
+        self.subtree_ends[index] = len(self.nodes)
+
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+    def index_of(self, node):
+        """The position of a node of the tree in the arrays."""
+        if self._index_of_node is None:
+            self._index_of_node = {id(indexed_node): index for index, indexed_node in enumerate(self.nodes)}
+        return self._index_of_node[id(node)]
+
+
+    def get_subtree(self, node=None):
+        """The node and all its sub-chunks in pre-order. Defaults to the whole tree."""
+        index = 0 if node is None else self.index_of(node)
+        return self.nodes[index:self.subtree_ends[index]]
+
+
+    def get_atom_chunks(self, node=None):
+        """
+        The chunks below the node without sub-chunks, sorted by page number.
+        Identical to the recursive MarkdownDocument.get_atom_chunks: within each node, the atom children come before
+        the atom chunks of the other children, and chunks on the same page keep this order.
+        A document without chunks is returned as its only atom chunk, also like MarkdownDocument.get_atom_chunks.
+        """
+        # imported here, as the chunk module imports this module
+        from objects.chunk_objects.chunk import MarkdownDocument, Chunk
+
+        index = 0 if node is None else self.index_of(node)
+        node = self.nodes[index]
+        if type(node) is MarkdownDocument and not self.children[index]:
+            return [Chunk(node.text, node, node.chunk_level, 0, node.page_number)]
+        atom_indices = []
+        # the stack holds the nodes whose atom chunks are collected next, in reverse order
+        stack = [index]
+        while stack:
+            children = self.children[stack.pop()]
+            atom_indices.extend(child for child in children if not self.children[child])
+            stack.extend(reversed([child for child in children if self.children[child]]))
+        atom_indices.sort(key=self.page_numbers.__getitem__)
+        return [self.nodes[atom_index] for atom_index in atom_indices]
+
+
+    def get_chunks_of_level(self, level:int):
+        """All chunks of a level in pre-order, identical to MarkdownDocument.get_chunks_of_level of the root."""
+        return [self.nodes[index] for index in self._indices_of_level.get(level, [])]
+
+
+    def calculate_number_of_chunks_for_each_level(self, max_level:int=9):
+        """The number of chunks of each level from 1 to max_level, and 1 for level 0, the document."""
+        chunk_counts = {0: 1}
+        for level in range(1, max_level+1):
+            chunk_counts[level] = len(self._indices_of_level.get(level, []))
+        return chunk_counts
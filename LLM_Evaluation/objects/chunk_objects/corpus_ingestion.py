@@ -0,0 +1,174 @@
+"""
+Functions to read and chunk a whole corpus of document twins in a process pool. The chunked documents are yielded
+one by one as soon as they are finished, so the parent process never holds more than the documents in flight.
+"""
+import os
+import time
+import traceback
+import logging as log
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from objects.chunk_objects.chunk import MarkdownDocument
+from objects.chunk_objects.chunk_handler import ChunkHandler
+
+DOCUMENT_EXTENSIONS = ('.md', '.json')
+
+DEFAULT_SPLIT_CRITERIA = [
+    *ChunkHandler.MARKDOWN_HEADINGS,
+    ChunkHandler.split_by_bold_headers,
+    ChunkHandler.split_by_short_lines_that_might_be_headers,
+    ChunkHandler.hard_split_by_character_number
+]
+
+
+class IngestionResult:
+    """The chunked document of one path or the error that occured while reading or chunking it.
+
+    Attributes:
+        path (str): The path of the document twin.
+        document (MarkdownDocument): The document with its chunk tree in document.chunks, None if an error occured.
+        error (str): The traceback of the error, None if the document was chunked.
+        duration (float): The seconds it took to read and chunk the document.
+    """
+
+    def __init__(self, path, document=None, error=None, duration=None):
+        self.path = path
+        self.document = document
+        self.error = error
+        self.duration = duration
+
+    @property
+    def chunks(self):
+        return self.document.chunks if self.document is not None else None
+
+    def __repr__(self) -> str:
+        status = f"error: {self.error.strip().splitlines()[-1]}" if self.error else f"{len(self.chunks or [])} chunks"
+        return f"IngestionResult({self.path}, {status})"
+
+
+def find_document_paths(folder_or_paths, extensions=DOCUMENT_EXTENSIONS):
+    """Lists the document twins of a folder or filters a list of paths by their extension.
+    If a document has twins with several of the extensions, only the one with the first extension is used.
+
+    Args:
+        folder_or_paths (str or list): A folder with document twins or a list of paths.
+        extensions (tuple, optional): The extensions to read, in order of preference. Defaults to DOCUMENT_EXTENSIONS.
+
+    Returns:
+        list: The sorted paths of the documents.
+    """
+    if isinstance(folder_or_paths, str):
+        paths = [os.path.join(folder_or_paths, file_name) for file_name in os.listdir(folder_or_paths)]
+    else:
+        paths = list(folder_or_paths)
+    documents = {}
+    for path in paths:
+        name, extension = os.path.splitext(path)
+        if extension not in extensions:
+            continue
+        if name not in documents or extensions.index(extension) < extensions.index(os.path.splitext(documents[name])[1]):
+            documents[name] = path
+    return sorted(documents.values())
+
+
+def chunk_document(path, max_chunk_size=ChunkHandler.RECOMMENDED_MAX_CHUNK_SIZE, split_criteria=None, recursive=True, compact=True):
+    """Reads a document twin and splits it into its chunk tree. Errors are returned in the result instead of raised.
+
+    Args:
+        path (str): The path of the document twin.
+        max_chunk_size (int, optional): The maximum size of a chunk. Defaults to ChunkHandler.RECOMMENDED_MAX_CHUNK_SIZE.
+        split_criteria (list, optional): The split criteria in order. Defaults to DEFAULT_SPLIT_CRITERIA.
+        recursive (bool, optional): Whether the chunks are split further by the remaining criteria. Defaults to True.
+        compact (bool, optional): Whether to create CompactChunks, which are also much smaller to send between processes. Defaults to True.
+
+    Returns:
+        IngestionResult: The chunked document or the error.
+    """
+    start_time = time.time()
+    try:
+        document = MarkdownDocument(path)
+        document.chunks = ChunkHandler.split_document_into_chunks(
+            document, max_chunk_size=max_chunk_size, split_criteria=split_criteria or DEFAULT_SPLIT_CRITERIA,
+            recursive=recursive, compact=compact)
+        return IngestionResult(path, document, duration=time.time() - start_time)
+    except Exception:
+        return IngestionResult(path, error=traceback.format_exc(), duration=time.time() - start_time)
+
+
+def ingest_documents(folder_or_paths, max_chunk_size=ChunkHandler.RECOMMENDED_MAX_CHUNK_SIZE, split_criteria=None,
+                     recursive=True, compact=True, max_workers=None, max_in_flight=None):
+    """Reads and chunks documents in a process pool and yields each chunked document as soon as it is finished.
+    The results are yielded in the order they finish, not in the order of the paths. A failing document is
+    yielded with its error and does not stop the other documents. If a worker process dies, e.g. killed for its memory,
+    the documents in flight are chunked again one at a time in a new pool, so only a document that kills a worker on its
+    own is yielded with the error, and the remaining documents are chunked in a new pool after them.
+
+    Args:
+        folder_or_paths (str or list): A folder with document twins or a list of paths.
+        max_chunk_size (int, optional): The maximum size of a chunk. Defaults to ChunkHandler.RECOMMENDED_MAX_CHUNK_SIZE.
+        split_criteria (list, optional): The split criteria in order. Defaults to DEFAULT_SPLIT_CRITERIA.
+            Callable criteria must be importable functions, e.g. the static methods of ChunkHandler, to be sent to the workers.
+        recursive (bool, optional): Whether the chunks are split further by the remaining criteria. Defaults to True.
+        compact (bool, optional): Whether to create CompactChunks. Defaults to True.
+        max_workers (int, optional): The number of processes. Defaults to the number of CPUs. With 1, the documents are chunked in this process.
+        max_in_flight (int, optional): The maximum number of submitted documents whose results have not been yielded yet. Defaults to twice the number of processes.
+
+    Yields:
+        IngestionResult: The chunked document or the error of each path.
+    """
+    paths = find_document_paths(folder_or_paths)
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1:
+        for path in paths:
+            yield _log_result(chunk_document(path, max_chunk_size, split_criteria, recursive, compact))
+        return
+
+    max_in_flight = max_in_flight or 2 * max_workers
+    remaining_paths = deque(paths)
+    # the documents that were in flight when a worker process died, each of them may have killed it
+    suspect_paths = deque()
+    while remaining_paths or suspect_paths:
+        # the suspects are chunked one at a time, so a document only fails if the pool breaks while it is chunked alone
+        isolating = bool(suspect_paths)
+        pending_paths = suspect_paths if isolating else remaining_paths
+        with ProcessPoolExecutor(max_workers=1 if isolating else max_workers) as executor:
+            in_flight = {}
+            number_submitted = 0
+            broken = False
+            while True:
+                # keep the pool busy, but do not submit more documents than we want to hold at once
+                try:
+                    while not broken and pending_paths and len(in_flight) < (1 if isolating else max_in_flight):
+                        future = executor.submit(chunk_document, pending_paths[0], max_chunk_size, split_criteria, recursive, compact)
+                        in_flight[future] = pending_paths.popleft()
+                        number_submitted += 1
+                except BrokenProcessPool:
+                    broken = True
+                    if number_submitted == 0:
+                        # the new pool broke before it took a document, so the document is reported instead of retried forever
+                        yield _log_result(IngestionResult(pending_paths.popleft(), error=traceback.format_exc()))
+                if not in_flight:
+                    break
+                # in a broken pool all documents in flight are finished or failed, so they are all collected at once
+                done, _ = wait(in_flight, return_when=ALL_COMPLETED if broken else FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        if not isolating:
+                            suspect_paths.append(path)
+                            continue
+                        # the document was chunked alone, so it broke the pool
+                        result = IngestionResult(path, error=traceback.format_exc())
+                    except Exception:
+                        # e.g. the result could not be sent back
+                        result = IngestionResult(path, error=traceback.format_exc())
+                    yield _log_result(result)
+
+def _log_result(result):
+    if result.error:
+        log.error(f"Ingestion of document '{result.path}' failed:\n{result.error}")
+    return result
@@ -0,0 +1,114 @@
+"""
+Class to find the positions of all headers of a document in a single scan, so the chunk tree can be built from
+the positions instead of splitting the text of every chunk again on every level.
+"""
+import re
+from bisect import bisect_left
+from objects.chunk_objects.page_index import PageIndex
+
+class HeaderIndex:
+    """
+    Positions of the header candidates in the text of a document, grouped by the split criterion they belong to.
+    Each kind of header is scanned once over the whole text, the first time it is needed.
+    The splits of any part of the text are then computed from the positions and are identical to the result of
+    applying the split criterion to the text of that part, as long as the part does not start or end with whitespace.
+    """
+
+    # matches the same positions as the pattern r"(?<!#)\n" + heading + r"(?!#)" of each of the markdown headings,
+    # the number of hashes tells which heading matched
+    MARKDOWN_HEADING_PATTERN = re.compile(r"(?<!#)\n(#{1,4}) (?!#)")
+    # same pattern as in ChunkHandler.split_by_bold_headers, but capturing the bold text to know where it ends
+    BOLD_HEADER_PATTERN = re.compile(r"(?=(\*\*.*?\*\*))")
+    # same pattern as in ChunkHandler.split_by_short_lines_that_might_be_headers
+    SHORT_LINE_PATTERN = re.compile(r"(?<=\n\n)(\w+(?: \w+){0,3})(?=\n\n)")
+
+    def __init__(self, text, page_index:PageIndex=None):
+        """
+        @param page_index: the page markers of the same text, e.g. the page index of the document. Built on first use if not given.
+        """
+        self.text = text
+        # each index is a pair of sorted lists with the start and end positions of the matches
+        self._markdown_headings = None
+        self._bold_headers = None
+        self._short_lines = None
+        self._page_index = page_index if page_index is not None and page_index.text is text else None
+
+    @property
+    def page_index(self):
+        """The page markers of the indexed text, to get the page numbers of the splits from their spans."""
+        if self._page_index is None:
+            self._page_index = PageIndex(self.text)
+        return self._page_index
+
+    def _get_markdown_headings(self, heading):
+        if self._markdown_headings is None:
+            self._markdown_headings = {}
+            for match in HeaderIndex.MARKDOWN_HEADING_PATTERN.finditer(self.text):
+                starts, ends = self._markdown_headings.setdefault(match.group(1) + ' ', ([], []))
+                starts.append(match.start())
+                ends.append(match.end())
+        return self._markdown_headings.get(heading, ([], []))
+
+    def _get_bold_headers(self):
+        if self._bold_headers is None:
+            self._bold_headers = ([], [])
+            for match in HeaderIndex.BOLD_HEADER_PATTERN.finditer(self.text):
+                self._bold_headers[0].append(match.start())
+                self._bold_headers[1].append(match.end(1))
+        return self._bold_headers
+
+    def _get_short_lines(self):
+        if self._short_lines is None:
+            self._short_lines = ([], [])
+            for match in HeaderIndex.SHORT_LINE_PATTERN.finditer(self.text):
+                self._short_lines[0].append(match.start())
+                self._short_lines[1].append(match.end())
+        return self._short_lines
+
+    @staticmethod
+    def _matches_within(index, min_start, max_end):
+        """Yield the (start, end) of the indexed matches that start at min_start or later and end at max_end or earlier."""
+        starts, ends = index
+        i = bisect_left(starts, min_start)
+        # the end positions are sorted as well, so we can stop at the first match ending too late
+        while i < len(starts) and ends[i] <= max_end:
+            yield starts[i], ends[i]
+            i += 1
+
+    def split_by_markdown_heading(self, heading, start, end):
+        """
+        Spans of the splits of text[start:end] by a markdown heading such as '## '.
+        Identical to re.split(r"(?<!#)\n" + heading + r"(?!#)", text[start:end]).
+        """
+        spans = []
+        split_start = start
+        for match_start, match_end in HeaderIndex._matches_within(self._get_markdown_headings(heading), start, end):
+            spans.append((split_start, match_start))
+            split_start = match_end
+        spans.append((split_start, end))
+        return spans
+
+    def split_by_bold_headers(self, start, end):
+        """
+        Spans of the splits of text[start:end] by bold headers with whitespace stripped and empty splits removed.
+        Identical to ChunkHandler.split_by_bold_headers(text[start:end]).
+        """
+        # the lookahead must find the closing asterisks within the part of the text
+        positions = [match_start for match_start, _ in HeaderIndex._matches_within(self._get_bold_headers(), start, end)]
+        spans = []
+        for split_start, split_end in zip([start] + positions, positions + [end]):
+            split = self.text[split_start:split_end]
+            stripped_split = split.strip()
+            if stripped_split:
+                split_start += len(split) - len(split.lstrip())
+                spans.append((split_start, split_start + len(stripped_split)))
+        return spans
+
+    def split_by_short_lines_that_might_be_headers(self, start, end):
+        """
+        Spans of the splits of text[start:end] by short lines that might be headers.
+        Identical to ChunkHandler.split_by_short_lines_that_might_be_headers(text[start:end]).
+        """
+        # the line breaks before and after the short line must be within the part of the text
+        positions = [match_start for match_start, _ in HeaderIndex._matches_within(self._get_short_lines(), start + 2, end - 2)]
+        return list(zip([start] + positions, positions + [end]))
@@ -0,0 +1,114 @@
+"""
+Class to find the page markers of a document in a single scan. Page count, missing pages and the page numbers
+of the chunks are computed from the sorted positions of the markers instead of scanning the text again.
+"""
+import re
+from bisect import bisect_left
+
+class PageIndex:
+    """
+    Sorted positions and numbers of the '[PAGE n]' markers in the text of a document.
+    The page-number heuristics of the chunking are defined here as well.
+    """
+
+    # same pattern as in ChunkHandler.extract_page_numbers, the line breaks around a marker belong to the marker
+    PAGE_MARKER_PATTERN = re.compile(r'\n*\[PAGE (\d+)\]\n*')
+
+    def __init__(self, text):
+        self.text = text
+        # positions of the '[' and after the ']' of each marker and the page number as written in the marker
+        self.marker_starts = []
+        self.marker_ends = []
+        self.page_number_strings = []
+        for match in PageIndex.PAGE_MARKER_PATTERN.finditer(text):
+            self.marker_starts.append(match.start(1) - len('[PAGE '))
+            self.marker_ends.append(match.end(1) + len(']'))
+            self.page_number_strings.append(match.group(1))
+        self.page_numbers = [int(page) for page in self.page_number_strings]
+        # in most documents, the pages are in order. Then the smallest and biggest page number of a part of the text are its first and last marker
+        self._pages_in_order = all(previous <= page for previous, page in zip(self.page_numbers, self.page_numbers[1:]))
+
+
+    def get_page_count(self):
+        """The page count is the biggest page number of the document, or 1 if there are no page markers."""
+        return max(self.page_numbers) if len(self.page_numbers) > 0 else 1
+
+
+    def get_missing_pages(self):
+        """The pages from 1 to the page count that do not have a page marker."""
+        included_pages = set(self.page_number_strings)
+        return [page for page in range(1, self.get_page_count()+1) if str(page) not in included_pages]
+
+
+    def _markers_within(self, start, end):
+        """Index range of the markers that are completely within text[start:end]."""
+        first = bisect_left(self.marker_starts, start)
+        # the markers do not overlap, so their ends are sorted as well
+        last = bisect_left(self.marker_ends, end + 1, lo=first)
+        return first, last
+
+
+    def get_chunk_page_number(self, start, end, current_page_number, can_start_with_marker=True):
+        """
+        Page number of the chunk with the text text[start:end] and the page number the next chunk starts on.
+        @param current_page_number: the page number the previous chunk ended on
+        @param can_start_with_marker: False if the text of the chunk starts with something that is not part of the indexed text, e.g. a re-added heading
+        """
+        first, last = self._markers_within(start, end)
+        if first == last:
+            return PageIndex.get_page_number_from_markers(None, None, False, current_page_number)
+        if self._pages_in_order:
+            min_page, max_page = self.page_numbers[first], self.page_numbers[last-1]
+        else:
+            min_page, max_page = min(self.page_numbers[first:last]), max(self.page_numbers[first:last])
+        starts_with_marker = can_start_with_marker and self.marker_starts[first] == start \
+            and self.text.startswith(f'[PAGE {self.page_numbers[first]}]', start)
+        return PageIndex.get_page_number_from_markers(min_page, max_page, starts_with_marker, current_page_number)
+
+
+    @staticmethod
+    def get_page_number_from_markers(min_page, max_page, starts_with_marker, current_page_number):
+        """
+        Page number of a chunk from the smallest and biggest page marker in its text, and the page number the next chunk starts on.
+        Chunks without page markers are on the page the previous chunk ended on.
+        """
+        page_number = current_page_number
+        # use the smallest extracted number of the previous page number
+        if min_page is not None:
+            page_number = min_page
+            # subsctract 1 as the extracted page number indicate the start of the NEXT page
+            # don't substract if it is the first page
+            # TODO: might be a bug, make sure, we do not subsctract -1 too often when a split does not contain page info
+            if page_number > 1 and not starts_with_marker: page_number -= 1
+        # set the maximum extracted page to current page number
+        next_page_number = max_page if max_page is not None else page_number
+        return page_number, next_page_number
+
+
+    @staticmethod
+    def get_first_line_without_markers(text):
+        """
+        First line of the text without page markers, identical to
+        re.sub(PAGE_MARKER_PATTERN, '', text).strip().split('\\n', maxsplit=1)[0],
+        and if the cleaned text has more than one line. Only the text up to the end of the first line is cleaned.
+        """
+        cleaned_text = ''
+        position = 0
+        for match in PageIndex.PAGE_MARKER_PATTERN.finditer(text):
+            cleaned_text += text[position:match.start()]
+            position = match.end()
+            first_line = PageIndex._get_first_line(cleaned_text)
+            if first_line is not None:
+                return first_line, True
+        cleaned_text = (cleaned_text + text[position:]).strip()
+        return cleaned_text.split('\n', maxsplit=1)[0], '\n' in cleaned_text
+
+
+    @staticmethod
+    def _get_first_line(cleaned_text):
+        """The first line of the stripped text, if it is followed by more text. Otherwise None, as the rest of the text might be whitespace only."""
+        cleaned_text = cleaned_text.lstrip()
+        line_break = cleaned_text.find('\n')
+        if line_break >= 0 and not cleaned_text[line_break:].isspace():
+            return cleaned_text[:line_break]
+        return None
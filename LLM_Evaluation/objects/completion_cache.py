@@ -0,0 +1,177 @@
+"""
+In this module, we define the CompletionCache class. It persists chat-completion answers on disk, so a repeated
+or crashed run can replay identical requests instead of sending them to the model again.
+"""
+import json
+import time
+import hashlib
+import threading
+from objects.utils.utils import connect_sqlite
+
+
+class CompletionCache:
+    """A content-addressed on-disk cache for chat completions, stored in a SQLite database.
+
+    The key of an entry is the hash of the endpoint, the deployment and the canonicalized payload, so only requests
+    to the same endpoint with the same model, messages and sampling parameters hit the same entry.
+
+    Attributes:
+        path (str): The path to the SQLite database file.
+        max_size_bytes (int): The maximum total size of the cached answers. Least recently used entries are evicted first.
+        max_age_seconds (float): The maximum age of an entry before it is evicted.
+        hits (int): The number of lookups that were answered from the cache.
+        misses (int): The number of lookups that were not found in the cache.
+    """
+
+    def __init__(self, path, max_size_bytes=None, max_age_seconds=None):
+        """
+        Args:
+            path (str): The path to the SQLite database file. It is created if it does not exist.
+            max_size_bytes (int, optional): The maximum total size of the cached answers. Defaults to None (no limit).
+            max_age_seconds (float, optional): The maximum age of an entry in seconds. Defaults to None (no limit).
+        """
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        # the connection is shared by the worker threads of the async generation, so access is serialized by a lock
+        self._lock = threading.Lock()
+        self._connection = connect_sqlite(path)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                deployment TEXT,
+                content TEXT,
+                size INTEGER,
+                created_at REAL,
+                last_accessed REAL
+            )""")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(deployment, payload, base_url=None):
+        """Builds the cache key from the endpoint, the deployment and the canonicalized payload.
+
+        Args:
+            deployment (str): The name of the model deployment.
+            payload (dict): The chat-completion payload.
+            base_url (str, optional): The base URL of the service, as the same deployment name may exist on several endpoints. Defaults to None.
+
+        Returns:
+            str: The hex digest of the SHA-256 hash.
+        """
+        key = {"deployment": deployment, "payload": payload}
+        if base_url is not None:
+            key["base_url"] = base_url
+        canonical = json.dumps(key,
+                               sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, deployment, payload, base_url=None):
+        """Looks up the cached answer of a request.
+
+        Args:
+            deployment (str): The name of the model deployment.
+            payload (dict): The chat-completion payload.
+            base_url (str, optional): The base URL of the service. Defaults to None.
+
+        Returns:
+            str: The cached answer or None if the request is not cached or the entry has expired.
+        """
+        key = self.make_key(deployment, payload, base_url)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age_seconds is not None and now - row[1] > self.max_age_seconds:
+                self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE completions SET last_accessed = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, deployment, payload, content, base_url=None):
+        """Stores the answer of a request and evicts old entries if the limits are exceeded.
+        Answers without content, e.g. filtered by the content filter, are not stored.
+
+        Args:
+            deployment (str): The name of the model deployment.
+            payload (dict): The chat-completion payload.
+            content (str): The answer of the model.
+            base_url (str, optional): The base URL of the service. Defaults to None.
+        """
+        if content is None:
+            return
+        key = self.make_key(deployment, payload, base_url)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)",
+                (key, deployment, content, len(content.encode("utf-8")), now, now))
+            self._evict(now)
+            self._connection.commit()
+
+    def delete(self, deployment, payload, base_url=None):
+        """Removes the answer of a request, e.g. a cached answer that turned out to be malformed.
+
+        Args:
+            deployment (str): The name of the model deployment.
+            payload (dict): The chat-completion payload.
+            base_url (str, optional): The base URL of the service. Defaults to None.
+        """
+        key = self.make_key(deployment, payload, base_url)
+        with self._lock:
+            self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+            self._connection.commit()
+
+    def evict(self):
+        """Removes expired entries and the least recently used entries above the size limit."""
+        with self._lock:
+            self._evict(time.time())
+            self._connection.commit()
+
+    def _evict(self, now):
+        """Removes expired entries and the least recently used entries above the size limit. The caller holds the lock."""
+        if self.max_age_seconds is not None:
+            self._connection.execute("DELETE FROM completions WHERE created_at < ?", (now - self.max_age_seconds,))
+        if self.max_size_bytes is not None:
+            total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+            if total_size > self.max_size_bytes:
+                rows = self._connection.execute(
+                    "SELECT key, size FROM completions ORDER BY last_accessed ASC").fetchall()
+                keys_to_delete = []
+                for key, size in rows:
+                    if total_size <= self.max_size_bytes:
+                        break
+                    keys_to_delete.append((key,))
+                    total_size -= size
+                self._connection.executemany("DELETE FROM completions WHERE key = ?", keys_to_delete)
+
+    def stats(self):
+        """Returns the hit and miss counters and the current size of the cache.
+
+        Returns:
+            dict: The number of hits, misses and entries and the total size in bytes.
+        """
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "size_bytes": size}
+
+    def clear(self):
+        """Removes all entries from the cache and resets the counters."""
+        with self._lock:
+            self._connection.execute("DELETE FROM completions")
+            self._connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        """Closes the connection to the database."""
+        self._connection.close()
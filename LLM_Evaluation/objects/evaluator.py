@@ -1,10 +1,62 @@
 from datasets import Dataset
-import requests
-import time
 import ast
+import pandas as pd
+from objects.llm_client import LLMClient
+from objects.batch_job import make_batch_request, make_custom_id
+from objects.run_ledger import RunLedger
 
 class Evaluator:
-    def __init__(self, question, true_answer, generated_answer, model, api_key, document=None):
+    # the rubric of the correctness evaluation, shared by the single and the batch evaluation
+    CORRECTNESS_RUBRIC = """
+            You are tasked with evaluating the quality of answers generated by a Retrieval-Augmented Generation (RAG)-based chatbot designed to answer product-related questions in the validation service department of a pharmaceutical company. The evaluation involves comparing the generated answers against the true answers provided by experts.
+            
+            Your goal is to evaluate how well the generated answers match the true answers based on the following criteria:
+            
+            - Accuracy: How closely does the generated answer align with the true answer in terms of factual correctness?
+            - Completeness: Does the generated answer fully address the question, or does it omit important details?
+            - Clarity: Is the generated answer clear and understandable, or is it ambiguous or confusing?
+            - Relevance: Is the generated answer directly relevant to the question asked, or does it include unnecessary or off-topic information?
+            
+            Instructions:
+            
+            Compare the true answer and the generated answer using the criteria above.
+            Start by writing an Evaluation Text that provides a detailed comparison, explaining why the generated answer received a particular score. Your reasoning should highlight the strengths and weaknesses of the generated answer in relation to the true answer.
+            Based on the comparison, assign an Evaluation Score on a scale from 1 to 5:
+                5: The generated answer is nearly identical to the true answer in accuracy, completeness, clarity, and relevance.
+                4: The generated answer is very close to the true answer but may miss some minor details or contain slight inaccuracies.
+                3: The generated answer provides a reasonably correct response but has noticeable gaps in completeness, clarity, or relevance.
+                2: The generated answer contains significant inaccuracies or omissions but has some elements that are correct or relevant.
+                1: The generated answer is mostly incorrect or irrelevant.
+            
+"""
+    CORRECTNESS_OUTPUT_EXAMPLE = """            Output Example:
+            
+            At the end of the evaluation, return the result as a JSON object with the following structure:
+            
+            {
+            "reasoning": "Your detailed comparison goes here, explaining why the generated answer received its score based on accuracy, completeness, clarity, and relevance. It should be a maximum of five sentences.",
+            "score": "Your score from 1 to 5 goes here."
+            }
+
+            """
+    SCORE_FORMAT = """
+                Your answer is always of exactly the format {"score": "the integer score", "reasoning": "the reasoning"}.
+                """
+    BATCH_OUTPUT_EXAMPLE = """
+            Output Example:
+            
+            You are given several items, each with an id. Evaluate each item independently of the others and return one result per item as a list of JSON objects with the following structure:
+            
+            [
+            {"id": "The id of the item", "reasoning": "Your detailed comparison for this item. It should be a maximum of five sentences.", "score": "Your score from 1 to 5 for this item."}
+            ]
+
+            """
+    BATCH_SCORE_FORMAT = """
+                Your answer is always of exactly the format [{"id": the integer id, "score": "the integer score", "reasoning": "the reasoning"}, ...] with exactly one entry per item.
+                """
+
+    def __init__(self, question, true_answer, generated_answer, model, api_key, document=None, client=None, ledger=None):
         """
         Initializes the Evaluator class.
 
@@ -15,6 +67,9 @@ class Evaluator:
             model (str): The model used for generating answers.
             api_key (str): The API key for accessing the model.
             document (str, optional): Additional document for context. Defaults to None.
+            client (LLMClient, optional): A shared client to send the requests with. Defaults to the shared client of the api_key, see LLMClient.shared.
+            ledger (RunLedger, optional): A ledger of the run. Recorded evaluations are not requested again,
+                so a crashed run can be restarted. Defaults to None.
         """
         self.question = question
         self.true_answer = true_answer
@@ -22,6 +77,8 @@ class Evaluator:
         self.document = document
         self.model = model
         self.api_key = api_key
+        self.client = client or LLMClient.shared(api_key)
+        self.ledger = ledger
 
     def _evaluate(self, message, instruction):
         """
@@ -36,32 +93,31 @@ class Evaluator:
 
         Raises:
             KeyError: If the 'choices' key is missing or empty in the response.
+            HTTPError: If the request to the API fails.
         """
-        headers = {"Content-Type": "application/json", 
-                   "api-key": self.api_key}
-        payload = {
+        payload = Evaluator._build_payload(message, instruction, Evaluator.SCORE_FORMAT)
+        return ast.literal_eval(self.client.chat_completion(self.model, payload, validate=ast.literal_eval))
+
+    @staticmethod
+    def _build_payload(message, instruction, output_format):
+        """
+        Builds the chat-completion payload for an evaluation.
+
+        Args:
+            message (str): The message containing the question and answers.
+            instruction (str): The instruction for evaluating the answer.
+            output_format (str): The instruction describing the format of the answer.
+
+        Returns:
+            dict: The payload with the messages and sampling parameters.
+        """
+        return {
             "messages": [
                 {"role": "system", "content": [{"type": "text", "text": message}]},
-                {"role": "user", "content": [{"type": "text", "text": instruction+ """
-                Your answer is always of exactly the format {"score": "the integer score", "reasoning": "the reasoning"}.
-                """}]}
+                {"role": "user", "content": [{"type": "text", "text": instruction + output_format}]}
             ],
             "temperature": 0.7, "top_p": 0.95, "max_tokens": 4096
         }
-        GPT4V_ENDPOINT = f"https://appprodsagopenaigpt4weu.openai.azure.com/openai/deployments/{self.model}/chat/completions?api-version=2024-02-15-preview"
-
-        while True:
-            response = requests.post(GPT4V_ENDPOINT, headers=headers, json=payload)
-            if response.status_code == 200:
-                response_json = response.json()
-                if "choices" in response_json and len(response_json["choices"]) > 0:
-                    return ast.literal_eval(response_json["choices"][0]["message"]["content"])
-                else:
-                    raise KeyError("The 'choices' key is missing or empty in the response.")
-            elif response.status_code == 429:
-                time.sleep(60)
-            else:
-                response.raise_for_status()
 
     def evaluate_correctness(self):
         """
@@ -70,44 +126,189 @@ class Evaluator:
         Returns:
             dict: The evaluation result containing the score and reasoning.
         """
-        message = f"""
+        if self.ledger is None:
+            return self._evaluate_correctness()
+        key = make_custom_id("eval", self.question, self.true_answer, self.generated_answer)
+        return self.ledger.run(RunLedger.EVALUATION, key, self._evaluate_correctness)
+
+    def _evaluate_correctness(self):
+        """Evaluates the correctness of the generated answer without looking it up in the ledger."""
+        message = Evaluator._build_correctness_message(self.question, self.true_answer, self.generated_answer)
+        instruction = Evaluator.CORRECTNESS_RUBRIC + Evaluator.CORRECTNESS_OUTPUT_EXAMPLE
+        return self._evaluate(message, instruction)
+
+    @staticmethod
+    def _build_correctness_message(question, true_answer, generated_answer):
+        """
+        Builds the message containing the question and answers of a single evaluation.
+
+        Args:
+            question (str): The question being evaluated.
+            true_answer (str): The true answer provided by experts.
+            generated_answer (str): The answer generated by the model.
+
+        Returns:
+            str: The message for the evaluation.
+        """
+        return f"""
             Here are the question and answers for evaluation: 
-            Question: {self.question}, 
-            True answer: {self.true_answer}, 
-            Generated answer: {self.generated_answer}.
+            Question: {question}, 
+            True answer: {true_answer}, 
+            Generated answer: {generated_answer}.
             """
-        instruction = """
-            You are tasked with evaluating the quality of answers generated by a Retrieval-Augmented Generation (RAG)-based chatbot designed to answer product-related questions in the validation service department of a pharmaceutical company. The evaluation involves comparing the generated answers against the true answers provided by experts.
-            
-            Your goal is to evaluate how well the generated answers match the true answers based on the following criteria:
-            
-            - Accuracy: How closely does the generated answer align with the true answer in terms of factual correctness?
-            - Completeness: Does the generated answer fully address the question, or does it omit important details?
-            - Clarity: Is the generated answer clear and understandable, or is it ambiguous or confusing?
-            - Relevance: Is the generated answer directly relevant to the question asked, or does it include unnecessary or off-topic information?
-            
-            Instructions:
-            
-            Compare the true answer and the generated answer using the criteria above.
-            Start by writing an Evaluation Text that provides a detailed comparison, explaining why the generated answer received a particular score. Your reasoning should highlight the strengths and weaknesses of the generated answer in relation to the true answer.
-            Based on the comparison, assign an Evaluation Score on a scale from 1 to 5:
-                5: The generated answer is nearly identical to the true answer in accuracy, completeness, clarity, and relevance.
-                4: The generated answer is very close to the true answer but may miss some minor details or contain slight inaccuracies.
-                3: The generated answer provides a reasonably correct response but has noticeable gaps in completeness, clarity, or relevance.
-                2: The generated answer contains significant inaccuracies or omissions but has some elements that are correct or relevant.
-                1: The generated answer is mostly incorrect or irrelevant.
-            
-            Output Example:
-            
-            At the end of the evaluation, return the result as a JSON object with the following structure:
-            
-            {
-            "reasoning": "Your detailed comparison goes here, explaining why the generated answer received its score based on accuracy, completeness, clarity, and relevance. It should be a maximum of five sentences.",
-            "score": "Your score from 1 to 5 goes here."
-            }
 
-            """
-        return self._evaluate(message, instruction)
+    @classmethod
+    def evaluate_correctness_batch(cls, rows, model, api_key, batch_size=10, client=None, ledger=None):
+        """
+        Evaluates the correctness of several generated answers with one request per batch of rows,
+        so the rubric is only sent once per batch. Each result of a batch is validated and rows
+        with a missing or malformed result are evaluated again with a single-item request.
+        Rows with an evaluation in the ledger are not sent again and new evaluations are recorded as each batch completes.
+
+        Args:
+            rows (list): The (question, true_answer, generated_answer) triples to evaluate.
+            model (str): The model used for evaluating the answers.
+            api_key (str): The API key for accessing the model.
+            batch_size (int, optional): The number of rows evaluated in one request. Defaults to 10.
+            client (LLMClient, optional): A shared client to send the requests with. Defaults to the shared client of the api_key, see LLMClient.shared.
+            ledger (RunLedger, optional): A ledger of the run. Defaults to None.
+
+        Returns:
+            list: The evaluation results containing the score and reasoning, in the order of the rows.
+        """
+        client = client or LLMClient.shared(api_key)
+        rows = list(rows)
+        results = [None] * len(rows)
+        if ledger is not None:
+            for i, row in enumerate(rows):
+                results[i] = ledger.get(RunLedger.EVALUATION, make_custom_id("eval", *row))
+        remaining_indices = [i for i, result in enumerate(results) if result is None]
+        for batch_start in range(0, len(remaining_indices), batch_size):
+            batch_indices = remaining_indices[batch_start:batch_start + batch_size]
+            batch = [rows[i] for i in batch_indices]
+            batch_results = cls._evaluate_correctness_of_batch(batch, model, client)
+            for i, (question, true_answer, generated_answer), result in zip(batch_indices, batch, batch_results):
+                if result is None:
+                    # fall back to a single-item request for rows the batch did not answer correctly
+                    result = cls(question, true_answer, generated_answer, model, api_key, client=client, ledger=ledger).evaluate_correctness()
+                elif ledger is not None:
+                    ledger.record(RunLedger.EVALUATION, make_custom_id("eval", question, true_answer, generated_answer), result)
+                results[i] = result
+        return results
+
+    @classmethod
+    def _evaluate_correctness_of_batch(cls, batch, model, client):
+        """
+        Evaluates one batch of rows with a single request.
+
+        Args:
+            batch (list): The (question, true_answer, generated_answer) triples to evaluate.
+            model (str): The model used for evaluating the answers.
+            client (LLMClient): The client to send the request with.
+
+        Returns:
+            list: The evaluation result of each row or None for the rows without a valid result.
+        """
+        payload = cls._build_payload(cls._build_batch_message(batch), cls.CORRECTNESS_RUBRIC + cls.BATCH_OUTPUT_EXAMPLE, cls.BATCH_SCORE_FORMAT)
+        try:
+            response = ast.literal_eval(client.chat_completion(model, payload, validate=ast.literal_eval))
+        except (ValueError, SyntaxError) as ex:
+            print("Batch evaluation returned a malformed answer, evaluating the items one by one:", ex)
+            return [None] * len(batch)
+        return cls._parse_batch_results(response, len(batch))
+
+    @staticmethod
+    def _build_batch_message(batch):
+        """
+        Builds the message listing all rows of a batch with their ids.
+
+        Args:
+            batch (list): The (question, true_answer, generated_answer) triples to evaluate.
+
+        Returns:
+            str: The message containing the questions and answers.
+        """
+        items = [f"""
+            Item {item_id}:
+            Question: {question},
+            True answer: {true_answer},
+            Generated answer: {generated_answer}.
+            """ for item_id, (question, true_answer, generated_answer) in enumerate(batch)]
+        return """
+            Here are the items with question and answers for evaluation:
+            """ + "".join(items)
+
+    @staticmethod
+    def _parse_batch_results(response, batch_length):
+        """
+        Maps the results of a batch answer back to its rows and validates each of them.
+
+        Args:
+            response (list): The parsed answer of the model.
+            batch_length (int): The number of rows in the batch.
+
+        Returns:
+            list: The evaluation result of each row or None for the rows without a valid result.
+        """
+        results = [None] * batch_length
+        if not isinstance(response, (list, tuple)):
+            return results
+        for item in response:
+            if not isinstance(item, dict) or not isinstance(item.get("reasoning"), str):
+                continue
+            try:
+                item_id = int(item.get("id"))
+                score = int(item.get("score"))
+            except (TypeError, ValueError):
+                continue
+            if 0 <= item_id < batch_length and 1 <= score <= 5 and results[item_id] is None:
+                results[item_id] = {"score": item["score"], "reasoning": item["reasoning"]}
+        return results
+
+    @classmethod
+    def build_batch_requests(cls, rows, model):
+        """
+        Builds one batch request per distinct row instead of sending the requests, for the offline batch mode.
+        Identical rows share one request, whose result ingest_batch_results joins back onto each of them.
+        Write them with batch_job.write_batch_file and read the results back with ingest_batch_results.
+
+        Args:
+            rows (list): The (question, true_answer, generated_answer) triples to evaluate.
+            model (str): The model used for evaluating the answers.
+
+        Returns:
+            list: The batch requests with a stable custom id per distinct row, in the order of the rows.
+        """
+        instruction = cls.CORRECTNESS_RUBRIC + cls.CORRECTNESS_OUTPUT_EXAMPLE
+        batch_requests = {}
+        for row in rows:
+            custom_id = make_custom_id("eval", *row)
+            if custom_id not in batch_requests:
+                batch_requests[custom_id] = make_batch_request(
+                    custom_id, model, cls._build_payload(cls._build_correctness_message(*row), instruction, cls.SCORE_FORMAT))
+        return list(batch_requests.values())
+
+    @staticmethod
+    def ingest_batch_results(rows, results):
+        """
+        Joins the results of a batch job back onto the evaluated rows.
+
+        Args:
+            rows (list): The (question, true_answer, generated_answer) triples the batch requests were built from.
+            results (dict): Maps the custom ids to the returned contents, as read by batch_job.read_batch_results.
+
+        Returns:
+            list: The evaluation result containing the score and reasoning of each row or None if the row has no valid result.
+        """
+        evaluations = []
+        for row in rows:
+            content = results.get(make_custom_id("eval", *row))
+            try:
+                evaluations.append(ast.literal_eval(content) if content is not None else None)
+            except (ValueError, SyntaxError) as ex:
+                print("Malformed batch result for question:", row[0], ex)
+                evaluations.append(None)
+        return evaluations
 
     def evaluate_relevance(self):
         """
@@ -115,19 +316,58 @@ class Evaluator:
         """
         pass
 
-    def evaluate_metrical_correctness(self):
+    def evaluate_metrical_correctness(self, llm=None, embeddings=None):
         """
         Evaluates the metrical correctness of the generated answer using predefined metrics.
+        To evaluate a whole run, use evaluate_metrical_correctness_batch, which builds a single dataset for all rows.
+
+        Args:
+            llm (optional): The LLM of the metrics, e.g. an AzureChatOpenAI. Defaults to the default of ragas.
+            embeddings (optional): The embeddings of the metrics. Defaults to the default of ragas.
 
         Returns:
             pandas.DataFrame: The evaluation scores.
         """
-        data_samples = {
-            'question': [self.question],
-            'answer': [self.generated_answer],
-            'ground_truth': [self.true_answer]
-        }
-        dataset = Dataset.from_dict(data_samples)
-        score = evaluate(dataset, metrics=[answer_correctness])
-        score.to_pandas()
-        return score
\ No newline at end of file
+        df = pd.DataFrame({'question': [self.question], 'answer': [self.true_answer], 'productai_response': [self.generated_answer]})
+        return Evaluator.evaluate_metrical_correctness_batch(df, llm=llm, embeddings=embeddings)
+
+    @staticmethod
+    def evaluate_metrical_correctness_batch(df, metrics=None, llm=None, embeddings=None, batch_size=None, max_workers=16,
+                                            question_column='question', true_column='answer', generated_column='productai_response'):
+        """
+        Evaluates the metrics of all rows of a run with one dataset and one ragas evaluation, instead of one dataset per row.
+        ragas runs the metric requests of all rows concurrently, with at most max_workers in flight.
+
+        Args:
+            df (pandas.DataFrame): The run with the questions, true answers and generated answers.
+            metrics (list, optional): The ragas metrics. Defaults to [answer_correctness].
+            llm (optional): The LLM of the metrics, e.g. an AzureChatOpenAI. Defaults to the default of ragas.
+            embeddings (optional): The embeddings of the metrics. Defaults to the default of ragas.
+            batch_size (int, optional): The number of rows whose requests are scheduled together. Defaults to None, all rows at once.
+            max_workers (int, optional): The maximum number of concurrent metric requests. Defaults to 16.
+            question_column (str, optional): The column of the questions. Defaults to 'question'.
+            true_column (str, optional): The column of the true answers. Defaults to 'answer'.
+            generated_column (str, optional): The column of the generated answers. Defaults to 'productai_response'.
+
+        Returns:
+            pandas.DataFrame: A copy of the run with one column per metric, NaN for the rows whose metric failed.
+        """
+        # ragas is only needed for the metrics, so it is imported when they are computed
+        from ragas import evaluate
+        from ragas.metrics import answer_correctness
+        from ragas.run_config import RunConfig
+
+        metrics = metrics or [answer_correctness]
+        df = df.reset_index(drop=True)
+        dataset = Dataset.from_dict({
+            'question': df[question_column].astype(str).tolist(),
+            'answer': df[generated_column].fillna('').astype(str).tolist(),
+            'ground_truth': df[true_column].fillna('').astype(str).tolist()
+        })
+        result = evaluate(dataset, metrics=metrics, llm=llm, embeddings=embeddings, batch_size=batch_size,
+                          run_config=RunConfig(max_workers=max_workers), raise_exceptions=False)
+        scores = result.to_pandas()
+        df = df.copy()
+        for metric in metrics:
+            df[metric.name] = scores[metric.name].to_numpy()
+        return df
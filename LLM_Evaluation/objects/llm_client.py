@@ -0,0 +1,220 @@
+"""
+In this module, we define the LLMClient class. It is the shared transport layer for all HTTP calls to the
+language model services used in the evaluation pipeline (Azure OpenAI chat completions and ProductAI).
+"""
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from objects.rate_limiter import RateLimiter
+from objects.call_metrics import CallMetrics
+
+# the endpoint can be overridden with an environment variable, e.g. to point the pipeline at benchmarks/fake_server.py
+AZURE_OPENAI_BASE_URL = os.environ.get("AZURE_OPENAI_BASE_URL", "https://appprodsagopenaigpt4weu.openai.azure.com")
+AZURE_OPENAI_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+
+
+class LLMClient:
+    """A reusable client that keeps its connections alive and pools them across calls and threads.
+
+    Attributes:
+        api_key (str): The API key for the Azure OpenAI service.
+        base_url (str): The base URL of the Azure OpenAI service.
+        api_version (str): The API version of the Azure OpenAI service.
+        timeout (tuple): The connect and read timeout in seconds for each request.
+        session (requests.Session): The session holding the connection pool.
+        cache (CompletionCache): The optional on-disk cache for chat completions.
+        rate_limiter (RateLimiter): The limiter pacing the requests and computing the back-off after rejected requests.
+        metrics (CallMetrics): The optional collector of the usage, latency and retries of each call.
+        retry_statuses (tuple): The status codes chat completions are retried on.
+    """
+
+    # the clients of the objects created without a client, one per API key
+    _shared_clients = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, api_key=None, base_url=AZURE_OPENAI_BASE_URL, api_version=AZURE_OPENAI_API_VERSION,
+                 timeout=(10, 300), pool_maxsize=16, cache=None, rate_limiter=None, metrics=None,
+                 retry_statuses=(429,)):
+        """
+        Args:
+            api_key (str, optional): The API key for the Azure OpenAI service. Only needed for chat completions. Defaults to None.
+            base_url (str, optional): The base URL of the Azure OpenAI service. Defaults to AZURE_OPENAI_BASE_URL.
+            api_version (str, optional): The API version of the Azure OpenAI service. Defaults to AZURE_OPENAI_API_VERSION.
+            timeout (tuple, optional): The connect and read timeout in seconds for each request. Defaults to (10, 300).
+            pool_maxsize (int, optional): The maximum number of connections kept alive per host. Should be at least the number of concurrent callers. Defaults to 16.
+            cache (CompletionCache, optional): A cache to replay identical chat completions from. Defaults to None (no caching).
+            rate_limiter (RateLimiter, optional): A limiter with the budgets of the deployments. Share it between clients using the same deployments. Defaults to a limiter without budgets, which only backs off after rejected requests.
+            metrics (CallMetrics, optional): A collector for one record per call. Share it between the clients of a run. Defaults to None (no metrics).
+            retry_statuses (tuple, optional): The status codes chat completions are retried on. Defaults to (429,).
+        """
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.api_version = api_version
+        self.timeout = timeout
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = metrics
+        self.retry_statuses = retry_statuses
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @classmethod
+    def shared(cls, api_key=None):
+        """Returns the client shared by all objects created without a client for an API key, so the notebooks that create
+        a new Evaluator per row still reuse the pooled connections instead of opening a new session per call.
+
+        Args:
+            api_key (str, optional): The API key for the Azure OpenAI service. Defaults to None, e.g. for ProductAI.
+
+        Returns:
+            LLMClient: The shared client of the API key, created with the default settings on first use.
+        """
+        with cls._shared_lock:
+            client = cls._shared_clients.get(api_key)
+            if client is None:
+                client = cls._shared_clients[api_key] = cls(api_key)
+            return client
+
+    def chat_completions_url(self, deployment):
+        """Builds the chat-completions endpoint of a deployment.
+
+        Args:
+            deployment (str): The name of the model deployment.
+
+        Returns:
+            str: The URL of the chat-completions endpoint.
+        """
+        return f"{self.base_url}/openai/deployments/{deployment}/chat/completions?api-version={self.api_version}"
+
+    def post(self, url, payload, headers=None, retry_statuses=(429,), rate_limit_key=None):
+        """Sends a JSON payload and retries on the given status codes until the request succeeds.
+        The request is paced by the rate limiter and each retry waits for the Retry-After header or an exponential back-off.
+
+        Args:
+            url (str): The URL to send the request to.
+            payload (dict): The JSON payload of the request.
+            headers (dict, optional): The headers to include in the request. Defaults to None.
+            retry_statuses (tuple, optional): The status codes to retry on. Defaults to (429,).
+            rate_limit_key (str, optional): The deployment or service whose budget the request counts against. Defaults to the url.
+
+        Returns:
+            tuple: The successful response and the time in seconds the successful attempt took.
+
+        Raises:
+            HTTPError: If the request fails with a status code that is not retried.
+        """
+        response, response_time, record = self._send(url, payload, headers, retry_statuses, rate_limit_key)
+        self._collect(record)
+        return response, response_time
+
+    def _send(self, url, payload, headers, retry_statuses, rate_limit_key):
+        """Sends a request with retries as described in post and measures it.
+        Failed calls are collected before the error is raised, successful calls are returned with their record,
+        so the caller can add the token usage before collecting it.
+
+        Returns:
+            tuple: The successful response, the time in seconds the successful attempt took and the metrics record of the call.
+        """
+        rate_limit_key = rate_limit_key or url
+        tokens = self.rate_limiter.estimate_tokens(payload)
+        record = CallMetrics.new_record(rate_limit_key, url)
+        call_start = time.time()
+
+        # Implemented to handle rate limiting by waiting before retrying and catching HTTP errors.
+        attempt = 0
+        try:
+            while True:
+                wait_start = time.time()
+                self.rate_limiter.acquire(rate_limit_key, tokens)
+                record["rate_limit_wait"] += time.time() - wait_start
+                time_start = time.time()
+                response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout)
+                response_time = time.time() - time_start
+                record["status"] = response.status_code
+                record["latency"] = response_time
+                if response.status_code in retry_statuses:
+                    delay = self.rate_limiter.retry_delay(rate_limit_key, response, attempt)
+                    print("HTTP Error:", response.status_code, f"\nRetrying in {delay:.1f} seconds")
+                    time.sleep(delay)
+                    record["retry_sleep"] += delay
+                    attempt += 1
+                    record["retries"] = attempt
+                    continue
+                response.raise_for_status()
+                record["total_time"] = time.time() - call_start
+                return response, response_time, record
+        except Exception as ex:
+            record["error"] = repr(ex)
+            record["total_time"] = time.time() - call_start
+            self._collect(record)
+            raise
+
+    def _collect(self, record):
+        if self.metrics is not None:
+            self.metrics.collect(record)
+
+    def chat_completion(self, deployment, payload, validate=None):
+        """Sends a chat-completion request to a deployment and returns the content of the first choice.
+        If the client has a cache, identical requests are answered from the cache.
+
+        Args:
+            deployment (str): The name of the model deployment.
+            payload (dict): The chat-completion payload with the messages and sampling parameters.
+            validate (callable, optional): Parses the content and raises if it is malformed, e.g. ast.literal_eval.
+                Only valid contents are cached, so a rerun requests a malformed answer again instead of replaying it,
+                and cached contents that fail it are dropped and requested again. Defaults to None.
+
+        Returns:
+            str: The content of the message of the first choice, None if the answer has no content.
+
+        Raises:
+            KeyError: If the 'choices' key is missing or empty in the response.
+            HTTPError: If the request to the API fails.
+        """
+        url = self.chat_completions_url(deployment)
+        if self.cache is not None:
+            content = self.cache.get(deployment, payload, self.base_url)
+            if content is not None and not self._is_valid(content, validate):
+                self.cache.delete(deployment, payload, self.base_url)
+                content = None
+            if content is not None:
+                record = CallMetrics.new_record(deployment, url)
+                record["cache_hit"] = True
+                self._collect(record)
+                return content
+
+        headers = {"Content-Type": "application/json",
+                   "api-key": self.api_key}
+        response, _, record = self._send(url, payload, headers, self.retry_statuses, deployment)
+        try:
+            response_json = response.json()
+            CallMetrics.add_usage(record, response_json.get("usage"))
+        except ValueError as ex:
+            record["error"] = repr(ex)
+            raise
+        finally:
+            self._collect(record)
+        if "choices" in response_json and len(response_json["choices"]) > 0:
+            content = response_json["choices"][0]["message"]["content"]
+            if self.cache is not None and content is not None:
+                # a malformed content raises here, before it is cached
+                if validate is not None:
+                    validate(content)
+                self.cache.set(deployment, payload, content, self.base_url)
+            return content
+        else:
+            raise KeyError("The 'choices' key is missing or empty in the response.")
+
+    @staticmethod
+    def _is_valid(content, validate):
+        if validate is None:
+            return True
+        try:
+            validate(content)
+            return True
+        except Exception:
+            return False
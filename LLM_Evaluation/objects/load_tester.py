@@ -0,0 +1,172 @@
+"""
+In this module, we define the ProductAILoadTester class. It replays the questions of a QA-pair run against the
+ProductAI chat endpoint under concurrent load and reports how latency, throughput and error rates change with the load.
+"""
+import time
+import random
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import requests
+from objects.llm_client import LLMClient
+from objects.product_ai_prompter import ProductAIPrompter, PRODUCTAI_URL
+
+
+class ProductAILoadTester:
+    """Sends the questions of a QA-pair run to ProductAI at increasing load levels and measures each request.
+
+    Requests are not retried, so rejected requests show up in the error and 429 rates instead of in the latency.
+    Two load models are supported:
+        - closed loop: a fixed number of concurrent users, each sending the next question as soon as the previous answer arrived.
+        - open loop: requests arrive at a fixed rate, independent of how fast the service answers. The latency of a request
+          is measured from its scheduled start, so requests waiting for a free connection count as slow.
+
+    Attributes:
+        questions (list): The questions that are replayed in order, from the start again when all have been sent.
+        samples (list): One record per request of all load levels run so far.
+    """
+
+    def __init__(self, questions, cookie, url=PRODUCTAI_URL, timeout=(10, 300)):
+        """
+        Args:
+            questions (list or str): The questions or the path to a QA-pair parquet with a 'question' column.
+            cookie (str): The cookie to authenticate at ProductAI.
+            url (str, optional): The URL of the chat endpoint, e.g. of a local stub server. Defaults to PRODUCTAI_URL.
+            timeout (tuple, optional): The connect and read timeout in seconds for each request. Defaults to (10, 300).
+        """
+        if isinstance(questions, str):
+            questions = pd.read_parquet(questions, columns=["question"])["question"].tolist()
+        if len(questions) == 0:
+            raise ValueError("The load test needs at least one question.")
+        self.questions = list(questions)
+        self.cookie = cookie
+        self.url = url
+        self.timeout = timeout
+        self.samples = []
+
+    def _new_prompter(self, max_connections):
+        """Creates a prompter without retries and with a connection pool for the given number of concurrent requests."""
+        client = LLMClient(timeout=self.timeout, pool_maxsize=max_connections)
+        return ProductAIPrompter(self.cookie, client=client, url=self.url, retry_statuses=())
+
+    def _send(self, prompter, question, mode, level, scheduled_start=None):
+        """Sends one question and returns its record. Errors are recorded instead of raised."""
+        start = time.time()
+        status, error = 200, None
+        try:
+            prompter.prompt_productai(question)
+        except requests.HTTPError as ex:
+            status, error = ex.response.status_code if ex.response is not None else None, repr(ex)
+        except Exception as ex:
+            status, error = None, repr(ex)
+        end = time.time()
+        return {
+            "mode": mode, "level": level, "start": start, "end": end,
+            "latency": end - (scheduled_start if scheduled_start is not None else start),
+            "service_time": end - start, "status": status, "error": error
+        }
+
+    def run_closed_loop(self, concurrency_levels, requests_per_level=100):
+        """Runs one load level per number of concurrent users.
+
+        Args:
+            concurrency_levels (list): The numbers of concurrent users, e.g. [1, 2, 4, 8, 16].
+            requests_per_level (int, optional): The number of requests sent at each level. Defaults to 100.
+
+        Returns:
+            pandas.DataFrame: The report with one row per level, see report.
+        """
+        for concurrency in concurrency_levels:
+            prompter = self._new_prompter(concurrency)
+            questions = itertools.islice(itertools.cycle(self.questions), requests_per_level)
+            lock = threading.Lock()
+            samples = []
+
+            def user():
+                while True:
+                    with lock:
+                        question = next(questions, None)
+                    if question is None:
+                        return
+                    sample = self._send(prompter, question, "closed", concurrency)
+                    with lock:
+                        samples.append(sample)
+
+            users = [threading.Thread(target=user, daemon=True) for _ in range(concurrency)]
+            for thread in users:
+                thread.start()
+            for thread in users:
+                thread.join()
+            self.samples.extend(samples)
+            print(f"Closed loop with {concurrency} users finished.")
+        return self.report("closed")
+
+    def run_open_loop(self, arrival_rates, duration=60, max_in_flight=256, poisson=True, seed=None):
+        """Runs one load level per arrival rate.
+
+        Args:
+            arrival_rates (list): The requests per second, e.g. [0.5, 1, 2, 4].
+            duration (float, optional): The seconds requests arrive at each level. Defaults to 60.
+            max_in_flight (int, optional): The maximum number of requests sent at the same time. Defaults to 256.
+            poisson (bool, optional): Whether the gaps between requests are random with the given mean rate, like independent users,
+                or constant. Defaults to True.
+            seed (int, optional): The seed of the random gaps. Defaults to None.
+
+        Returns:
+            pandas.DataFrame: The report with one row per level, see report.
+        """
+        rng = random.Random(seed)
+        for rate in arrival_rates:
+            prompter = self._new_prompter(max_in_flight)
+            questions = itertools.cycle(self.questions)
+            futures = []
+            with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+                level_start = time.time()
+                scheduled_start = level_start
+                while scheduled_start < level_start + duration:
+                    # wait for the scheduled start, the requests in flight are not waited for
+                    time.sleep(max(0.0, scheduled_start - time.time()))
+                    futures.append(executor.submit(self._send, prompter, next(questions), "open", rate, scheduled_start))
+                    scheduled_start += rng.expovariate(rate) if poisson else 1 / rate
+            self.samples.extend(future.result() for future in futures)
+            print(f"Open loop with {rate} requests per second finished.")
+        return self.report("open")
+
+    def report(self, mode=None):
+        """Aggregates the recorded requests per load level.
+
+        Args:
+            mode (str, optional): Only report the levels of "closed" or "open" loop runs. Defaults to None (all).
+
+        Returns:
+            pandas.DataFrame: Per mode and level the number of requests, the throughput of successful requests per second,
+            the 50th, 95th and 99th percentile of the latency of successful requests in seconds, and the error and 429 rates.
+        """
+        df = self.samples_dataframe()
+        if mode is not None:
+            df = df[df["mode"] == mode]
+        rows = []
+        for (level_mode, level), level_df in df.groupby(["mode", "level"], sort=True):
+            successful = level_df[level_df["error"].isna()]
+            level_duration = level_df["end"].max() - level_df["start"].min()
+            latencies = successful["latency"].to_numpy()
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) > 0 else (np.nan, np.nan, np.nan)
+            rows.append({
+                "mode": level_mode, "level": level, "requests": len(level_df),
+                "throughput": len(successful) / level_duration if level_duration > 0 else np.nan,
+                "latency_p50": p50, "latency_p95": p95, "latency_p99": p99,
+                "error_rate": 1 - len(successful) / len(level_df),
+                "rate_429": (level_df["status"] == 429).mean()
+            })
+        return pd.DataFrame(rows, columns=["mode", "level", "requests", "throughput", "latency_p50", "latency_p95",
+                                           "latency_p99", "error_rate", "rate_429"])
+
+    def samples_dataframe(self):
+        """Returns the records of all requests sent so far.
+
+        Returns:
+            pandas.DataFrame: One row per request with mode, level, start, end, latency, service time, status and error.
+        """
+        return pd.DataFrame(self.samples, columns=["mode", "level", "start", "end", "latency", "service_time", "status", "error"])
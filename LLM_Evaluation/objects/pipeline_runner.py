@@ -0,0 +1,290 @@
+"""
+In this module, we define the PipelineRunner class. It runs QA generation, ProductAI prompting and the evaluation as
+concurrent streaming stages, so a question is sent to ProductAI as soon as it is generated and judged as soon as it is
+answered, instead of each stage waiting for the complete results of the previous one.
+"""
+import os
+import json
+import queue
+import threading
+import traceback
+from objects.qa_pair_generator import QAPairGenerator
+from objects.product_ai_prompter import ProductAIPrompter
+from objects.evaluator import Evaluator
+from objects.llm_client import LLMClient
+
+# marks the end of the items of a queue
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised in the worker threads when the pipeline is stopped before all items are processed."""
+
+
+class PipelineRunner:
+    """Runs the generation of QA pairs, the prompting of ProductAI and the evaluation of the answers as streaming stages.
+
+    Each stage has its own worker threads and hands its rows to the next stage through a bounded queue. When a
+    stage is slower than the previous one, its queue fills up and the previous stage waits, so the number of rows
+    in memory stays bounded. A row that fails in a stage keeps the error in its 'error' and 'failed_stage'
+    fields and skips the remaining stages instead of stopping the pipeline.
+
+    Attributes:
+        document_paths (list): The paths of the document twins to generate questions from.
+        number_questions (int): Number of questions to generate per chunk.
+        workers (dict): The number of worker threads per stage.
+        queue_size (int): The maximum number of rows waiting between two stages.
+    """
+
+    GENERATION = "generation"
+    PRODUCTAI = "productai"
+    EVALUATION = "evaluation"
+
+    def __init__(self, document_paths, model_name, api_key, cookie, evaluation_model=None, number_questions=2,
+                 generation_workers=4, productai_workers=4, evaluation_workers=4, queue_size=64,
+                 client=None, prompter=None, ledger=None, metrics=None, deduplicator=None):
+        """
+        Args:
+            document_paths (list): The paths of the document twins to generate questions from.
+            model_name (str): The model used for the QA generation.
+            api_key (str): The API key for the models.
+            cookie (str): The cookie to authenticate at ProductAI.
+            evaluation_model (str, optional): The model used for the evaluation. Defaults to model_name.
+            number_questions (int, optional): Number of questions to generate per chunk. Defaults to 2.
+            generation_workers (int, optional): Number of chunks generated at the same time. Defaults to 4.
+            productai_workers (int, optional): Number of questions sent to ProductAI at the same time. Defaults to 4.
+            evaluation_workers (int, optional): Number of answers evaluated at the same time. Defaults to 4.
+            queue_size (int, optional): The maximum number of rows waiting between two stages. Defaults to 64.
+            client (LLMClient, optional): The client shared by the generation and the evaluation. Defaults to a new client for the api_key.
+            prompter (ProductAIPrompter, optional): The prompter of ProductAI. Defaults to a new prompter for the cookie.
+            ledger (RunLedger, optional): A ledger of the run, so a restarted run skips the completed items of every stage. Defaults to None.
+            metrics (CallMetrics, optional): A collector for the records of all calls of the default clients, labeled with the stage. Defaults to None.
+            deduplicator (QuestionDeduplicator, optional): Drops generated questions that are near-duplicates of an earlier question
+                of the run before they are sent to ProductAI. The chunks are deduplicated in the order of the documents and chunks,
+                so the kept questions do not depend on the number of workers. A kept row lists the dropped questions of its chunk
+                in 'duplicate_questions', the clusters across chunks are kept in the deduplicator. Defaults to None.
+        """
+        self.document_paths = list(document_paths)
+        self.model = model_name
+        self.evaluation_model = evaluation_model or model_name
+        self.api_key = api_key
+        self.number_questions = number_questions
+        self.workers = {
+            PipelineRunner.GENERATION: generation_workers,
+            PipelineRunner.PRODUCTAI: productai_workers,
+            PipelineRunner.EVALUATION: evaluation_workers
+        }
+        self.queue_size = queue_size
+        self.ledger = ledger
+        self.metrics = metrics
+        self.deduplicator = deduplicator
+        self.client = client or LLMClient(api_key, pool_maxsize=generation_workers + evaluation_workers, metrics=metrics)
+        self.prompter = prompter or ProductAIPrompter(cookie, client=LLMClient(pool_maxsize=productai_workers, metrics=metrics), ledger=ledger)
+        self._stop_event = threading.Event()
+        # the sequence number of the next chunk to deduplicate, the chunks are deduplicated in the order they were read
+        self._next_sequence = 0
+        self._deduplication_turn = threading.Condition()
+
+    def run(self):
+        """Runs all stages and yields each finished row as soon as it has been evaluated or has failed.
+        The rows are yielded in the order they finish. Stopping the iteration stops the pipeline.
+
+        Yields:
+            dict: The QA pair with the chunk metadata, the ProductAI response and its response time, and the evaluation score and reasoning.
+        """
+        self._stop_event.clear()
+        self._next_sequence = 0
+        chunk_tasks = queue.Queue(self.queue_size)
+        generated_rows = queue.Queue(self.queue_size)
+        answered_rows = queue.Queue(self.queue_size)
+        finished_rows = queue.Queue(self.queue_size)
+
+        threads = [threading.Thread(target=self._read_documents, args=(chunk_tasks,), daemon=True)]
+        threads += self._start_stage(PipelineRunner.GENERATION, self._generate, chunk_tasks, generated_rows)
+        threads += self._start_stage(PipelineRunner.PRODUCTAI, self._prompt_productai, generated_rows, answered_rows)
+        threads += self._start_stage(PipelineRunner.EVALUATION, self._evaluate, answered_rows, finished_rows)
+        threads[0].start()
+        try:
+            while True:
+                row = finished_rows.get()
+                if row is _DONE:
+                    break
+                yield row
+        finally:
+            self._stop_event.set()
+            for thread in threads:
+                thread.join()
+
+    def run_to_file(self, path):
+        """Runs all stages and appends each finished row as a JSON line to a file, so the results of an interrupted run are kept.
+
+        Args:
+            path (str): The path of the JSONL file.
+
+        Returns:
+            int: The number of written rows.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        number_rows = 0
+        with open(path, "a", encoding="utf-8") as file:
+            for row in self.run():
+                file.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+                file.flush()
+                number_rows += 1
+        return number_rows
+
+    def run_to_store(self, store, run=None, row_group_size=100):
+        """Runs all stages and appends the finished rows to the 'evaluation' stage of a run in a ResultsStore,
+        partitioned by document, so later stages read only the columns they need.
+
+        Args:
+            store (ResultsStore): The results store.
+            run (str, optional): The run id. Defaults to a new run id from the current time.
+            row_group_size (int, optional): The number of rows of a document written as one row group. Defaults to 100.
+
+        Returns:
+            str: The run id.
+        """
+        run = run or store.new_run_id()
+        with store.writer(run, PipelineRunner.EVALUATION, row_group_size) as writer:
+            for row in self.run():
+                writer.append(row)
+        print(f"Wrote {writer.number_rows} rows of run {run} to {store.base_folder}.")
+        return run
+
+    def _start_stage(self, stage, process, input_queue, output_queue):
+        """Starts the worker threads of a stage and a thread that closes the output queue when all workers are finished.
+
+        Args:
+            stage (str): The name of the stage.
+            process (callable): Processes one item of the input queue and returns the rows for the output queue.
+            input_queue (queue.Queue): The items of the stage.
+            output_queue (queue.Queue): The rows for the next stage.
+
+        Returns:
+            list: The started threads.
+        """
+        def work():
+            try:
+                while True:
+                    item = self._get(input_queue)
+                    if item is _DONE:
+                        # leave the end marker for the other workers of the stage
+                        self._put(input_queue, _DONE)
+                        return
+                    if self.metrics is None:
+                        rows = self._process(stage, process, item)
+                    else:
+                        with self.metrics.labels(stage=stage):
+                            rows = self._process(stage, process, item)
+                    for row in rows:
+                        self._put(output_queue, row)
+            except _Stopped:
+                return
+
+        workers = [threading.Thread(target=work, daemon=True) for _ in range(self.workers[stage])]
+
+        def close():
+            for worker in workers:
+                worker.join()
+            try:
+                self._put(output_queue, _DONE)
+            except _Stopped:
+                pass
+
+        threads = workers + [threading.Thread(target=close, daemon=True)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    @staticmethod
+    def _process(stage, process, item):
+        """Processes an item and keeps the error in the row instead of raising it. Rows that failed before are passed on."""
+        if isinstance(item, dict) and item.get('error') is not None:
+            return [item]
+        try:
+            return process(item)
+        except Exception:
+            row = dict(item) if isinstance(item, dict) else {'chunk_index': item[1], 'path_to_document': item[0].doc_twin.file_path}
+            row['error'] = traceback.format_exc()
+            row['failed_stage'] = stage
+            print(f"Pipeline stage '{stage}' failed:", row['error'].strip().splitlines()[-1])
+            return [row]
+
+    def _read_documents(self, chunk_tasks):
+        """Reads and chunks the documents one by one and queues one generation task per chunk."""
+        try:
+            sequence = 0
+            for path in self.document_paths:
+                try:
+                    generator = QAPairGenerator(path, self.model, self.api_key, client=self.client, ledger=self.ledger)
+                except Exception:
+                    print(f"Reading document '{path}' failed:", traceback.format_exc().strip().splitlines()[-1])
+                    continue
+                # the first chunk is skipped, the same as in QAPairGenerator.generate_qa_pairs
+                for chunk_index in range(1, len(generator.chunks)):
+                    self._put(chunk_tasks, (generator, chunk_index, sequence))
+                    sequence += 1
+            self._put(chunk_tasks, _DONE)
+        except _Stopped:
+            return
+
+    def _generate(self, chunk_task):
+        generator, chunk_index, sequence = chunk_task
+        if self.deduplicator is None:
+            return generator.generate_qa_pairs_for_chunk(chunk_index, self.number_questions)
+        try:
+            qa_pairs = generator.generate_qa_pairs_for_chunk(chunk_index, self.number_questions)
+        except Exception:
+            # the failed chunk still takes its turn, so the following chunks are not kept waiting
+            self._deduplicate_in_order(sequence, [])
+            raise
+        return self._deduplicate_in_order(sequence, qa_pairs)
+
+    def _deduplicate_in_order(self, sequence, qa_pairs):
+        """Deduplicates the QA pairs of a chunk after the QA pairs of all chunks read before it, so the kept questions
+        do not depend on the order in which the generation workers finish."""
+        with self._deduplication_turn:
+            while self._next_sequence != sequence:
+                if self._stop_event.is_set():
+                    raise _Stopped()
+                self._deduplication_turn.wait(timeout=0.1)
+            try:
+                return self.deduplicator.deduplicate(qa_pairs, verbose=False)
+            finally:
+                self._next_sequence += 1
+                self._deduplication_turn.notify_all()
+
+    def _prompt_productai(self, row):
+        row['productai_response'], row['productai_response_time'] = self.prompter.prompt_productai(row['question'])
+        return [row]
+
+    def _evaluate(self, row):
+        evaluator = Evaluator(row['question'], row['answer'], row['productai_response'], self.evaluation_model, self.api_key,
+                              client=self.client, ledger=self.ledger)
+        evaluation = evaluator.evaluate_correctness()
+        row['evaluation_score'] = evaluation['score']
+        row['evaluation_reasoning'] = evaluation['reasoning']
+        return [row]
+
+    def _put(self, target_queue, item):
+        """Puts an item into a bounded queue and waits while it is full, unless the pipeline is stopped."""
+        while True:
+            if self._stop_event.is_set():
+                raise _Stopped()
+            try:
+                target_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, source_queue):
+        """Gets an item from a queue and waits while it is empty, unless the pipeline is stopped."""
+        while True:
+            if self._stop_event.is_set():
+                raise _Stopped()
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
@@ -1,6 +1,11 @@
-import requests
+import os
 from bs4 import BeautifulSoup
-import time
+from objects.llm_client import LLMClient
+from objects.batch_job import make_custom_id
+from objects.run_ledger import RunLedger
+
+# the endpoint can be overridden with an environment variable, e.g. to point the pipeline at benchmarks/fake_server.py
+PRODUCTAI_URL = os.environ.get("PRODUCTAI_URL", "https://app-validation-services-dev.azurewebsites.net/chat")
 
 class ProductAIPrompter:
     """A class to interact with the Product AI service.
@@ -8,14 +13,26 @@ class ProductAIPrompter:
     Attributes:
         url (str): The URL of the Product AI service.
         headers (dict): The headers to include in the HTTP requests.
+        client (LLMClient): The client used to send the requests.
+        ledger (RunLedger): The ledger the answers are recorded in, None to not record them.
+        retry_statuses (tuple): The status codes a request is retried on.
     """
 
-    def __init__(self, cookie):
+    def __init__(self, cookie, client=None, url=PRODUCTAI_URL, ledger=None, retry_statuses=(429, 500)):
         """
         Args:
             cookie (str): The cookie to use for authentication. Obtained by logging in on the website for ProductAI. Then sending a prompt and inspecting the response headers.
+            client (LLMClient, optional): A shared client to send the requests with. Defaults to the shared client without API key, see LLMClient.shared.
+            url (str, optional): The URL of the Product AI service. Defaults to PRODUCTAI_URL.
+            ledger (RunLedger, optional): A ledger of the run. Questions with a recorded answer are not sent again,
+                so a crashed run can be restarted. Defaults to None.
+            retry_statuses (tuple, optional): The status codes a request is retried on. Use () to raise on every error,
+                e.g. to measure the error rates in a load test. Defaults to (429, 500).
         """
-        self.url = "https://app-validation-services-dev.azurewebsites.net/chat"
+        self.url = url
+        self.retry_statuses = retry_statuses
+        self.client = client or LLMClient.shared()
+        self.ledger = ledger
         self.headers = {
             "Content-Type": "application/json",
             "Cookie": cookie
@@ -28,27 +45,22 @@ class ProductAIPrompter:
             question (str): The question to send to the Product AI service.
 
         Returns:
-            str: The text response from the Product AI service.
+            tuple: The text response from the Product AI service and the response time in seconds.
         """
+        if self.ledger is None:
+            return self._prompt_productai(question)
+        # a recorded answer keeps the response time of the request that produced it
+        answer, response_time = self.ledger.run(
+            RunLedger.PRODUCTAI, make_custom_id("productai", self.url, question), lambda: list(self._prompt_productai(question)))
+        return answer, response_time
+
+    def _prompt_productai(self, question):
+        """Sends a question to the Product AI service without looking it up in the ledger."""
         payload = {"message": question, "history": "[{}]", "last_chunks": ""}
         
         # Implemented to avoid rate limiting and catch HTTP errors.
-        while True:
-            time_start = time.time()
-            response = requests.post(self.url, headers=self.headers, json=payload)
-            response_time = time.time() - time_start
-            if response.status_code == 200:
-                response_json = response.json()
-                soup = BeautifulSoup(response_json["message"]["html_answer"], "html.parser")
-                return soup.get_text(), response_time
-            elif response.status_code == 429:
-                print("HTTP Error:", response.status_code, "\nRetrying in 20 seconds")
-                time.sleep(20)
-            elif response.status_code == 500:
-                print("HTTP Error:", response.status_code, "\nRetrying in 20 seconds")
-                time.sleep(20)
-            else:
-                response.raise_for_status()
-        
-        
-        
\ No newline at end of file
+        response, response_time = self.client.post(
+            self.url, payload, headers=self.headers, retry_statuses=self.retry_statuses, rate_limit_key="productai")
+        response_json = response.json()
+        soup = BeautifulSoup(response_json["message"]["html_answer"], "html.parser")
+        return soup.get_text(), response_time
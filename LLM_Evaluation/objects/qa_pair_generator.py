@@ -1,8 +1,13 @@
 import re
+import ast
 import json
+import asyncio
 from objects.agentic_generator import AgenticGenerator, SimpleGenerator
 from objects.chunk_objects.chunk import Chunk, MarkdownDocument
 from objects.chunk_objects.chunk_handler import ChunkHandler
+from objects.llm_client import LLMClient, AZURE_OPENAI_BASE_URL, AZURE_OPENAI_API_VERSION
+from objects.batch_job import make_batch_request, make_custom_id
+from objects.run_ledger import RunLedger
 
 class QAPairGenerator:
     """Generates question-answer pairs from a markdown document.
@@ -14,26 +19,46 @@ class QAPairGenerator:
         model (str): The model name for the QA generation.
         api_key (str): The API key for the QA generation.
         llm_config (dict): Configuration for the language model.
+        client (LLMClient): The client shared by all requests of this generator.
+        ledger (RunLedger): The ledger the QA pairs of each chunk are recorded in, None to not record them.
     """
 
-    def __init__(self, path_to_document_twin, model_name, api_key):
+    # the chunking of the documents, also used to find the source chunk of a QA pair again
+    MAX_CHUNK_SIZE = ChunkHandler.RECOMMENDED_MAX_CHUNK_SIZE
+    SPLIT_CRITERIA = [
+        *ChunkHandler.MARKDOWN_HEADINGS,
+        '''
+            ChunkHandler.split_by_bold_headers, 
+            ChunkHandler.split_by_short_lines_that_might_be_headers, 
+            ChunkHandler.hard_split_by_character_number
+        '''
+    ]
+
+    def __init__(self, path_to_document_twin, model_name, api_key, client=None, ledger=None):
         """
         Args:
             path_to_document_twin (str): Path to the markdown document.
             model_name (str): The model name for the QA generation.
             api_key (str): The API key for the QA generation.
+            client (LLMClient, optional): A client to share with other generators, e.g. across documents. Defaults to the shared client of the api_key, see LLMClient.shared.
+            ledger (RunLedger, optional): A ledger of the run. Chunks with recorded QA pairs are not generated again,
+                so a crashed run can be restarted. Defaults to None.
         """
         self.doc_twin = MarkdownDocument(path_to_document_twin)
         self.chunks = self._chunk_document()
         self.qa_pairs = []
         self.model = model_name
         self.api_key = api_key
+        self.client = client or LLMClient.shared(api_key)
+        self.ledger = ledger
+        # one generator per number of questions, as the instruction depends on it
+        self._simple_generators = {}
         self.llm_config = {"config_list": [{
             "model": model_name,
             "api_key": api_key,
-            "base_url": "https://appprodsagopenaigpt4weu.openai.azure.com",
+            "base_url": AZURE_OPENAI_BASE_URL,
             "api_type": "azure",
-            "api_version": "2024-02-15-preview"
+            "api_version": AZURE_OPENAI_API_VERSION
         }]}
 
     def _chunk_document(self):
@@ -42,16 +67,7 @@ class QAPairGenerator:
         Returns:
             list: List of chunks from the document.
         """
-        MAX_CHUNK_SIZE = ChunkHandler.RECOMMENDED_MAX_CHUNK_SIZE
-        SPLIT_CRITERIA = [
-            *ChunkHandler.MARKDOWN_HEADINGS,
-            '''
-            ChunkHandler.split_by_bold_headers, 
-            ChunkHandler.split_by_short_lines_that_might_be_headers, 
-            ChunkHandler.hard_split_by_character_number
-            '''
-        ]
-        self.doc_twin.chunks = ChunkHandler.split_document_into_chunks(self.doc_twin, max_chunk_size=MAX_CHUNK_SIZE, split_criteria=SPLIT_CRITERIA, recursive=False)
+        self.doc_twin.chunks = ChunkHandler.split_document_into_chunks(self.doc_twin, max_chunk_size=QAPairGenerator.MAX_CHUNK_SIZE, split_criteria=QAPairGenerator.SPLIT_CRITERIA, recursive=False, compact=True)
         return self.doc_twin.chunks
 
     def generate_qa_pairs(self, number_questions):
@@ -65,13 +81,113 @@ class QAPairGenerator:
         """
         self.qa_pairs = []
         for i in range(1, len(self.chunks)):
-            qa_pairs = self._generate_qa_pair(self.chunks[i].text, number_questions)
-            for qa_pair in qa_pairs:
-                qa_pair['chunk'] = self.chunks[i].text
-                qa_pair['document'] = self.doc_twin.file_name
-                qa_pair['path_to_document'] = self.doc_twin.file_path
-                self.qa_pairs.append(qa_pair)
+            self.qa_pairs.extend(self.generate_qa_pairs_for_chunk(i, number_questions))
+        return self.qa_pairs
+
+    async def generate_qa_pairs_async(self, number_questions, max_concurrency=8):
+        """Generates QA pairs for each chunk in the document with several requests in flight at once.
+
+        The blocking requests are run in worker threads, at most max_concurrency at a time.
+        The QA pairs are returned in chunk order, the same as in generate_qa_pairs.
+        In a notebook, call it with: qa_pairs = await generator.generate_qa_pairs_async(2)
+
+        Args:
+            number_questions (int): Number of questions to generate per chunk.
+            max_concurrency (int, optional): Maximum number of chunk requests in flight. Defaults to 8.
+
+        Returns:
+            list: List of generated QA pairs.
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, but was {max_concurrency}")
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def generate_for_chunk(chunk_index):
+            async with semaphore:
+                return await asyncio.to_thread(self.generate_qa_pairs_for_chunk, chunk_index, number_questions)
+
+        # gather keeps the order of the chunks, independent of which request finishes first
+        results = await asyncio.gather(*[generate_for_chunk(i) for i in range(1, len(self.chunks))])
+        self.qa_pairs = [qa_pair for qa_pairs in results for qa_pair in qa_pairs]
+        return self.qa_pairs
+
+    def build_batch_requests(self, number_questions):
+        """Builds one batch request per chunk instead of sending the requests, for the offline batch mode.
+        Write them with batch_job.write_batch_file and read the results back with ingest_batch_results.
+
+        Args:
+            number_questions (int): Number of questions to generate per chunk.
+
+        Returns:
+            list: List of batch requests with a stable custom id per chunk.
+        """
+        simple_generator = self._get_simple_generator(number_questions)
+        return [
+            make_batch_request(self._batch_custom_id(i, number_questions), self.model, simple_generator.build_payload(self.chunks[i].text))
+            for i in range(1, len(self.chunks))
+        ]
+
+    def ingest_batch_results(self, results, number_questions):
+        """Builds the QA pairs from the results of a batch job.
+
+        Args:
+            results (dict): Maps the custom ids to the returned contents, as read by batch_job.read_batch_results.
+            number_questions (int): Number of questions per chunk the batch requests were built with.
+
+        Returns:
+            list: List of generated QA pairs. Chunks without a valid result are skipped.
+        """
+        self.qa_pairs = []
+        for i in range(1, len(self.chunks)):
+            content = results.get(self._batch_custom_id(i, number_questions))
+            if content is None:
+                print(f"No batch result for chunk {i} of document {self.doc_twin.file_name}")
+                continue
+            try:
+                qa_pairs = ast.literal_eval(content)
+            except (ValueError, SyntaxError) as ex:
+                print(f"Malformed batch result for chunk {i} of document {self.doc_twin.file_name}:", ex)
+                continue
+            self.qa_pairs.extend(self._add_chunk_metadata(qa_pairs, self.chunks[i]))
         return self.qa_pairs
+
+    def generate_qa_pairs_for_chunk(self, chunk_index, number_questions):
+        """Generates the QA pairs of a chunk, or takes them from the ledger if they have been recorded before.
+
+        Args:
+            chunk_index (int): The index of the chunk.
+            number_questions (int): Number of questions to generate.
+
+        Returns:
+            list: The QA pairs of the chunk with the chunk metadata.
+        """
+        chunk = self.chunks[chunk_index]
+        if self.ledger is None:
+            qa_pairs = self._generate_qa_pair(chunk.text, number_questions)
+        else:
+            qa_pairs = self.ledger.run(RunLedger.QA_GENERATION, self._batch_custom_id(chunk_index, number_questions),
+                                       lambda: self._generate_qa_pair(chunk.text, number_questions))
+        return self._add_chunk_metadata(qa_pairs, chunk)
+
+    def _batch_custom_id(self, chunk_index, number_questions):
+        """Builds the stable custom id of the batch request of a chunk, also used as its key in the ledger."""
+        return make_custom_id("qa", self.doc_twin.file_path, chunk_index, number_questions, self.chunks[chunk_index].text)
+
+    def _add_chunk_metadata(self, qa_pairs, chunk):
+        """Adds the chunk text and the document information to each QA pair of a chunk.
+
+        Args:
+            qa_pairs (list): The QA pairs generated from the chunk.
+            chunk (Chunk): The chunk the QA pairs were generated from.
+
+        Returns:
+            list: The QA pairs with the added fields.
+        """
+        for qa_pair in qa_pairs:
+            qa_pair['chunk'] = chunk.text
+            qa_pair['document'] = self.doc_twin.file_name
+            qa_pair['path_to_document'] = self.doc_twin.file_path
+        return qa_pairs
     
     def _generate_qa_pair(self, section, number_questions):
         """Generates QA pairs for a given section of the document.
@@ -83,6 +199,18 @@ class QAPairGenerator:
         Returns:
             list: List of generated QA pairs.
         """
-        simple_generator = SimpleGenerator(self.model, self.api_key, number_questions)
-        qa_pair = simple_generator.generate_question_answer_pair(section)
-        return qa_pair
\ No newline at end of file
+        qa_pair = self._get_simple_generator(number_questions).generate_question_answer_pair(section)
+        return qa_pair
+
+    def _get_simple_generator(self, number_questions):
+        """Returns the generator for the given number of questions, shared by all chunks.
+
+        Args:
+            number_questions (int): Number of questions to generate.
+
+        Returns:
+            SimpleGenerator: The generator using the client of this QAPairGenerator.
+        """
+        if number_questions not in self._simple_generators:
+            self._simple_generators[number_questions] = SimpleGenerator(self.model, self.api_key, number_questions, client=self.client)
+        return self._simple_generators[number_questions]
@@ -0,0 +1,148 @@
+"""
+In this module, we define the QuestionDeduplicator class. It finds near-duplicate questions with MinHash signatures
+and locality-sensitive hashing, so only one question of each cluster of near-identical questions is sent to ProductAI
+and to the judge.
+"""
+import re
+import zlib
+import threading
+import numpy as np
+
+# the hash functions are (a * x + b) mod MERSENNE_PRIME with a, x < MERSENNE_PRIME, so the products fit into 64 bits
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+class QuestionDeduplicator:
+    """Clusters near-duplicate questions and keeps the first question of each cluster as its representative.
+
+    The questions are normalized and split into character shingles. Two questions are near-duplicates if the Jaccard
+    similarity of their shingles is at least the threshold. To not compare each question with all others, the
+    MinHash signature of each question is split into bands and only questions sharing a band with a representative
+    are compared with it. Questions can be added one by one, e.g. while they are generated, and from several threads.
+
+    Attributes:
+        threshold (float): The minimal Jaccard similarity of the shingles of two near-duplicate questions.
+        questions (list): All added questions in order.
+        cluster_ids (list): The index of the representative of each added question, its own index for a representative.
+    """
+
+    def __init__(self, threshold=0.8, shingle_size=4, number_bands=16, rows_per_band=4, seed=0):
+        """
+        Args:
+            threshold (float, optional): The minimal Jaccard similarity of near-duplicates. Lower values also merge
+                questions that only differ in one important word, e.g. "pressure" and "temperature". Defaults to 0.8.
+            shingle_size (int, optional): The number of characters of a shingle. Defaults to 4.
+            number_bands (int, optional): The number of bands of the signatures. More bands find more candidates. Defaults to 16.
+            rows_per_band (int, optional): The number of signature values per band. More rows find fewer candidates. Defaults to 4.
+            seed (int, optional): The seed of the hash functions. Defaults to 0.
+        """
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.number_bands = number_bands
+        self.rows_per_band = rows_per_band
+        rng = np.random.default_rng(seed)
+        number_hashes = number_bands * rows_per_band
+        self._a = rng.integers(1, MERSENNE_PRIME, (number_hashes, 1), dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, (number_hashes, 1), dtype=np.uint64)
+        self.questions = []
+        self.cluster_ids = []
+        # the shingles of the representatives and their indices per band value
+        self._representative_shingles = {}
+        self._buckets = [{} for _ in range(number_bands)]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(question):
+        """Lowercases a question and removes punctuation and repeated whitespace."""
+        return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+    def _shingles(self, question):
+        text = self.normalize(question)
+        if len(text) <= self.shingle_size:
+            return {text}
+        return {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+
+    def _band_keys(self, shingles):
+        """Computes the MinHash signature of the shingles and returns the value of each band."""
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) % MERSENNE_PRIME for shingle in shingles], dtype=np.uint64)
+        signature = ((self._a * hashes + self._b) % MERSENNE_PRIME).min(axis=1).tolist()
+        return [tuple(signature[band * self.rows_per_band:(band + 1) * self.rows_per_band]) for band in range(self.number_bands)]
+
+    def add(self, question):
+        """Adds a question and returns the index of its cluster representative.
+
+        Args:
+            question (str): The question.
+
+        Returns:
+            int: The index of the representative, the index of the question itself if it is not a near-duplicate.
+        """
+        return self._add(question)[1]
+
+    def is_duplicate(self, question):
+        """Adds a question and returns whether it is a near-duplicate of a question added before."""
+        index, cluster_id = self._add(question)
+        return index != cluster_id
+
+    def _add(self, question):
+        """Adds a question and returns its index and the index of its cluster representative."""
+        shingles = self._shingles(question)
+        band_keys = self._band_keys(shingles)
+        with self._lock:
+            index = len(self.questions)
+            self.questions.append(question)
+            # compare with the representatives in the same bucket of any band, the oldest first
+            candidates = sorted({candidate for bucket, key in zip(self._buckets, band_keys) for candidate in bucket.get(key, ())})
+            for candidate in candidates:
+                candidate_shingles = self._representative_shingles[candidate]
+                if len(shingles & candidate_shingles) / len(shingles | candidate_shingles) >= self.threshold:
+                    self.cluster_ids.append(candidate)
+                    return index, candidate
+            self.cluster_ids.append(index)
+            self._representative_shingles[index] = shingles
+            for bucket, key in zip(self._buckets, band_keys):
+                bucket.setdefault(key, []).append(index)
+            return index, index
+
+    def get_clusters(self):
+        """Returns the questions of each cluster with more than one question.
+
+        Returns:
+            dict: Maps the representative to the list of its near-duplicates, without the representative itself.
+        """
+        clusters = {}
+        with self._lock:
+            for index, cluster_id in enumerate(self.cluster_ids):
+                if index != cluster_id:
+                    clusters.setdefault(self.questions[cluster_id], []).append(self.questions[index])
+        return clusters
+
+    def deduplicate(self, qa_pairs, verbose=True):
+        """Adds the questions of the QA pairs and keeps one QA pair per cluster.
+
+        Each kept QA pair gets the 'duplicate_questions' of its cluster and the 'duplicate_count', so the dropped
+        questions stay visible in the results.
+
+        Args:
+            qa_pairs (list): The QA pairs with a 'question', e.g. from QAPairGenerator.generate_qa_pairs.
+            verbose (bool, optional): Whether to print the number of removed questions. Defaults to True.
+
+        Returns:
+            list: The representative QA pairs in their original order.
+        """
+        representatives = {}
+        kept = []
+        for qa_pair in qa_pairs:
+            index, cluster_id = self._add(qa_pair['question'])
+            if index == cluster_id:
+                qa_pair['duplicate_questions'] = []
+                representatives[cluster_id] = qa_pair
+                kept.append(qa_pair)
+            elif cluster_id in representatives:
+                representatives[cluster_id]['duplicate_questions'].append(qa_pair['question'])
+            # questions that duplicate a question of an earlier call are dropped, they are listed in get_clusters
+        for qa_pair in kept:
+            qa_pair['duplicate_count'] = len(qa_pair['duplicate_questions'])
+        if verbose:
+            print(f"Removed {len(qa_pairs) - len(kept)} near-duplicate questions of {len(qa_pairs)}.")
+        return kept
@@ -0,0 +1,159 @@
+"""
+In this module, we define the RateLimiter class. It paces the requests of the LLMClient, so each deployment stays
+just under its requests-per-minute and tokens-per-minute quota, and computes the back-off after a rejected request.
+"""
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+
+class _Bucket:
+    """A token bucket that refills continuously at a fixed rate up to its capacity."""
+
+    def __init__(self, per_minute, burst_seconds):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # a request larger than the whole bucket is let through as soon as the bucket is full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Paces requests per deployment against requests-per-minute and tokens-per-minute budgets.
+
+    The limiter is shared by all threads of a client. Before a request is sent, acquire blocks until the budgets of
+    its deployment allow it. After a rejected request, retry_delay honors the Retry-After header of the response or
+    falls back to an exponential back-off with jitter, and the whole deployment is paused for that time.
+
+    Attributes:
+        budgets (dict): Maps a deployment to its budget, e.g. {"evaluation_gpt4o": {"requests_per_minute": 300, "tokens_per_minute": 50000}}.
+        chars_per_token (float): The number of characters counted as one token when estimating the prompt tokens.
+        burst_seconds (float): The number of seconds of budget that can be spent at once.
+        base_delay (float): The back-off in seconds after the first rejected request without Retry-After header.
+        max_delay (float): The maximum back-off in seconds.
+    """
+
+    def __init__(self, budgets=None, chars_per_token=4, burst_seconds=10, base_delay=4, max_delay=120):
+        """
+        Args:
+            budgets (dict, optional): Maps a deployment to its requests_per_minute and tokens_per_minute budget. Deployments without budget are not paced. Defaults to None.
+            chars_per_token (float, optional): The number of characters counted as one token. Defaults to 4.
+            burst_seconds (float, optional): The number of seconds of budget that can be spent at once. Azure OpenAI enforces its quota in windows of a few seconds, so the default is 10.
+            base_delay (float, optional): The back-off in seconds after the first rejected request. Defaults to 4.
+            max_delay (float, optional): The maximum back-off in seconds. Defaults to 120.
+        """
+        self.budgets = budgets or {}
+        self.chars_per_token = chars_per_token
+        self.burst_seconds = burst_seconds
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._paused_until = {}
+
+    def estimate_tokens(self, payload):
+        """Estimates the tokens a request is counted with against the tokens-per-minute budget.
+        Azure OpenAI counts the prompt tokens plus max_tokens of the completion.
+
+        Args:
+            payload (dict): The JSON payload of the request.
+
+        Returns:
+            int: The estimated number of tokens.
+        """
+        def count_chars(value):
+            if isinstance(value, str):
+                return len(value)
+            if isinstance(value, dict):
+                return sum(count_chars(item) for item in value.values())
+            if isinstance(value, list):
+                return sum(count_chars(item) for item in value)
+            return 0
+
+        prompt_tokens = int(count_chars(payload.get("messages", payload)) / self.chars_per_token) + 1
+        return prompt_tokens + payload.get("max_tokens", 0)
+
+    def _get_buckets(self, key):
+        if key not in self._buckets:
+            budget = self.budgets.get(key, {})
+            self._buckets[key] = [
+                _Bucket(budget[name], self.burst_seconds) if budget.get(name) else None
+                for name in ("requests_per_minute", "tokens_per_minute")
+            ]
+        return self._buckets[key]
+
+    def acquire(self, key, tokens=0):
+        """Blocks until a request of the given size is allowed for the deployment.
+
+        Args:
+            key (str): The deployment or service the request is sent to.
+            tokens (int, optional): The estimated tokens of the request. Defaults to 0.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until.get(key, 0) - now
+                request_bucket, token_bucket = self._get_buckets(key)
+                for bucket, amount in ((request_bucket, 1), (token_bucket, tokens)):
+                    if bucket is not None:
+                        bucket.refill(now)
+                        wait = max(wait, bucket.wait_time(amount))
+                if wait <= 0:
+                    for bucket, amount in ((request_bucket, 1), (token_bucket, tokens)):
+                        if bucket is not None:
+                            bucket.take(amount)
+                    return
+            time.sleep(wait)
+
+    def retry_delay(self, key, response, attempt):
+        """Computes how long to wait before retrying a rejected request and pauses the deployment for that time.
+
+        Args:
+            key (str): The deployment or service the request was sent to.
+            response (requests.Response): The rejected response.
+            attempt (int): The number of the retry, starting with 0.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        delay = self._parse_retry_after(response.headers)
+        if delay is None:
+            # exponential back-off with jitter, so parallel workers do not retry at the same moment
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+        else:
+            # the jitter is at most the delay itself, so short server delays are not stretched to seconds
+            delay += random.uniform(0, min(1.0, delay))
+        with self._lock:
+            self._paused_until[key] = max(self._paused_until.get(key, 0), time.monotonic() + delay)
+        return delay
+
+    @staticmethod
+    def _parse_retry_after(headers):
+        """Reads the delay from the retry-after-ms or Retry-After header. Returns None if there is no valid header."""
+        try:
+            if headers.get("retry-after-ms") is not None:
+                return float(headers["retry-after-ms"]) / 1000
+            retry_after = headers.get("Retry-After")
+            if retry_after is None:
+                return None
+            try:
+                # seconds, also fractional ones as sent by some proxies and the fake server of the benchmarks
+                return max(0.0, float(retry_after))
+            except ValueError:
+                # the header can also be an HTTP date
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
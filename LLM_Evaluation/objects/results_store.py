@@ -0,0 +1,276 @@
+"""
+In this module, we define the ResultsStore class. It keeps the rows of all runs and stages in one Parquet dataset,
+partitioned by run, stage and document, so rows are appended as they finish and later stages read only the runs,
+stages, documents and columns they need, instead of globbing and re-reading every parquet of a run.
+"""
+import os
+import uuid
+import threading
+from urllib.parse import quote, unquote
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from objects.utils import utils
+
+# the partition folders are named run=<run>/stage=<stage>/document=<document>
+PARTITION_SCHEMA = pa.schema([("run", pa.string()), ("stage", pa.string()), ("document", pa.string())])
+UNKNOWN_DOCUMENT = "unknown"
+
+
+def unify_schemas(schemas):
+    """Unifies the schemas of part files or row groups. A column that is null in one schema takes the type of the others
+    and ints are promoted to floats, e.g. when the first scores of a run are missing. Columns with incompatible types,
+    e.g. ints and strings, become strings.
+
+    Args:
+        schemas (list): The pyarrow schemas.
+
+    Returns:
+        pyarrow.Schema: The unified schema with the columns in the order they first appear.
+    """
+    fields = {}
+    for schema in schemas:
+        for field in schema:
+            previous = fields.get(field.name)
+            if previous is None:
+                fields[field.name] = field
+            elif not previous.type.equals(field.type):
+                try:
+                    fields[field.name] = pa.unify_schemas([pa.schema([previous]), pa.schema([field])], promote_options="permissive").field(0)
+                except (pa.ArrowTypeError, pa.ArrowInvalid):
+                    fields[field.name] = pa.field(field.name, pa.string())
+    return pa.schema(list(fields.values()))
+
+
+def _to_array(values):
+    """Converts the values of a column to an array, as strings if they have incompatible types."""
+    try:
+        return pa.array(values)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+
+class ResultsStore:
+    """A Parquet dataset of result rows, partitioned by run, stage and document.
+
+    Each partition holds one or more part files. The partition values are stored in the folder names only, so the
+    'run', 'stage' and 'document' fields of the rows are removed when writing and restored when reading.
+
+    Attributes:
+        base_folder (str): The root folder of the dataset.
+    """
+
+    def __init__(self, base_folder, catalog=None):
+        """
+        Args:
+            base_folder (str): The root folder of the dataset. It is created if it does not exist.
+            catalog (RunCatalog, optional): A catalog the writers register the partitions and row counts of each
+                document in, so the runs are listed without scanning the folder. Defaults to None.
+        """
+        self.base_folder = base_folder
+        self.catalog = catalog
+        os.makedirs(base_folder, exist_ok=True)
+
+    @staticmethod
+    def new_run_id():
+        """Returns a run id from the current time, in the timestamp format of the notebooks."""
+        return utils.get_current_datetime_as_str(str_format="%Y%m%d%H%M%S")
+
+    def partition_folder(self, run, stage, document):
+        """Returns the folder of a partition. The values are URI-encoded, so document names may contain any character."""
+        return os.path.join(self.base_folder, *[f"{name}={quote(str(value), safe='')}" for name, value in
+                                                zip(PARTITION_SCHEMA.names, (run, stage, document))])
+
+    def writer(self, run, stage, row_group_size=1000, parent_run=None):
+        """Opens a writer that appends the rows of a stage of a run.
+
+        Args:
+            run (str): The run id, e.g. from new_run_id.
+            stage (str): The stage, e.g. "generation", "productai" or "evaluation".
+            row_group_size (int, optional): The number of rows of a document written as one row group. Defaults to 1000.
+            parent_run (str, optional): The run whose rows the stage read, registered in the catalog. Defaults to None.
+
+        Returns:
+            ResultsWriter: The writer, to be used as a context manager.
+        """
+        return ResultsWriter(self, run, stage, row_group_size, parent_run)
+
+    def write(self, rows, run, stage, row_group_size=1000, parent_run=None):
+        """Appends rows to a stage of a run.
+
+        Args:
+            rows (iterable): The rows as dicts, or a pandas.DataFrame.
+            run (str): The run id.
+            stage (str): The stage.
+            row_group_size (int, optional): The number of rows of a document written as one row group. Defaults to 1000.
+            parent_run (str, optional): The run whose rows the stage read, registered in the catalog. Defaults to None.
+
+        Returns:
+            int: The number of written rows.
+        """
+        if isinstance(rows, pd.DataFrame):
+            rows = rows.to_dict(orient="records")
+        with self.writer(run, stage, row_group_size, parent_run) as writer:
+            writer.extend(rows)
+        return writer.number_rows
+
+    def runs(self):
+        """Returns the ids of all runs in the store, oldest first. With a catalog, the folder is not listed."""
+        if self.catalog is not None:
+            return [run["run"] for run in self.catalog.runs()]
+        return sorted(unquote(name[len("run="):]) for name in os.listdir(self.base_folder) if name.startswith("run="))
+
+    def dataset(self, run=None, stage=None, document=None):
+        """Opens the dataset lazily, without reading any rows. Only the part files of the selected partitions are opened.
+
+        Args:
+            run (str or list, optional): The run or runs. Defaults to all runs.
+            stage (str or list, optional): The stage or stages. Defaults to all stages.
+            document (str or list, optional): The document or documents. Defaults to all documents.
+
+        Returns:
+            pyarrow.dataset.Dataset: The dataset with the columns of all selected part files and the partition columns.
+        """
+        partitioning = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+        dataset = ds.dataset(self.base_folder, format="parquet", partitioning=partitioning)
+        partition_filter = self._partition_filter(run, stage, document)
+        paths = [fragment.path for fragment in dataset.get_fragments(filter=partition_filter)]
+        if not paths:
+            return ds.dataset([], schema=PARTITION_SCHEMA, format="parquet")
+        # the part files may have different columns, e.g. when only some rows failed, so their schemas are unified
+        schema = unify_schemas([pq.read_schema(path) for path in paths] + [PARTITION_SCHEMA])
+        return ds.dataset(paths, schema=schema, format="parquet", partitioning=partitioning, partition_base_dir=self.base_folder)
+
+    def read(self, columns=None, run=None, stage=None, document=None, filter=None):
+        """Reads the selected rows and columns. Only the requested columns are read from disk and the filter is
+        evaluated while scanning, e.g. store.read(["question", "evaluation_score"], run="20240928203654").
+
+        Args:
+            columns (list, optional): The columns to read. Defaults to all columns.
+            run (str or list, optional): The run or runs. Defaults to all runs.
+            stage (str or list, optional): The stage or stages. Defaults to all stages.
+            document (str or list, optional): The document or documents. Defaults to all documents.
+            filter (pyarrow.dataset.Expression, optional): A filter on the rows, e.g. ds.field("evaluation_score") < 3. Defaults to None.
+
+        Returns:
+            pandas.DataFrame: The selected rows.
+        """
+        dataset = self.dataset(run, stage, document)
+        row_filter = self._partition_filter(run, stage, document)
+        if filter is not None:
+            row_filter = filter if row_filter is None else row_filter & filter
+        return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+    @staticmethod
+    def _partition_filter(run=None, stage=None, document=None):
+        """Builds the filter expression of the selected partitions, None to select all."""
+        expression = None
+        for name, value in zip(PARTITION_SCHEMA.names, (run, stage, document)):
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            condition = ds.field(name).isin(values)
+            expression = condition if expression is None else expression & condition
+        return expression
+
+
+class ResultsWriter:
+    """Appends the rows of one stage of a run to a ResultsStore.
+
+    The rows are buffered per document and each full buffer is written as a row group to the open part file of its
+    document, so rows are on disk shortly after they finish and memory stays bounded. The part files are complete
+    when the writer is closed. Rows can be appended from several threads.
+
+    Attributes:
+        run (str): The run id.
+        stage (str): The stage.
+        row_group_size (int): The number of rows of a document written as one row group.
+        number_rows (int): The number of rows appended so far.
+    """
+
+    def __init__(self, store, run, stage, row_group_size=1000, parent_run=None):
+        self.store = store
+        self.run = run
+        self.stage = stage
+        self.row_group_size = row_group_size
+        self.parent_run = parent_run
+        self.number_rows = 0
+        self._buffers = {}
+        # the number of rows appended per document, registered in the catalog when the writer is closed
+        self._document_rows = {}
+        self._writers = {}
+        self._lock = threading.Lock()
+
+    def append(self, row):
+        """Appends a row. Its 'document' field selects the partition, rows without it go to the 'unknown' document."""
+        row = {key: value for key, value in row.items() if key not in ("run", "stage")}
+        document = row.pop("document", None) or UNKNOWN_DOCUMENT
+        with self._lock:
+            buffer = self._buffers.setdefault(document, [])
+            buffer.append(row)
+            self.number_rows += 1
+            self._document_rows[document] = self._document_rows.get(document, 0) + 1
+            if len(buffer) >= self.row_group_size:
+                self._flush(document)
+
+    def extend(self, rows):
+        """Appends several rows."""
+        for row in rows:
+            self.append(row)
+
+    def flush(self):
+        """Writes the buffered rows of all documents."""
+        with self._lock:
+            for document in list(self._buffers):
+                self._flush(document)
+
+    def close(self):
+        """Writes the buffered rows, closes the part files and registers the written documents in the catalog of the store."""
+        self.flush()
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers = {}
+            document_rows, self._document_rows = self._document_rows, {}
+        catalog = self.store.catalog
+        if catalog is None:
+            return
+        catalog.register_run(self.run, self.parent_run)
+        for document, number_rows in document_rows.items():
+            # rows appended to the partition by an earlier writer are counted as well
+            previous = catalog.outputs(self.run, self.stage, document)
+            previous_rows = previous[0]["row_count"] or 0 if previous else 0
+            catalog.register(self.run, self.stage, self.store.partition_folder(self.run, self.stage, document), document,
+                             previous_rows + number_rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _flush(self, document):
+        """Writes the buffer of a document as one row group."""
+        rows = self._buffers.pop(document, None)
+        if not rows:
+            return
+        # the columns of all rows, as rows may have different fields
+        names = list(dict.fromkeys(name for row in rows for name in row))
+        table = pa.Table.from_pydict({name: _to_array([row.get(name) for row in rows]) for name in names})
+        writer = self._writers.get(document)
+        schema = unify_schemas([writer.schema, table.schema]) if writer is not None else table.schema
+        if writer is not None and not schema.equals(writer.schema):
+            # a new column, e.g. the error of a failed row, or a wider type, e.g. the first scores after missing ones,
+            # starts a new part file with the unified schema, as the open file cannot hold the rows
+            writer.close()
+            writer = None
+        if writer is None:
+            folder = self.store.partition_folder(self.run, self.stage, document)
+            os.makedirs(folder, exist_ok=True)
+            writer = self._writers[document] = pq.ParquetWriter(os.path.join(folder, f"part-{uuid.uuid4().hex}.parquet"), schema)
+        # add the missing columns as nulls and bring the columns into the order of the file
+        columns = [table.column(field.name).cast(field.type) if field.name in table.schema.names else pa.nulls(table.num_rows, field.type)
+                   for field in schema]
+        writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
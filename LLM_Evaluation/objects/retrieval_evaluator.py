@@ -0,0 +1,247 @@
+"""
+In this module, we define the RetrievalEvaluator class. It builds an in-process search index over the chunks of the
+document twins and measures for all QA pairs of a run at once whether their source chunk and source document are retrieved,
+offline and without one vector search request per question.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from objects.qa_pair_generator import QAPairGenerator
+from objects.chunk_objects.corpus_ingestion import ingest_documents
+from objects.utils.utils import tokenize_words
+
+
+class RetrievalEvaluator:
+    """Scores questions against the chunks of a corpus and ranks the source chunk of each question.
+
+    The chunks are scored with BM25 or TF-IDF on sparse term matrices, or with the cosine similarity of the vectors
+    of an embedding function. All questions of a batch are scored in one matrix product.
+
+    Attributes:
+        texts (list): The indexed text of each chunk, its title and its text.
+        documents (np.ndarray): The document of each chunk.
+        method (str): "bm25", "tfidf" or "embedding".
+    """
+
+    BM25 = "bm25"
+    TFIDF = "tfidf"
+    EMBEDDING = "embedding"
+
+    def __init__(self, texts, documents, method=BM25, embedding_function=None, keys=None, k1=1.5, b=0.75):
+        """
+        Args:
+            texts (list): The indexed text of each chunk.
+            documents (list): The document of each chunk.
+            method (str, optional): "bm25" or "tfidf". Ignored if an embedding function is given. Defaults to "bm25".
+            embedding_function (callable, optional): Returns the vectors of a list of texts as an array with one row per text,
+                e.g. the embedding model of the production index. Defaults to None.
+            keys (list, optional): The text the QA pairs of each chunk refer to in their 'chunk' field. Defaults to the texts.
+            k1 (float, optional): The term frequency saturation of BM25. Defaults to 1.5.
+            b (float, optional): The length normalization of BM25. Defaults to 0.75.
+        """
+        if len(texts) != len(documents):
+            raise ValueError("There must be one document per chunk text.")
+        self.texts = list(texts)
+        self.documents = np.asarray(documents, dtype=object)
+        self.embedding_function = embedding_function
+        self.method = RetrievalEvaluator.EMBEDDING if embedding_function is not None else method
+        self.k1 = k1
+        self.b = b
+        # the position of each chunk by its document and the text the QA pairs refer to
+        self._chunk_positions = {}
+        for position, (document, key) in enumerate(zip(documents, keys if keys is not None else texts)):
+            self._chunk_positions.setdefault((document, key.strip()), position)
+        # the chunk positions of each document, to find the best ranked chunk of a document
+        self._document_names, self._document_of_chunk = np.unique(self.documents.astype(str), return_inverse=True)
+
+        if self.method == RetrievalEvaluator.EMBEDDING:
+            self._chunk_vectors = self._normalize(np.asarray(embedding_function(self.texts), dtype=np.float32))
+        elif self.method in (RetrievalEvaluator.BM25, RetrievalEvaluator.TFIDF):
+            self._vocabulary = {}
+            term_counts = self._count_terms(self.texts, grow_vocabulary=True)
+            self._chunk_weights = self._weigh_chunks(term_counts)
+        else:
+            raise ValueError(f"Unknown retrieval method {method}, use 'bm25', 'tfidf' or an embedding function.")
+
+    @classmethod
+    def from_documents(cls, folder_or_paths, method=BM25, embedding_function=None, max_workers=1, **kwargs):
+        """Chunks the document twins the same way as the QA generation and indexes all their chunks.
+
+        Args:
+            folder_or_paths (str or list): A folder with document twins or a list of paths.
+            method (str, optional): "bm25" or "tfidf". Defaults to "bm25".
+            embedding_function (callable, optional): Returns the vectors of a list of texts. Defaults to None.
+            max_workers (int, optional): The number of processes chunking the documents. Defaults to 1.
+            **kwargs: The BM25 parameters k1 and b.
+
+        Returns:
+            RetrievalEvaluator: The evaluator over all chunks of the documents.
+        """
+        texts, documents, keys = [], [], []
+        for result in ingest_documents(folder_or_paths, max_chunk_size=QAPairGenerator.MAX_CHUNK_SIZE,
+                                       split_criteria=QAPairGenerator.SPLIT_CRITERIA, recursive=False, max_workers=max_workers):
+            if result.error is not None:
+                continue
+            for chunk in result.chunks:
+                texts.append(chunk.title + "\n\n" + chunk.text)
+                documents.append(result.document.file_name)
+                keys.append(chunk.text)
+        return cls(texts, documents, method, embedding_function, keys, **kwargs)
+
+    def _count_terms(self, texts, grow_vocabulary=False):
+        """Counts the terms of each text in a sparse matrix with one row per text and one column per term of the vocabulary.
+        Terms that are not in the vocabulary are left out, unless the vocabulary grows."""
+        indptr, indices = [0], []
+        for text in texts:
+            for token in tokenize_words(text):
+                index = self._vocabulary.get(token)
+                if index is None:
+                    if not grow_vocabulary:
+                        continue
+                    index = self._vocabulary[token] = len(self._vocabulary)
+                indices.append(index)
+            indptr.append(len(indices))
+        counts = sp.csr_matrix((np.ones(len(indices), dtype=np.float32), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+                               shape=(len(texts), len(self._vocabulary)))
+        # add up the repeated terms of a text
+        counts.sum_duplicates()
+        return counts
+
+    def _weigh_chunks(self, term_counts):
+        """Computes the term weights of the chunks, so the score of a question is the sum of the weights of its terms."""
+        number_chunks = term_counts.shape[0]
+        document_frequency = np.bincount(term_counts.indices, minlength=term_counts.shape[1])
+        rows = np.repeat(np.arange(number_chunks), np.diff(term_counts.indptr))
+        term_frequency = term_counts.data
+
+        if self.method == RetrievalEvaluator.BM25:
+            self._idf = np.log(1 + (number_chunks - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+            lengths = np.asarray(term_counts.sum(axis=1)).ravel()
+            length_ratio = lengths / lengths.mean() if lengths.mean() > 0 else np.ones_like(lengths)
+            saturation = term_frequency * (self.k1 + 1) / (term_frequency + self.k1 * (1 - self.b + self.b * length_ratio[rows]))
+            weights = term_counts.copy()
+            weights.data = (saturation * self._idf[term_counts.indices]).astype(np.float32)
+            return weights
+
+        # TF-IDF with smoothed idf and unit length rows, so the score is the cosine similarity
+        self._idf = (np.log((1 + number_chunks) / (1 + document_frequency)) + 1).astype(np.float32)
+        weights = term_counts.copy()
+        weights.data = term_frequency * self._idf[term_counts.indices]
+        return self._normalize_rows(weights)
+
+    def _score(self, questions):
+        """Scores a batch of questions against all chunks.
+
+        Returns:
+            np.ndarray: The scores with one row per question and one column per chunk.
+        """
+        if self.method == RetrievalEvaluator.EMBEDDING:
+            question_vectors = self._normalize(np.asarray(self.embedding_function(list(questions)), dtype=np.float32))
+            return question_vectors @ self._chunk_vectors.T
+
+        question_terms = self._count_terms(questions)
+        if self.method == RetrievalEvaluator.BM25:
+            # BM25 counts each term of the question once
+            question_terms.data = np.ones_like(question_terms.data)
+        else:
+            question_terms.data = question_terms.data * self._idf[question_terms.indices]
+            question_terms = self._normalize_rows(question_terms)
+        return (question_terms @ self._chunk_weights.T).toarray()
+
+    def evaluate(self, qa_pairs, ks=(1, 3, 5, 10), batch_size=256):
+        """Ranks the source chunk and the source document of each QA pair.
+
+        The rank of a chunk is 1 plus the number of other chunks with the same or a higher score, so ties are ranked
+        pessimistically and a question scoring the same on all chunks does not hit. The rank of the document is 1 plus the
+        number of chunks of other documents with the same or a higher score than its best chunk, so a document hit at k
+        means that one of the first k chunks is from the source document, as in the vector search check of the curation.
+        A question whose scores are all 0, e.g. without any term in the index, is a miss with an infinite rank.
+
+        Args:
+            qa_pairs (pandas.DataFrame or list): The QA pairs with 'question', 'document' and 'chunk'.
+            ks (tuple, optional): The cut-offs of the hit rates. Defaults to (1, 3, 5, 10).
+            batch_size (int, optional): The number of questions scored in one matrix product. Defaults to 256.
+
+        Returns:
+            pandas.DataFrame: The QA pairs with the added columns 'retrieval_chunk_rank', 'retrieval_reciprocal_rank',
+            'retrieval_document_rank', 'retrieval_top_documents' and 'retrieval_hit@k' and 'retrieval_document_hit@k' for each k.
+            The chunk rank is NaN if the source chunk is not in the index, the document rank if the document is not.
+            The top documents of a question whose scores are all 0 are empty.
+        """
+        df = pd.DataFrame(qa_pairs).reset_index(drop=True) if not isinstance(qa_pairs, pd.DataFrame) else qa_pairs.reset_index(drop=True)
+        number_questions = len(df)
+        source_chunks = np.array([self._chunk_positions.get((document, str(chunk).strip()), -1)
+                                  for document, chunk in zip(df["document"], df["chunk"])], dtype=np.int64)
+        document_positions = {name: position for position, name in enumerate(self._document_names)}
+        source_documents = np.array([document_positions.get(str(document), -1) for document in df["document"]], dtype=np.int64)
+
+        chunk_ranks = np.full(number_questions, np.nan)
+        document_ranks = np.full(number_questions, np.nan)
+        top_documents = []
+        top_k = max(ks)
+        for start in range(0, number_questions, batch_size):
+            end = min(start + batch_size, number_questions)
+            scores = self._score(df["question"].iloc[start:end].astype(str).tolist())
+            rows = np.arange(end - start)
+            unmatched = ~(scores != 0).any(axis=1)
+
+            sources = source_chunks[start:end]
+            found = sources >= 0
+            source_scores = scores[rows[found], sources[found]]
+            # the source chunk itself is counted by >=, which adds the 1
+            chunk_ranks[start:end][found] = (scores[found] >= source_scores[:, None]).sum(axis=1)
+            chunk_ranks[start:end][found & unmatched] = np.inf
+
+            # the best score of the chunks of the source document
+            documents = source_documents[start:end]
+            found = documents >= 0
+            best_document_scores = np.full(end - start, -np.inf)
+            in_document = self._document_of_chunk[None, :] == documents[:, None]
+            best_document_scores[found] = np.where(in_document[found], scores[found], -np.inf).max(axis=1)
+            document_ranks[start:end][found] = ((scores[found] >= best_document_scores[found][:, None]) & ~in_document[found]).sum(axis=1) + 1
+            document_ranks[start:end][found & unmatched] = np.inf
+
+            # the documents of the first k chunks, best first
+            k = min(top_k, scores.shape[1])
+            top_chunks = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k > 0 else np.zeros((end - start, 0), dtype=np.int64)
+            top_chunks = np.take_along_axis(top_chunks, np.argsort(-np.take_along_axis(scores, top_chunks, axis=1), axis=1, kind="stable"), axis=1)
+            top_documents.extend([] if is_unmatched else list(dict.fromkeys(self.documents[row]))
+                                 for row, is_unmatched in zip(top_chunks, unmatched))
+
+        df["retrieval_chunk_rank"] = chunk_ranks
+        df["retrieval_reciprocal_rank"] = np.nan_to_num(1 / chunk_ranks, nan=0.0)
+        df["retrieval_document_rank"] = document_ranks
+        df["retrieval_top_documents"] = top_documents
+        for k in ks:
+            df[f"retrieval_hit@{k}"] = chunk_ranks <= k
+            df[f"retrieval_document_hit@{k}"] = document_ranks <= k
+        return df
+
+    @staticmethod
+    def summarize(results, ks=(1, 3, 5, 10)):
+        """Aggregates the evaluated QA pairs of a run.
+
+        Args:
+            results (pandas.DataFrame): The result of evaluate.
+            ks (tuple, optional): The cut-offs of the hit rates. Defaults to (1, 3, 5, 10).
+
+        Returns:
+            dict: The share of QA pairs with a chunk and a document hit at each k, the mean reciprocal rank of the source chunk
+            and the share of QA pairs whose source chunk is not in the index.
+        """
+        summary = {"questions": len(results), "mrr": float(results["retrieval_reciprocal_rank"].mean())}
+        for k in ks:
+            summary[f"hit@{k}"] = float(results[f"retrieval_hit@{k}"].mean())
+            summary[f"document_hit@{k}"] = float(results[f"retrieval_document_hit@{k}"].mean())
+        summary["missing_source_chunks"] = float(results["retrieval_chunk_rank"].isna().mean())
+        return summary
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+    @staticmethod
+    def _normalize_rows(matrix):
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        return sp.diags(1 / np.where(norms > 0, norms, 1)) @ matrix
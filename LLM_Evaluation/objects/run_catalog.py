@@ -0,0 +1,288 @@
+"""
+In this module, we define the RunCatalog class. It is an index of the runs in a base folder and the outputs each stage
+wrote, so the latest run and the inputs of a run are looked up in a SQLite database instead of listing the folder and
+parsing the run timestamps out of the file names.
+"""
+import os
+import re
+import json
+import time
+import threading
+from datetime import datetime
+import pyarrow.parquet as pq
+from objects.utils import utils
+from objects.utils.utils import connect_sqlite
+
+# the file name of a result parquet ends with the run timestamp, e.g. "question_answer_pairs_20240928203654.parquet"
+RUN_FILE_PATTERN = re.compile(r"^(?P<prefix>.+)_(?P<run>\d{14})\.parquet$")
+RUN_ID_FORMAT = "%Y%m%d%H%M%S"
+
+
+class RunCatalog:
+    """A catalog of the runs in a base folder and their outputs, stored in a SQLite database in the base folder.
+
+    A run is identified by its id, the timestamp of the notebooks, and may have a parent run whose outputs it read,
+    e.g. the ProductAI run of a QA generation run. Each stage registers its outputs with their document, path and
+    number of rows. The combined output of a stage has the document ALL_DOCUMENTS.
+
+    The base folders are on mounted network volumes, so the database uses the rollback journal of SQLite instead of
+    the write-ahead log, which does not work on network file systems.
+
+    Attributes:
+        base_folder (str): The folder of the runs.
+        path (str): The path to the SQLite database file in the base folder.
+    """
+
+    FILE_NAME = "run_catalog.sqlite"
+
+    # the stages of the evaluation pipeline
+    QA_GENERATION = "qa_generation"
+    PRODUCTAI = "productai"
+    EVALUATION = "evaluation"
+    CURATION = "curation"
+
+    ALL_DOCUMENTS = ""
+
+    # the file name prefixes of the notebooks and their stages, used to import existing folders
+    FILE_PREFIXES = {
+        "question_answer_pairs": QA_GENERATION,
+        "question_answer_pairs+product_ai_answers": PRODUCTAI,
+        "question_answer_pairs+productai_answers": PRODUCTAI,
+        "question_answer_pairs+productai_answers+evaluation_results": EVALUATION,
+        "curated_results": CURATION,
+    }
+
+    def __init__(self, base_folder, file_name=FILE_NAME):
+        """
+        Args:
+            base_folder (str): The folder of the runs, e.g. the date folder of the notebooks. It is created if it does not exist.
+            file_name (str, optional): The file name of the database in the base folder. Defaults to FILE_NAME.
+        """
+        self.base_folder = base_folder
+        self.path = os.path.join(base_folder, file_name)
+        # the writers of a stage may register their outputs from several threads
+        self._lock = threading.Lock()
+        self._connection = connect_sqlite(self.path)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run TEXT PRIMARY KEY,
+                parent_run TEXT,
+                metadata TEXT,
+                created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS outputs (
+                run TEXT,
+                stage TEXT,
+                document TEXT,
+                path TEXT,
+                row_count INTEGER,
+                updated_at REAL,
+                PRIMARY KEY (run, stage, document)
+            );
+            CREATE INDEX IF NOT EXISTS outputs_by_stage ON outputs (stage, run);
+            CREATE INDEX IF NOT EXISTS runs_by_parent ON runs (parent_run);""")
+        self._connection.commit()
+
+    @staticmethod
+    def new_run_id():
+        """Returns a run id from the current time, in the timestamp format of the notebooks."""
+        return utils.get_current_datetime_as_str(str_format=RUN_ID_FORMAT)
+
+    @staticmethod
+    def _run_time(run):
+        """Returns the start time of a run from its timestamp id, so imported runs are ordered by their start and not by
+        their import, or the current time for other ids."""
+        try:
+            return datetime.strptime(run, RUN_ID_FORMAT).timestamp()
+        except ValueError:
+            return time.time()
+
+    def register_run(self, run=None, parent_run=None, metadata=None):
+        """Registers a run. Registering a run again updates its parent run and metadata if they are given.
+
+        Args:
+            run (str, optional): The run id. Defaults to a new run id from the current time.
+            parent_run (str, optional): The run whose outputs the run read. Defaults to None.
+            metadata (dict, optional): JSON-serializable information on the run, e.g. the models. Defaults to None.
+
+        Returns:
+            str: The run id.
+        """
+        run = run or self.new_run_id()
+        metadata = json.dumps(metadata, ensure_ascii=False) if metadata is not None else None
+        with self._lock:
+            self._connection.execute("""
+                INSERT INTO runs VALUES (?, ?, ?, ?)
+                ON CONFLICT (run) DO UPDATE SET
+                    parent_run = COALESCE(excluded.parent_run, parent_run), metadata = COALESCE(excluded.metadata, metadata)""",
+                (run, parent_run, metadata, self._run_time(run)))
+            self._connection.commit()
+        return run
+
+    def register(self, run, stage, path, document=ALL_DOCUMENTS, row_count=None, parent_run=None):
+        """Registers an output of a stage of a run, and the run if it is not registered yet.
+        Registering the same run, stage and document again replaces the output.
+
+        Args:
+            run (str): The run id.
+            stage (str): The stage, e.g. RunCatalog.PRODUCTAI.
+            path (str): The path of the output file or folder.
+            document (str, optional): The document of the output. Defaults to ALL_DOCUMENTS, the combined output.
+            row_count (int, optional): The number of rows. Defaults to the number of rows in the metadata of a parquet file.
+            parent_run (str, optional): The run whose outputs the run read. Defaults to None.
+        """
+        if row_count is None and os.path.isfile(path) and path.endswith(".parquet"):
+            row_count = pq.read_metadata(path).num_rows
+        self.register_run(run, parent_run)
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)",
+                                     (run, stage, document or RunCatalog.ALL_DOCUMENTS, path, row_count, time.time()))
+            self._connection.commit()
+
+    def latest_run(self, stage=None):
+        """Returns the latest run, or the latest run with outputs of a stage.
+
+        Args:
+            stage (str, optional): The stage. Defaults to None, any run.
+
+        Returns:
+            str: The run id or None if there is no such run.
+        """
+        with self._lock:
+            if stage is None:
+                row = self._connection.execute("SELECT run FROM runs ORDER BY created_at DESC, run DESC LIMIT 1").fetchone()
+            else:
+                row = self._connection.execute("""
+                    SELECT runs.run FROM runs JOIN (SELECT DISTINCT run FROM outputs WHERE stage = ?) AS staged USING (run)
+                    ORDER BY runs.created_at DESC, runs.run DESC LIMIT 1""", (stage,)).fetchone()
+        return row[0] if row is not None else None
+
+    def runs(self):
+        """Returns all runs, oldest first.
+
+        Returns:
+            list: A dict per run with its 'run', 'parent_run', 'metadata' and 'created_at'.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT run, parent_run, metadata, created_at FROM runs ORDER BY created_at, run").fetchall()
+        return [{"run": run, "parent_run": parent_run, "metadata": json.loads(metadata) if metadata is not None else None,
+                 "created_at": created_at} for run, parent_run, metadata, created_at in rows]
+
+    def outputs(self, run, stage=None, document=None):
+        """Returns the registered outputs of a run.
+
+        Args:
+            run (str): The run id.
+            stage (str, optional): Only the outputs of this stage. Defaults to all stages.
+            document (str, optional): Only the outputs of this document, ALL_DOCUMENTS for the combined outputs. Defaults to all outputs.
+
+        Returns:
+            list: A dict per output with its 'run', 'stage', 'document', 'path' and 'row_count'.
+        """
+        query = "SELECT run, stage, document, path, row_count FROM outputs WHERE run = ?"
+        parameters = [run]
+        if stage is not None:
+            query += " AND stage = ?"
+            parameters.append(stage)
+        if document is not None:
+            query += " AND document = ?"
+            parameters.append(document)
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY stage, document", parameters).fetchall()
+        return [dict(zip(("run", "stage", "document", "path", "row_count"), row)) for row in rows]
+
+    def get_path(self, run, stage, document=ALL_DOCUMENTS):
+        """Returns the path of an output, by default the combined output of a stage, or None if it is not registered."""
+        outputs = self.outputs(run, stage, document)
+        return outputs[0]["path"] if outputs else None
+
+    def documents(self, run, stage):
+        """Returns the documents with a registered output in a stage of a run, e.g. to skip them when the stage is restarted."""
+        return [output["document"] for output in self.outputs(run, stage) if output["document"] != RunCatalog.ALL_DOCUMENTS]
+
+    def lineage(self, run):
+        """Returns a run and its ancestors, following the parent runs.
+
+        Args:
+            run (str): The run id.
+
+        Returns:
+            list: The run ids, starting with the run and ending with the run without a parent.
+        """
+        with self._lock:
+            rows = self._connection.execute("""
+                WITH RECURSIVE ancestors (run, parent_run, depth) AS (
+                    SELECT run, parent_run, 0 FROM runs WHERE run = ?
+                    UNION
+                    SELECT runs.run, runs.parent_run, ancestors.depth + 1 FROM runs JOIN ancestors ON runs.run = ancestors.parent_run
+                    WHERE ancestors.depth < 100
+                )
+                SELECT run FROM ancestors ORDER BY depth""", (run,)).fetchall()
+        return [row[0] for row in rows]
+
+    def children(self, run):
+        """Returns the runs whose parent is the given run, oldest first."""
+        with self._lock:
+            rows = self._connection.execute("SELECT run FROM runs WHERE parent_run = ? ORDER BY created_at, run", (run,)).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self, run):
+        """Returns the number of documents and rows of each stage of a run.
+
+        Returns:
+            dict: Maps each stage to a dict with the number of 'documents' and the number of 'rows' of the per-document outputs,
+            or of the combined output if the stage has no per-document outputs.
+        """
+        stats = {}
+        for output in self.outputs(run):
+            stage = stats.setdefault(output["stage"], {"documents": 0, "rows": 0, "combined_rows": None})
+            if output["document"] == RunCatalog.ALL_DOCUMENTS:
+                stage["combined_rows"] = output["row_count"]
+            else:
+                stage["documents"] += 1
+                stage["rows"] += output["row_count"] or 0
+        for stage in stats.values():
+            combined_rows = stage.pop("combined_rows")
+            if stage["documents"] == 0 and combined_rows is not None:
+                stage["rows"] = combined_rows
+        return stats
+
+    def import_folder(self, folder=None):
+        """Registers the result parquets of the notebooks in a date folder, once, so existing runs can be looked up.
+
+        The combined parquets are named "<prefix>_<run>.parquet" and the per-document parquets "<run>/<prefix>_<document>.parquet".
+        The run is taken from the end of the file name and the stage from the longest matching prefix in FILE_PREFIXES,
+        so document names may contain underscores.
+
+        Args:
+            folder (str, optional): The date folder. Defaults to the base folder.
+
+        Returns:
+            int: The number of registered outputs.
+        """
+        folder = folder or self.base_folder
+        prefixes = sorted(RunCatalog.FILE_PREFIXES, key=len, reverse=True)
+        number_outputs = 0
+        for file_name in sorted(os.listdir(folder)):
+            match = RUN_FILE_PATTERN.match(file_name)
+            stage = RunCatalog.FILE_PREFIXES.get(match.group("prefix")) if match else None
+            if stage is None:
+                continue
+            run = match.group("run")
+            self.register(run, stage, os.path.join(folder, file_name))
+            number_outputs += 1
+            run_folder = os.path.join(folder, run)
+            if not os.path.isdir(run_folder):
+                continue
+            for document_file in sorted(os.listdir(run_folder)):
+                prefix = next((prefix for prefix in prefixes if document_file.startswith(prefix + "_")), None)
+                if prefix is None or RunCatalog.FILE_PREFIXES[prefix] != stage or not document_file.endswith(".parquet"):
+                    continue
+                document = document_file[len(prefix) + 1:-len(".parquet")]
+                self.register(run, stage, os.path.join(run_folder, document_file), document)
+                number_outputs += 1
+        return number_outputs
+
+    def close(self):
+        """Closes the connection to the database."""
+        self._connection.close()
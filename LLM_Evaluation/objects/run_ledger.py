@@ -0,0 +1,185 @@
+"""
+In this module, we define the RunLedger class. It records the result of every item of a run as soon as it completes,
+e.g. the QA pairs of a chunk, a ProductAI answer or an evaluation, so a crashed or interrupted stage can be restarted
+and continues exactly where it stopped instead of repeating whole documents.
+"""
+import os
+import json
+import time
+import threading
+import traceback
+from objects.utils.utils import connect_sqlite
+
+
+class RunLedger:
+    """A durable record of the completed and failed items of a run, stored in a SQLite database in the run folder.
+
+    Each item is identified by its stage and a stable key, e.g. built with batch_job.make_custom_id from the
+    inputs of the item. Results are stored as JSON.
+
+    The run folders are on mounted network volumes, so the database uses the rollback journal of SQLite instead of
+    the write-ahead log, which does not work on network file systems.
+
+    Attributes:
+        path (str): The path to the SQLite database file.
+    """
+
+    FILE_NAME = "run_ledger.sqlite"
+
+    # the stages of the evaluation pipeline
+    QA_GENERATION = "qa_generation"
+    PRODUCTAI = "productai"
+    EVALUATION = "evaluation"
+
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, run_folder, file_name=FILE_NAME):
+        """
+        Args:
+            run_folder (str): The folder of the run, e.g. the timestamp folder of the notebooks. It is created if it does not exist.
+            file_name (str, optional): The file name of the database in the run folder. Defaults to FILE_NAME.
+        """
+        self.path = os.path.join(run_folder, file_name)
+        # the connection is shared by the worker threads of the async generation, so access is serialized by a lock
+        self._lock = threading.Lock()
+        self._connection = connect_sqlite(self.path)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                stage TEXT,
+                key TEXT,
+                status TEXT,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER,
+                updated_at REAL,
+                PRIMARY KEY (stage, key)
+            )""")
+        self._connection.commit()
+
+    def get(self, stage, key):
+        """Looks up the result of a completed item.
+
+        Args:
+            stage (str): The stage of the item.
+            key (str): The key of the item.
+
+        Returns:
+            The stored result or None if the item has not been completed.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT result FROM items WHERE stage = ? AND key = ? AND status = ?", (stage, key, RunLedger.DONE)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def is_done(self, stage, key):
+        """Checks if an item has been completed.
+
+        Args:
+            stage (str): The stage of the item.
+            key (str): The key of the item.
+
+        Returns:
+            bool: True if the item has been completed.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM items WHERE stage = ? AND key = ? AND status = ?", (stage, key, RunLedger.DONE)).fetchone()
+        return row is not None
+
+    def record(self, stage, key, result):
+        """Records the result of a completed item. The result is committed before this method returns.
+
+        Args:
+            stage (str): The stage of the item.
+            key (str): The key of the item.
+            result: The JSON-serializable result of the item.
+        """
+        self._write(stage, key, RunLedger.DONE, json.dumps(result, ensure_ascii=False), None)
+
+    def record_error(self, stage, key, error):
+        """Records that an item failed, so it is retried by the next run of the stage.
+
+        Args:
+            stage (str): The stage of the item.
+            key (str): The key of the item.
+            error (str): The error message or traceback.
+        """
+        self._write(stage, key, RunLedger.FAILED, None, str(error))
+
+    def _write(self, stage, key, status, result, error):
+        with self._lock:
+            self._connection.execute("""
+                INSERT INTO items VALUES (?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (stage, key) DO UPDATE SET
+                    status = excluded.status, result = excluded.result, error = excluded.error,
+                    attempts = attempts + 1, updated_at = excluded.updated_at""",
+                (stage, key, status, result, error, time.time()))
+            self._connection.commit()
+
+    def run(self, stage, key, function):
+        """Returns the recorded result of an item or computes and records it. Errors are recorded and raised again.
+
+        Args:
+            stage (str): The stage of the item.
+            key (str): The key of the item.
+            function (callable): Computes the JSON-serializable result of the item without arguments.
+
+        Returns:
+            The result of the item.
+        """
+        result = self.get(stage, key)
+        if result is not None:
+            return result
+        try:
+            result = function()
+        except Exception:
+            self.record_error(stage, key, traceback.format_exc())
+            raise
+        self.record(stage, key, result)
+        return result
+
+    def completed(self, stage):
+        """Returns the results of all completed items of a stage.
+
+        Args:
+            stage (str): The stage of the items.
+
+        Returns:
+            dict: Maps the keys of the completed items to their results.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, result FROM items WHERE stage = ? AND status = ?", (stage, RunLedger.DONE)).fetchall()
+        return {key: json.loads(result) for key, result in rows}
+
+    def failed(self, stage):
+        """Returns the errors of all failed items of a stage.
+
+        Args:
+            stage (str): The stage of the items.
+
+        Returns:
+            dict: Maps the keys of the failed items to their last error.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, error FROM items WHERE stage = ? AND status = ?", (stage, RunLedger.FAILED)).fetchall()
+        return dict(rows)
+
+    def stats(self):
+        """Returns the number of completed and failed items per stage.
+
+        Returns:
+            dict: Maps each stage to a dict with the number of items per status.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT stage, status, COUNT(*) FROM items GROUP BY stage, status").fetchall()
+        stats = {}
+        for stage, status, count in rows:
+            stats.setdefault(stage, {})[status] = count
+        return stats
+
+    def close(self):
+        """Closes the connection to the database."""
+        self._connection.close()
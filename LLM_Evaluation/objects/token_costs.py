@@ -0,0 +1,144 @@
+"""
+Functions to count the tokens of the texts of a run and to calculate the costs of the LLM calls.
+The encoder is created once per model, every distinct text is encoded once and whole columns are encoded in
+batches across threads, so counting the tokens of a results parquet takes seconds.
+"""
+from functools import lru_cache
+import pandas as pd
+import tiktoken
+
+# pricing from https://azure.microsoft.com/en-us/pricing/details/cognitive-services/openai-service/
+MODELS = {
+    'MODEL_GPT4o': {
+        "endpoint": "https://appprodsagopenaigpt4weu.openai.azure.com/openai/deployments/gpt-4o-cad-extraction/chat/completions?api-version=2024-02-15-preview",
+        "prompt_token_cost": 0.0047/1000,
+        "completion_token_cost": 0.0139/1000
+    },
+    'MODEL_GPT4o_mini': {
+        "endpoint": "https://appprodsagopenaigpt4weu.openai.azure.com/openai/deployments/evaluation_gpt4o-mini/chat/completions?api-version=2023-03-15-preview",
+        "prompt_token_cost": 0.00014/1000,
+        "completion_token_cost": 0.0006/1000
+    }
+    # Add more models here
+}
+
+TOKENIZER_MODEL = "gpt-4"
+
+# the text columns of the results that are sent to or returned by a model, as used by count_stage_tokens
+PROMPTED_COLUMNS = ['chunk', 'question', 'answer', 'productai_response', 'evaluation_score', 'evaluation_reasoning']
+
+
+@lru_cache(maxsize=None)
+def get_encoding(tokenizer_model=TOKENIZER_MODEL):
+    """Returns the encoding of a model, created once per model.
+
+    Args:
+        tokenizer_model (str, optional): The model whose tokenizer is used. Defaults to TOKENIZER_MODEL.
+
+    Returns:
+        tiktoken.Encoding: The encoding.
+    """
+    return tiktoken.encoding_for_model(tokenizer_model)
+
+
+@lru_cache(maxsize=1024)
+def count_tokens(text, tokenizer_model=TOKENIZER_MODEL):
+    """Counts the tokens of a text. The counts of repeated texts, e.g. prompt constants, are cached.
+
+    Args:
+        text (str): The text.
+        tokenizer_model (str, optional): The model whose tokenizer is used. Defaults to TOKENIZER_MODEL.
+
+    Returns:
+        int: The number of tokens.
+    """
+    return len(get_encoding(tokenizer_model).encode(text))
+
+
+def count_tokens_batch(texts, tokenizer_model=TOKENIZER_MODEL, num_threads=8):
+    """Counts the tokens of many texts. Each distinct text is encoded once and the texts are encoded in a batch across threads.
+
+    Args:
+        texts (list): The texts.
+        tokenizer_model (str, optional): The model whose tokenizer is used. Defaults to TOKENIZER_MODEL.
+        num_threads (int, optional): The number of threads used by tiktoken. Defaults to 8.
+
+    Returns:
+        list: The number of tokens of each text, in the order of the texts.
+    """
+    texts = list(texts)
+    # dict keeps the order of the first occurrence of each text
+    distinct_texts = list(dict.fromkeys(texts))
+    encoded_texts = get_encoding(tokenizer_model).encode_batch(distinct_texts, num_threads=num_threads)
+    token_counts = {text: len(tokens) for text, tokens in zip(distinct_texts, encoded_texts)}
+    return [token_counts[text] for text in texts]
+
+
+def count_tokens_in_dataframe(df, columns=None, tokenizer_model=TOKENIZER_MODEL, num_threads=8):
+    """Counts the tokens of each cell of a dataframe, as the text of the cell.
+
+    Args:
+        df (pandas.DataFrame): The dataframe, e.g. the results of a run.
+        columns (list, optional): The columns to count. Defaults to the PROMPTED_COLUMNS of the dataframe, so metadata such as
+            the paths, timestamps and scores of other tools are not tokenized.
+        tokenizer_model (str, optional): The model whose tokenizer is used. Defaults to TOKENIZER_MODEL.
+        num_threads (int, optional): The number of threads used by tiktoken. Defaults to 8.
+
+    Returns:
+        pandas.DataFrame: A new dataframe with the same index and the number of tokens of each cell of the columns.
+    """
+    columns = [column for column in PROMPTED_COLUMNS if column in df.columns] if columns is None else list(columns)
+    token_df = pd.DataFrame(index=df.index)
+    for column in columns:
+        token_df[column] = count_tokens_batch(df[column].astype(str), tokenizer_model, num_threads)
+    return token_df
+
+
+def calculate_costs(token_counts:dict, model:str='MODEL_GPT4o'):
+    """Calculates the costs of the given prompt and completion tokens.
+
+    Args:
+        token_counts (dict): The number of 'prompt_tokens' and 'completion_tokens'.
+        model (str, optional): The key of the model in MODELS. Defaults to 'MODEL_GPT4o'.
+
+    Returns:
+        float: The costs in euro, rounded to 4 digits.
+    """
+    completion_tokens = token_counts['completion_tokens']
+    prompt_tokens = token_counts['prompt_tokens']
+    costs_in_euro = prompt_tokens * MODELS[model]["prompt_token_cost"] + \
+            completion_tokens * MODELS[model]["completion_token_cost"]
+    return round(costs_in_euro, 4)
+
+
+def count_stage_tokens(token_df, qa_pair_prompt, evaluator_prompt, tokenizer_model=TOKENIZER_MODEL):
+    """Counts the prompt and completion tokens of the QA generation, the ProductAI prompts and the evaluation of a run.
+
+    Args:
+        token_df (pandas.DataFrame): The number of tokens of each cell of the results, as returned by count_tokens_in_dataframe.
+        qa_pair_prompt (str): The instruction sent with each chunk to generate the QA pairs.
+        evaluator_prompt (str): The instruction sent with each evaluation.
+        tokenizer_model (str, optional): The model whose tokenizer is used. Defaults to TOKENIZER_MODEL.
+
+    Returns:
+        dict: Maps each stage to its number of 'prompt_tokens', 'completion_tokens' and 'total_tokens'.
+    """
+    def token_counts(prompt_tokens, completion_tokens):
+        return {
+            'prompt_tokens': int(prompt_tokens),
+            'completion_tokens': int(completion_tokens),
+            'total_tokens': int(prompt_tokens + completion_tokens)
+        }
+
+    return {
+        'qa_pairs': token_counts(
+            count_tokens(qa_pair_prompt, tokenizer_model) * len(token_df) + token_df['chunk'].sum(),
+            token_df['question'].sum() + token_df['answer'].sum()),
+        'productai': token_counts(
+            token_df['question'].sum(),
+            token_df['productai_response'].sum()),
+        'evaluation': token_counts(
+            count_tokens(evaluator_prompt, tokenizer_model) * len(token_df) + token_df['question'].sum()
+            + token_df['answer'].sum() + token_df['productai_response'].sum(),
+            token_df['evaluation_score'].sum() + token_df['evaluation_reasoning'].sum())
+    }
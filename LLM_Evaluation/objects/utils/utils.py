@@ -1,4 +1,7 @@
+import os
+import re
 import json
+import sqlite3
 from datetime import datetime
 
 def save_dict_as_json(dict_obj, file_path):
@@ -12,4 +15,28 @@ def load_json_as_dict(file_path):
 def get_current_datetime_as_str(str_format="%Y-%m-%d, %H:%M:%S"):
     now = datetime.now()
     date_time_str = now.strftime(str_format)
-    return date_time_str
\ No newline at end of file
+    return date_time_str
+
+def connect_sqlite(path, write_ahead_log=False):
+    """Opens a SQLite database shared by several threads and creates its folder if needed.
+    The callers serialize the access to the connection with a lock.
+
+    Args:
+        path (str): The path to the SQLite database file.
+        write_ahead_log (bool, optional): Whether to use the write-ahead log, which keeps every commit on disk without
+            rewriting the database. It needs shared memory, so it must not be used on network file systems such as
+            the mounted volumes. Defaults to False.
+
+    Returns:
+        sqlite3.Connection: The connection.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False)
+    if write_ahead_log:
+        connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+def tokenize_words(text):
+    """Splits a text into lowercase word tokens."""
+    return re.findall(r"\w+", text.lower())
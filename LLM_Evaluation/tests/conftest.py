@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+import pytest
+
+# the modules are imported as in the notebooks, e.g. "from objects.results_store import ResultsStore"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+@pytest.fixture(scope="session")
+def chunking_fixture():
+    """The path of the fixture document and the chunk trees the recursive chunking produced for it before the
+    header, page and offset indexes, one per chunking configuration."""
+    with open(os.path.join(FIXTURES_FOLDER, "operating_instructions_chunks.json"), encoding="utf-8") as file:
+        expected = json.load(file)
+    return os.path.join(FIXTURES_FOLDER, "operating_instructions.md"), expected
+
+
+def split_fixture(path, config, compact=False):
+    """Reads a fixture document and splits it with a chunking configuration of the expected chunk trees."""
+    from objects.chunk_objects.chunk import MarkdownDocument
+    from objects.chunk_objects.chunk_handler import ChunkHandler
+
+    document = MarkdownDocument(path)
+    split_criteria = [criterion if criterion.startswith("#") else getattr(ChunkHandler, criterion) for criterion in config["split_criteria"]]
+    document.chunks = ChunkHandler.split_document_into_chunks(document, max_chunk_size=config["max_chunk_size"], split_criteria=split_criteria,
+                                                              recursive=config["recursive"], compact=compact)
+    return document
+
+
+def flatten_chunk_tree(node, depth=0):
+    """The depth, level, page number, title and text of the chunks of a tree in pre-order, as in the expected chunk trees."""
+    chunks = []
+    for chunk in node.chunks or []:
+        chunks.append({"depth": depth, "level": chunk.chunk_level, "page": chunk.page_number, "title": chunk.title, "text": chunk.text})
+        chunks.extend(flatten_chunk_tree(chunk, depth + 1))
+    return chunks
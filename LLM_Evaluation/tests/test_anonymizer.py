@@ -0,0 +1,41 @@
+import hashlib
+import pyarrow as pa
+import pyarrow.parquet as pq
+from objects.anonymizer import anonymize_array, anonymize_folder
+
+
+def sha256(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def test_missing_values_are_kept():
+    hashed = anonymize_array(pa.array(["yes", None, "yes"]))
+
+    assert hashed.to_pylist() == [sha256("yes"), None, sha256("yes")]
+
+
+def test_column_without_values_is_kept():
+    hashed = anonymize_array(pa.chunked_array([pa.nulls(2)]))
+
+    assert hashed.type == pa.null()
+    assert hashed.to_pylist() == [None, None]
+
+
+def test_folder_is_anonymized_row_group_by_row_group(tmp_path):
+    table = pa.table({
+        "question": ["Is it sterile?", "Is it sterile?", "What is the pore size?"],
+        "answer": ["Yes.", None, "0.2 µm"],
+        "evaluation_reasoning": pa.nulls(3),
+        "evaluation_score": [5, 4, 3],
+    })
+    pq.write_table(table, tmp_path / "curated_results_240928.parquet", row_group_size=2)
+    pq.write_table(table, tmp_path / "other_results.parquet")
+
+    paths = anonymize_folder(str(tmp_path), max_workers=1)
+
+    assert paths == [str(tmp_path / "complete_anonymized_results_240928.parquet")]
+    anonymized = pq.read_table(paths[0])
+    assert anonymized.column("question").to_pylist() == [sha256("Is it sterile?"), sha256("Is it sterile?"), sha256("What is the pore size?")]
+    assert anonymized.column("answer").to_pylist() == [sha256("Yes."), None, sha256("0.2 µm")]
+    assert anonymized.column("evaluation_reasoning").to_pylist() == [None, None, None]
+    assert anonymized.column("evaluation_score").to_pylist() == [5, 4, 3]
@@ -0,0 +1,52 @@
+import json
+import pytest
+
+pytest.importorskip("datasets")
+from benchmarks.fake_server import FakeLLMServer
+from objects.batch_job import write_batch_file, read_batch_file, read_batch_results, answer_batch_file
+from objects.evaluator import Evaluator
+from objects.llm_client import LLMClient
+
+ROWS = [
+    ("Is the filter compatible with ethanol?", "Yes.", "Yes, it is compatible."),
+    ("What is the pore size?", "0.2 µm", "The pore size is 0.2 µm."),
+    ("Is the filter compatible with ethanol?", "Yes.", "Yes, it is compatible."),
+]
+
+
+def test_identical_rows_share_one_request():
+    batch_requests = Evaluator.build_batch_requests(ROWS, "evaluation_gpt4o")
+
+    assert len(batch_requests) == 2
+    assert len({batch_request["custom_id"] for batch_request in batch_requests}) == 2
+
+
+def test_batch_round_trip_with_the_fake_server(tmp_path):
+    batch_requests = Evaluator.build_batch_requests(ROWS, "evaluation_gpt4o")
+    input_path, output_path = str(tmp_path / "batch.jsonl"), str(tmp_path / "results.jsonl")
+
+    assert write_batch_file(batch_requests, input_path) == 2
+    assert read_batch_file(input_path) == batch_requests
+
+    with FakeLLMServer() as server:
+        answer_batch_file(input_path, output_path, LLMClient("key", base_url=server.base_url))
+    evaluations = Evaluator.ingest_batch_results(ROWS, read_batch_results(output_path))
+
+    assert all(evaluation["score"] in {"1", "2", "3", "4", "5"} for evaluation in evaluations)
+    assert evaluations[0] == evaluations[2]
+
+
+def test_failed_batch_requests_are_ingested_as_none(tmp_path):
+    batch_requests = Evaluator.build_batch_requests(ROWS[:2], "evaluation_gpt4o")
+    output_path = tmp_path / "results.jsonl"
+    content = str({"score": "4", "reasoning": "Mostly correct."})
+    lines = [
+        {"custom_id": batch_requests[0]["custom_id"], "error": None,
+         "response": {"status_code": 200, "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}}},
+        {"custom_id": batch_requests[1]["custom_id"], "error": {"message": "rate limited"}, "response": None},
+    ]
+    output_path.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+
+    evaluations = Evaluator.ingest_batch_results(ROWS[:2], read_batch_results(str(output_path)))
+
+    assert evaluations == [{"score": "4", "reasoning": "Mostly correct."}, None]
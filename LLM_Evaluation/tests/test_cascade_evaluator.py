@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("scipy")
+pytest.importorskip("datasets")
+from objects.cascade_evaluator import CascadeEvaluator, is_negated
+
+
+@pytest.fixture
+def evaluator(monkeypatch):
+    evaluator = CascadeEvaluator("model", "key", client=object())
+    # the judge scores every row it gets with 3, so the tests see which rows were sent to it
+    monkeypatch.setattr(evaluator, "_judge", lambda rows: [{"score": 3, "reasoning": "judged"} for _ in rows])
+    return evaluator
+
+
+def evaluate(evaluator, answer, response):
+    df = pd.DataFrame([{"question": "q", "answer": answer, "productai_response": response}])
+    return evaluator.evaluate(df).iloc[0]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("The filter is not compatible with ethanol.", True),
+    ("The filter cannot be autoclaved.", True),
+    ("No.", True),
+    ("The housing isn't rated for steam.", True),
+    ("The filter is compatible with ethanol.", False),
+    ("Notice the nominal pore size.", False),
+])
+def test_is_negated(text, expected):
+    assert is_negated(text) == expected
+
+
+def test_near_match_is_accepted_locally(evaluator):
+    row = evaluate(evaluator, "The filter is compatible with ethanol.", "The filter is compatible with ethanol.")
+
+    assert row["evaluation_source"] == CascadeEvaluator.LOCAL
+    assert row["evaluation_score"] == 5
+
+
+def test_contradiction_goes_to_the_judge(evaluator):
+    row = evaluate(evaluator, "The filter is compatible with ethanol.", "The filter is not compatible with ethanol.")
+
+    assert row["local_score"] >= evaluator.accept_threshold
+    assert not row["polarity_match"]
+    assert row["evaluation_source"] == CascadeEvaluator.JUDGE
+    assert row["evaluation_score"] == 3
+
+
+def test_short_true_answer_is_not_rejected_locally(evaluator):
+    row = evaluate(evaluator, "No.", "The filter cannot be autoclaved.")
+
+    assert row["local_score"] <= evaluator.reject_threshold
+    assert row["evaluation_source"] == CascadeEvaluator.JUDGE
+
+
+def test_unrelated_response_is_rejected_locally(evaluator):
+    row = evaluate(evaluator, "Polyethersulfone membranes are used.", "Please contact our customer service.")
+
+    assert row["evaluation_source"] == CascadeEvaluator.LOCAL
+    assert row["evaluation_score"] == 1
+
+
+def test_empty_response_is_rejected_locally(evaluator):
+    row = evaluate(evaluator, "No.", "")
+
+    assert row["evaluation_source"] == CascadeEvaluator.LOCAL
+    assert row["evaluation_score"] == 1
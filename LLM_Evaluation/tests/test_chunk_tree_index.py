@@ -0,0 +1,52 @@
+import pytest
+from objects.chunk_objects.chunk import MarkdownDocument
+from objects.chunk_objects.chunk_handler import ChunkHandler
+
+MARKDOWN = """[PAGE 1]
+
+# Filter Guide
+
+Page 1 introduction.
+
+## Compatibility
+
+The filter is compatible with ethanol.
+
+## Sterilization
+
+[PAGE 2]
+
+The filter can be autoclaved at 121 °C.
+
+### Cycles
+
+Up to 5 cycles of 30 minutes.
+"""
+
+
+def summarize(chunks):
+    return [(chunk.title, chunk.text, chunk.chunk_level, chunk.page_number) for chunk in chunks]
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / "guide.md"
+    path.write_text(MARKDOWN, encoding="utf-8")
+    return MarkdownDocument(str(path))
+
+
+def test_unchunked_document_is_its_own_atom_chunk(document):
+    document.chunks = []
+
+    assert summarize(document.build_tree_index().get_atom_chunks()) == summarize(document.get_atom_chunks())
+    assert len(document.build_tree_index().get_atom_chunks()) == 1
+
+
+def test_atom_chunks_match_the_recursive_traversal(document):
+    document.chunks = ChunkHandler.split_document_into_chunks(document, max_chunk_size=40, split_criteria=ChunkHandler.MARKDOWN_HEADINGS)
+    tree_index = document.build_tree_index()
+
+    assert tree_index.get_atom_chunks() == document.get_atom_chunks()
+    for chunk in tree_index.get_subtree()[1:]:
+        if chunk.chunks:
+            assert tree_index.get_atom_chunks(chunk) == chunk.get_atom_chunks()
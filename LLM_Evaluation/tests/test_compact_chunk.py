@@ -0,0 +1,43 @@
+import pytest
+from conftest import split_fixture, flatten_chunk_tree
+from objects.chunk_objects.chunk import CompactChunk
+
+CONFIGS = ["markdown_headings", "all_criteria", "all_criteria_small", "first_level"]
+
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_compact_chunk_tree_matches_the_recursive_splitting(chunking_fixture, name):
+    path, expected = chunking_fixture
+    expected_chunking = expected["chunkings"][name]
+
+    document = split_fixture(path, expected_chunking["config"], compact=True)
+
+    assert flatten_chunk_tree(document) == expected_chunking["chunks"]
+    assert any(isinstance(chunk, CompactChunk) for chunk in document.build_tree_index().get_subtree()[1:])
+
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_compact_chunks_behave_like_chunks(chunking_fixture, name):
+    path, expected = chunking_fixture
+    config = expected["chunkings"][name]["config"]
+
+    chunks = split_fixture(path, config).build_tree_index().get_subtree()[1:]
+    compact_chunks = split_fixture(path, config, compact=True).build_tree_index().get_subtree()[1:]
+
+    assert len(compact_chunks) == len(chunks)
+    for chunk, compact_chunk in zip(chunks, compact_chunks):
+        assert compact_chunk.len == chunk.len
+        assert compact_chunk.chunk_pos == chunk.chunk_pos
+        assert compact_chunk.context == chunk.context
+        assert compact_chunk.get_chunk_metadata("2024-09-17") == chunk.get_chunk_metadata("2024-09-17")
+
+
+def test_compact_chunk_has_no_instance_dict(chunking_fixture):
+    path, expected = chunking_fixture
+    document = split_fixture(path, expected["chunkings"]["all_criteria"]["config"], compact=True)
+
+    compact_chunk = next(chunk for chunk in document.build_tree_index().get_subtree()[1:] if isinstance(chunk, CompactChunk))
+
+    assert not hasattr(compact_chunk, "__dict__")
+    # the text is a slice of the text of the document instead of a copy made when the chunk was created
+    assert compact_chunk.source_text is document.text
@@ -0,0 +1,28 @@
+import os
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from objects.chunk_objects import corpus_ingestion
+from objects.chunk_objects.corpus_ingestion import IngestionResult, ingest_documents
+
+pytestmark = pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(),
+                                reason="the workers must inherit the patched chunk_document")
+
+
+def _chunk_or_exit(path, *args):
+    # kills the worker process like the out-of-memory killer
+    if "crash" in path:
+        os._exit(1)
+    return IngestionResult(path)
+
+
+def test_only_the_documents_that_kill_a_worker_fail(monkeypatch):
+    monkeypatch.setattr(corpus_ingestion, "chunk_document", _chunk_or_exit)
+    monkeypatch.setattr(corpus_ingestion, "ProcessPoolExecutor", partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context("fork")))
+    paths = [f"/documents/{name}.md" for name in ("a", "b", "crash_c", "d", "e", "f", "crash_g", "h")]
+
+    results = list(ingest_documents(paths, max_workers=2, max_in_flight=4))
+
+    assert sorted(result.path for result in results) == sorted(paths)
+    assert sorted(result.path for result in results if result.error) == ["/documents/crash_c.md", "/documents/crash_g.md"]
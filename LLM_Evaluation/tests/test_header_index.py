@@ -0,0 +1,46 @@
+import re
+import pytest
+from conftest import split_fixture, flatten_chunk_tree
+from objects.chunk_objects.header_index import HeaderIndex
+from objects.chunk_objects.chunk_handler import ChunkHandler
+
+CONFIGS = ["markdown_headings", "all_criteria", "all_criteria_small", "first_level"]
+
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_chunk_tree_matches_the_recursive_splitting(chunking_fixture, name):
+    path, expected = chunking_fixture
+    expected_chunking = expected["chunkings"][name]
+
+    document = split_fixture(path, expected_chunking["config"])
+
+    assert flatten_chunk_tree(document) == expected_chunking["chunks"]
+    if "level_counts" in expected_chunking:
+        level_counts = document.calculate_number_of_chunks_for_each_level()
+        assert {str(level): count for level, count in level_counts.items()} == expected_chunking["level_counts"]
+        assert [[chunk.title, chunk.page_number] for chunk in document.get_atom_chunks()] == expected_chunking["atom_chunks"]
+
+
+@pytest.mark.parametrize("split_criterion", [*ChunkHandler.MARKDOWN_HEADINGS, ChunkHandler.split_by_bold_headers,
+                                             ChunkHandler.split_by_short_lines_that_might_be_headers])
+def test_splits_of_a_part_match_the_split_criterion(chunking_fixture, split_criterion):
+    path, _ = chunking_fixture
+    with open(path, encoding="utf-8") as file:
+        text = file.read()
+    header_index = HeaderIndex(text)
+    # a part of the text without whitespace at its ends, e.g. a chunk of the second level
+    start = text.index("## 2 Safety")
+    end = text.index("## 6 Disposal") - 2
+    part = text[start:end]
+
+    if split_criterion in ChunkHandler.MARKDOWN_HEADINGS:
+        spans = header_index.split_by_markdown_heading(split_criterion, start, end)
+        expected_splits = re.split(r"(?<!#)\n" + split_criterion + r"(?!#)", part)
+    elif split_criterion is ChunkHandler.split_by_bold_headers:
+        spans = header_index.split_by_bold_headers(start, end)
+        expected_splits = split_criterion(part)
+    else:
+        spans = header_index.split_by_short_lines_that_might_be_headers(start, end)
+        expected_splits = split_criterion(part)
+
+    assert [text[split_start:split_end] for split_start, split_end in spans] == expected_splits
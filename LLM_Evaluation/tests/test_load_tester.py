@@ -0,0 +1,42 @@
+from collections import Counter
+import pytest
+from benchmarks.fake_server import FakeLLMServer
+from objects.load_tester import ProductAILoadTester
+
+QUESTIONS = ["Is the filter compatible with ethanol?", "What is the pore size?", "How often can it be autoclaved?"]
+
+
+@pytest.fixture
+def server():
+    with FakeLLMServer(error_rates={429: 0.2, 500: 0.1}, seed=1) as server:
+        yield server
+
+
+def test_closed_loop_counts_every_request_once(server):
+    tester = ProductAILoadTester(QUESTIONS, "cookie", url=server.productai_url)
+
+    report = tester.run_closed_loop([1, 4], requests_per_level=30)
+
+    # the rejected requests are not retried, so the server answered each request of the tester exactly once
+    samples = tester.samples_dataframe()
+    assert Counter(samples["status"]) == Counter(server.counts["productai"])
+    assert set(server.counts["productai"]) == {200, 429, 500}
+    assert report["level"].tolist() == [1, 4]
+    assert report["requests"].tolist() == [30, 30]
+    for level, level_report in report.set_index("level").iterrows():
+        level_samples = samples[samples["level"] == level]
+        assert level_report["rate_429"] == pytest.approx((level_samples["status"] == 429).mean())
+        assert level_report["error_rate"] == pytest.approx((level_samples["status"] != 200).mean())
+    assert samples.loc[samples["status"] == 200, "error"].isna().all()
+    assert samples.loc[samples["status"] != 200, "error"].notna().all()
+
+
+def test_open_loop_sends_at_the_arrival_rate(server):
+    tester = ProductAILoadTester(QUESTIONS, "cookie", url=server.productai_url)
+
+    # the gap of 1/8 seconds is exact in binary, so the number of scheduled requests does not depend on rounding
+    report = tester.run_open_loop([8], duration=1, max_in_flight=4, poisson=False)
+
+    assert report["requests"].tolist() == [8]
+    assert sum(server.counts["productai"].values()) == 8
+    assert report["rate_429"].iloc[0] == pytest.approx(server.counts["productai"].get(429, 0) / 8)
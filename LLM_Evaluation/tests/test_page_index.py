@@ -0,0 +1,62 @@
+import re
+import random
+import pytest
+from conftest import split_fixture, flatten_chunk_tree
+from objects.chunk_objects.chunk import MarkdownDocument
+from objects.chunk_objects.chunk_handler import ChunkHandler
+from objects.chunk_objects.page_index import PageIndex
+
+
+@pytest.fixture(scope="module")
+def text(chunking_fixture):
+    path, _ = chunking_fixture
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+
+def random_spans(text, number_spans=2000, seed=0):
+    """Spans of the text that start and end with a character that is not whitespace, like the splits of the chunking."""
+    positions = [position for position, character in enumerate(text) if not character.isspace()]
+    rng = random.Random(seed)
+    for _ in range(number_spans):
+        start, last = sorted(rng.sample(positions, 2))
+        yield start, last + 1, rng.randint(1, 6)
+
+
+def test_page_count_and_missing_pages_match_the_document_scan(chunking_fixture):
+    path, expected = chunking_fixture
+
+    document = MarkdownDocument(path)
+
+    assert document.num_pages == expected["document"]["num_pages"]
+    assert document.page_index.get_missing_pages() == expected["document"]["missing_pages"]
+
+
+def test_chunk_page_numbers_match_the_marker_extraction(text):
+    page_index = PageIndex(text)
+
+    for start, end, current_page_number in random_spans(text):
+        _, page_numbers, starts_with_marker = ChunkHandler.extract_page_numbers(text[start:end])
+        expected = PageIndex.get_page_number_from_markers(min(page_numbers) if page_numbers else None,
+                                                          max(page_numbers) if page_numbers else None,
+                                                          starts_with_marker, current_page_number)
+        assert page_index.get_chunk_page_number(start, end, current_page_number) == expected, text[start:end]
+
+
+def test_first_line_without_markers_matches_the_regex(text):
+    for start, end, _ in random_spans(text, seed=1):
+        part = text[start:end]
+        cleaned_text = re.sub(PageIndex.PAGE_MARKER_PATTERN, '', part).strip()
+
+        assert PageIndex.get_first_line_without_markers(part) == (cleaned_text.split('\n', maxsplit=1)[0], '\n' in cleaned_text)
+
+
+@pytest.mark.parametrize("name", ["markdown_headings", "all_criteria_small"])
+def test_pages_of_the_chunk_tree_match_the_recursive_splitting(chunking_fixture, name):
+    path, expected = chunking_fixture
+    expected_chunking = expected["chunkings"][name]
+
+    for compact in (False, True):
+        document = split_fixture(path, expected_chunking["config"], compact)
+        pages = [(chunk["title"], chunk["page"]) for chunk in flatten_chunk_tree(document)]
+        assert pages == [(chunk["title"], chunk["page"]) for chunk in expected_chunking["chunks"]]
@@ -0,0 +1,99 @@
+import time
+import random
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("autogen")
+pytest.importorskip("datasets")
+from objects import pipeline_runner
+from objects.pipeline_runner import PipelineRunner
+from objects.question_deduplicator import QuestionDeduplicator
+
+# the questions of each chunk, the chunks share near-duplicates with each other and within themselves
+CHUNK_QUESTIONS = [
+    ["What is the maximum differential pressure?", "What is the maximum differential pressure ?"],
+    ["What is the maximum differential pressure?", "How long is the autoclave cycle?"],
+    ["How long is the autoclave cycle?", "Which solvents is the membrane compatible with?"],
+    ["Which solvents is the membrane compatible with?", "What is the minimum bubble point?"],
+    ["What is the minimum bubble point?", "How are used cartridges disposed of?"],
+    ["How are used cartridges disposed of?", "What is the maximum differential pressure?"],
+]
+
+
+class FakeGenerator:
+    """Generates the canned questions of each chunk after a random delay, so the workers finish in a random order."""
+
+    def __init__(self, path, model_name, api_key, client=None, ledger=None):
+        self.path = path
+        self.doc_twin = SimpleNamespace(file_path=path)
+        # the first chunk is skipped by the runner
+        self.chunks = [None] + CHUNK_QUESTIONS
+
+    def generate_qa_pairs_for_chunk(self, chunk_index, number_questions):
+        time.sleep(random.uniform(0, 0.02))
+        return [{"question": question, "answer": "answer", "chunk_index": chunk_index, "document": self.path}
+                for question in self.chunks[chunk_index]]
+
+
+class FakePrompter:
+    def prompt_productai(self, question):
+        return "response", 0.0
+
+
+class FakeEvaluator:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def evaluate_correctness(self):
+        return {"score": 5, "reasoning": "reasoning"}
+
+
+@pytest.fixture
+def run_pipeline(monkeypatch):
+    monkeypatch.setattr(pipeline_runner, "QAPairGenerator", FakeGenerator)
+    monkeypatch.setattr(pipeline_runner, "Evaluator", FakeEvaluator)
+
+    def run(generation_workers):
+        runner = PipelineRunner(["guide.md"], "model", "key", "cookie", generation_workers=generation_workers,
+                                client=object(), prompter=FakePrompter(), deduplicator=QuestionDeduplicator())
+        rows = sorted(runner.run(), key=lambda row: (row["chunk_index"], row["question"]))
+        return [(row["chunk_index"], row["question"], row["duplicate_questions"]) for row in rows]
+
+    return run
+
+
+def test_deduplication_does_not_depend_on_the_number_of_workers(run_pipeline):
+    expected = run_pipeline(generation_workers=1)
+
+    for _ in range(3):
+        assert run_pipeline(generation_workers=4) == expected
+
+
+def test_rows_record_the_dropped_questions_of_their_chunk(run_pipeline):
+    rows = run_pipeline(generation_workers=4)
+
+    assert rows == [
+        (1, "What is the maximum differential pressure?", ["What is the maximum differential pressure ?"]),
+        (2, "How long is the autoclave cycle?", []),
+        (3, "Which solvents is the membrane compatible with?", []),
+        (4, "What is the minimum bubble point?", []),
+        (5, "How are used cartridges disposed of?", []),
+    ]
+
+
+def test_failed_chunk_does_not_block_the_following_chunks(monkeypatch, run_pipeline):
+    generate = FakeGenerator.generate_qa_pairs_for_chunk
+
+    def generate_or_fail(self, chunk_index, number_questions):
+        if chunk_index == 2:
+            raise TimeoutError("The model did not answer.")
+        return generate(self, chunk_index, number_questions)
+
+    monkeypatch.setattr(FakeGenerator, "generate_qa_pairs_for_chunk", generate_or_fail)
+    runner = PipelineRunner(["guide.md"], "model", "key", "cookie", generation_workers=4,
+                            client=object(), prompter=FakePrompter(), deduplicator=QuestionDeduplicator())
+
+    rows = list(runner.run())
+
+    assert [row["chunk_index"] for row in rows if row.get("failed_stage") == PipelineRunner.GENERATION] == [2]
+    assert sorted({row["chunk_index"] for row in rows if row.get("error") is None}) == [1, 3, 4, 5]
@@ -0,0 +1,33 @@
+import pytest
+from objects.results_store import ResultsStore
+
+
+@pytest.mark.parametrize("scores, expected", [
+    # the first row group has only missing scores, so its column is null
+    ([None, None, 3, 4], [None, None, 3, 4]),
+    # the first row group has int scores, a later one a float score
+    ([3, 4, 4.5, 5], [3.0, 4.0, 4.5, 5.0]),
+    # incompatible types are kept as strings
+    ([3, 4, "n/a", None], ["3", "4", "n/a", None]),
+])
+def test_write_keeps_rows_when_column_types_drift(tmp_path, scores, expected):
+    store = ResultsStore(str(tmp_path))
+    rows = [{"question": f"q{i}", "document": "doc", "evaluation_score": score} for i, score in enumerate(scores)]
+
+    assert store.write(rows, "20240101000000", "evaluation", row_group_size=2) == len(rows)
+
+    df = store.read(["question", "evaluation_score"], run="20240101000000").sort_values("question")
+    assert df["question"].tolist() == [row["question"] for row in rows]
+    assert df["evaluation_score"].astype(object).where(df["evaluation_score"].notna(), None).tolist() == expected
+
+
+def test_write_adds_columns_of_later_rows(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    rows = [{"question": "q0", "document": "doc"}, {"question": "q1", "document": "doc"},
+            {"question": "q2", "document": "doc", "error": "timeout"}]
+
+    store.write(rows, "20240101000000", "evaluation", row_group_size=2)
+
+    df = store.read(["question", "error"], run="20240101000000").sort_values("question")
+    assert df["error"].isna().tolist() == [True, True, False]
+    assert df["error"].iloc[2] == "timeout"
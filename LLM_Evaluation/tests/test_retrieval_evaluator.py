@@ -0,0 +1,49 @@
+import math
+import pytest
+
+pytest.importorskip("scipy")
+pytest.importorskip("autogen")
+from objects.retrieval_evaluator import RetrievalEvaluator
+
+TEXTS = ["filter membrane ethanol compatibility", "autoclave sterilization cycle", "pressure drop flow rate"]
+DOCUMENTS = ["doc_a", "doc_a", "doc_b"]
+
+
+@pytest.mark.parametrize("method", [RetrievalEvaluator.BM25, RetrievalEvaluator.TFIDF])
+def test_zero_overlap_question_is_a_miss(method):
+    evaluator = RetrievalEvaluator(TEXTS, DOCUMENTS, method)
+    qa_pairs = [{"question": "What is the warranty period?", "document": "doc_a", "chunk": TEXTS[0]}]
+
+    results = evaluator.evaluate(qa_pairs, ks=(1, 3))
+
+    assert math.isinf(results["retrieval_chunk_rank"].iloc[0])
+    assert math.isinf(results["retrieval_document_rank"].iloc[0])
+    assert results["retrieval_reciprocal_rank"].iloc[0] == 0.0
+    assert not results["retrieval_hit@1"].iloc[0] and not results["retrieval_hit@3"].iloc[0]
+    assert not results["retrieval_document_hit@3"].iloc[0]
+    assert results["retrieval_top_documents"].iloc[0] == []
+
+
+def test_ties_are_ranked_pessimistically():
+    # the question matches both chunks of doc_a with the same score
+    evaluator = RetrievalEvaluator(["ethanol filter", "ethanol filter", "pressure drop"], DOCUMENTS)
+    qa_pairs = [{"question": "ethanol filter", "document": "doc_a", "chunk": "ethanol filter"}]
+
+    results = evaluator.evaluate(qa_pairs, ks=(1, 2))
+
+    assert results["retrieval_chunk_rank"].iloc[0] == 2
+    assert results["retrieval_reciprocal_rank"].iloc[0] == 0.5
+    assert not results["retrieval_hit@1"].iloc[0] and results["retrieval_hit@2"].iloc[0]
+    # the tie is within the source document, so the document is still retrieved first
+    assert results["retrieval_document_rank"].iloc[0] == 1
+
+
+def test_matching_question_ranks_its_source_chunk_first():
+    evaluator = RetrievalEvaluator(TEXTS, DOCUMENTS)
+    qa_pairs = [{"question": "How long is the autoclave cycle?", "document": "doc_a", "chunk": TEXTS[1]}]
+
+    results = evaluator.evaluate(qa_pairs, ks=(1,))
+
+    assert results["retrieval_chunk_rank"].iloc[0] == 1
+    assert results["retrieval_hit@1"].iloc[0]
+    assert results["retrieval_top_documents"].iloc[0] == ["doc_a"]
@@ -0,0 +1,32 @@
+import pandas as pd
+from objects import token_costs
+from objects.token_costs import count_tokens_in_dataframe, count_stage_tokens
+
+
+class FakeEncoding:
+    """Encodes each word as one token, so the tests do not download the tiktoken encodings."""
+
+    def encode(self, text):
+        return text.split()
+
+    def encode_batch(self, texts, num_threads=8):
+        return [self.encode(text) for text in texts]
+
+
+def test_only_the_prompted_columns_are_counted(monkeypatch):
+    monkeypatch.setattr(token_costs, "get_encoding", lambda tokenizer_model=None: FakeEncoding())
+    token_costs.count_tokens.cache_clear()
+    df = pd.DataFrame([{
+        "document": "/documents/guide.md", "chunk": "The filter is compatible with ethanol.",
+        "question": "Is the filter compatible with ethanol?", "answer": "Yes.", "productai_response": "Yes, it is.",
+        "evaluation_score": 5, "evaluation_reasoning": "Identical answers.", "timestamp": "20240928142914",
+    }])
+
+    token_df = count_tokens_in_dataframe(df)
+    stage_tokens = count_stage_tokens(token_df, "Generate questions.", "Evaluate the answer.")
+
+    assert list(token_df.columns) == token_costs.PROMPTED_COLUMNS
+    assert token_df.iloc[0].to_dict() == {"chunk": 6, "question": 6, "answer": 1, "productai_response": 3,
+                                          "evaluation_score": 1, "evaluation_reasoning": 2}
+    assert stage_tokens["qa_pairs"] == {"prompt_tokens": 8, "completion_tokens": 7, "total_tokens": 15}
+    assert stage_tokens["evaluation"] == {"prompt_tokens": 13, "completion_tokens": 3, "total_tokens": 16}